@@ -0,0 +1,172 @@
+"""
+End-to-end latency/throughput benchmarks against the in-process fake Bot API.
+
+Usage: python benchmarks/bench_e2e.py [--asks N] [--logs N] [--threads N] [--latency S]
+                                      [--error-429 P] [--error-5xx P] [--think S] [--real-limits]
+
+Reports:
+  * ask_human_and_wait latency: p50/p99 from the human's reply to the tool returning
+  * broadcast_log throughput: messages/s, sequential and concurrent
+  * many concurrent threads asking at once: total time and per-thread reply latency
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_bot_api import FakeBotAPI
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name: str, latencies: list[float]):
+    ms = [value * 1000 for value in latencies]
+    print(f"  {name:<34} n={len(ms):<5} p50={percentile(ms, 50):8.1f} ms   p99={percentile(ms, 99):8.1f} ms   max={max(ms, default=0):8.1f} ms")
+
+
+class AutoResponder:
+    """Answers every question the bot asks in a topic after `think` seconds, recording when."""
+
+    def __init__(self, fake: FakeBotAPI, think: float):
+        self.fake = fake
+        self.think = think
+        self.reply_sent: dict[int, float] = {}
+        self._tasks = set()
+        fake.on_message = self._on_message
+
+    async def _on_message(self, message: dict):
+        if "reply_markup" in message or message["text"].startswith("Q:"):
+            task = asyncio.ensure_future(self._answer(message["message_thread_id"]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _answer(self, thread_id: int):
+        await asyncio.sleep(self.think)
+        update_id = self.fake.user_reply(thread_id, f"answer for {thread_id}")
+        self.reply_sent[thread_id] = self.fake.pushed_at(update_id)
+
+
+async def open_topic(server, name: str) -> int:
+    """init_task_session, retried until it succeeds (injected faults also hit createForumTopic)."""
+    while True:
+        result = await server.init_task_session(name, new_topic=True)
+        if result.isdigit():
+            return int(result)
+
+
+async def bench_ask_latency(server, responder: AutoResponder, asks: int):
+    thread_id = await open_topic(server, "bench ask latency")
+    reply_latency, total_latency = [], []
+    for i in range(asks):
+        start = time.perf_counter()
+        answer = await server.ask_human_and_wait(str(thread_id), f"Q: question {i}", silent_mode=True)
+        end = time.perf_counter()
+        if not answer.startswith("answer"):
+            print(f"  unexpected answer: {answer}")
+            continue
+        total_latency.append(end - start)
+        reply_latency.append(end - responder.reply_sent[thread_id])
+    print("ask_human_and_wait")
+    report("reply -> tool return", reply_latency)
+    report("question -> tool return", total_latency)
+
+
+async def delivered(server):
+    """Waits for the outbox to send what broadcast_log queued, so rates count delivered messages."""
+    if server.outbox:
+        await server.outbox.drain(60)
+
+
+async def bench_broadcast(server, logs: int):
+    thread_id = await open_topic(server, "bench broadcast")
+    print("broadcast_log")
+
+    start = time.perf_counter()
+    results = [await server.broadcast_log(str(thread_id), f"log line {i} with **bold** and `code`", silent_mode=True) for i in range(logs)]
+    await delivered(server)
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for r in results if r.startswith("Error"))
+    print(f"  {'sequential':<34} {logs / elapsed:8.1f} msg/s   errors={errors}")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[server.broadcast_log(str(thread_id), f"log line {i}", silent_mode=True) for i in range(logs)])
+    await delivered(server)
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for r in results if r.startswith("Error"))
+    print(f"  {'concurrent':<34} {logs / elapsed:8.1f} msg/s   errors={errors}")
+
+
+async def bench_concurrent_threads(server, responder: AutoResponder, threads: int):
+    thread_ids = [await open_topic(server, f"bench thread {i}") for i in range(threads)]
+    finished: dict[int, float] = {}
+
+    async def ask(thread_id: int):
+        answer = await server.ask_human_and_wait(str(thread_id), "Q: next step?", silent_mode=True)
+        if answer == f"answer for {thread_id}":
+            finished[thread_id] = time.perf_counter()
+        return answer
+
+    start = time.perf_counter()
+    answers = await asyncio.gather(*[ask(t) for t in thread_ids])
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for a in answers if a.startswith("Error"))
+    mismatched = len(thread_ids) - len(finished) - failed
+    print(f"{threads} concurrent threads")
+    print(f"  {'all answered in':<34} {elapsed * 1000:8.1f} ms   wrong/lost replies={mismatched}   failed asks={failed}")
+    report("reply -> tool return", [finished[t] - responder.reply_sent[t] for t in finished])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--asks", type=int, default=20)
+    parser.add_argument("--logs", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="injected per-request latency (s)")
+    parser.add_argument("--error-429", type=float, default=0.0, help="fraction of sends answered with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="fraction of sends answered with 502")
+    parser.add_argument("--think", type=float, default=0.05, help="simulated human think time (s)")
+    parser.add_argument("--real-limits", action="store_true", help="keep Telegram's rate limits instead of lifting them")
+    args = parser.parse_args()
+
+    fake = FakeBotAPI(latency=args.latency, error_rate_429=args.error_429, error_rate_5xx=args.error_5xx, seed=1)
+    await fake.start()
+    responder = AutoResponder(fake, args.think)
+
+    # server reads its configuration at import time
+    state_dir = tempfile.mkdtemp(prefix="telegram-mcp-bench-")
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": fake.token,
+        "TELEGRAM_GROUP_ID": str(fake.chat_id),
+        "TELEGRAM_API_BASE_URL": fake.base_url,
+        "TELEGRAM_STATE_DB": os.path.join(state_dir, "state.db"),
+    })
+    if not args.real_limits:
+        os.environ.update({"TELEGRAM_RATE_GLOBAL": "100000/1", "TELEGRAM_RATE_CHAT": "100000/1", "TELEGRAM_RATE_TOPIC": "100000/1"})
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import server
+
+    print(f"fake Bot API at {fake.base_url} (latency={args.latency}s, 429={args.error_429:.0%}, 5xx={args.error_5xx:.0%})\n")
+    try:
+        await bench_ask_latency(server, responder, args.asks)
+        await bench_broadcast(server, args.logs)
+        await bench_concurrent_threads(server, responder, args.threads)
+    finally:
+        if server.outbox:
+            await server.outbox.stop()
+        await server.telegram.close()
+        await fake.stop()
+
+    print(f"\nrequests: {dict(sorted(fake.requests.items()))}, injected errors: {fake.injected_errors}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Micro-benchmark for the Markdown-to-HTML conversion and message splitting.
+
+Usage: python benchmarks/bench_formatting.py [--repeat N]
+
+Reports the conversion cost per KB of input on realistic agent logs, next to the
+previous multi-pass regex converter for comparison, plus the cost of validating the
+HTML locally and how many of the legacy converter's messages it had to repair.
+"""
+import os
+import re
+import sys
+import html
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from formatting import markdown_to_html, repair_html, split_html
+
+
+def legacy_convert_to_html(text: str) -> str:
+    """The original converter: re.split on code blocks, then five re.sub passes per segment."""
+    parts = re.split(r'(```.*?```)', text, flags=re.DOTALL)
+    html_parts = []
+    for part in parts:
+        if part.startswith('```') and part.endswith('```'):
+            content = part[3:-3].strip()
+            first_line_break = content.find('\n')
+            if first_line_break > -1 and first_line_break < 20:
+                lang_line = content[:first_line_break].strip()
+                if re.match(r'^[a-zA-Z0-9+#]+$', lang_line):
+                    content = content[first_line_break+1:]
+            html_parts.append(f'<pre>{html.escape(content)}</pre>')
+        else:
+            escaped_text = html.escape(part)
+            escaped_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', escaped_text)
+            escaped_text = re.sub(r'__(.*?)__', r'<b>\1</b>', escaped_text)
+            escaped_text = re.sub(r'_(.*?)_', r'<i>\1</i>', escaped_text)
+            escaped_text = re.sub(r'`(.*?)`', r'<code>\1</code>', escaped_text)
+            escaped_text = re.sub(r'(^|\n)[\*\-]\s+', r'\1• ', escaped_text)
+            html_parts.append(escaped_text)
+    return "".join(html_parts)
+
+
+def code_block_log(rng: random.Random) -> str:
+    lines = [f"tests/test_module_{i}.py::test_case_{j} PASSED [{j}%]" for i in range(20) for j in range(rng.randint(5, 30))]
+    return "**Test run finished**\n```text\n" + "\n".join(lines) + "\n```\nAll `pytest` checks passed."
+
+
+def bullet_list_log(rng: random.Random) -> str:
+    items = [f"- Updated **module_{i}** to use `helper_{i}()` & removed <legacy> path" for i in range(rng.randint(50, 150))]
+    return "## Summary of changes\n" + "\n".join(items)
+
+
+def diff_log(rng: random.Random) -> str:
+    hunks = []
+    for i in range(rng.randint(5, 15)):
+        body = "\n".join(f"{'+' if k % 3 else '-'}    value_{k} = compute(x, y) if x < y else None" for k in range(40))
+        hunks.append(f"@@ -{i * 40},40 +{i * 40},40 @@\n{body}")
+    return "Proposed patch:\n```diff\n" + "\n".join(hunks) + "\n```"
+
+
+def chat_log(rng: random.Random) -> str:
+    sentences = [
+        "I ran the _integration_ suite and **2 tests** failed.",
+        "The failure is in `parse_config` when the value is empty.",
+        "* Next step: fix the parser",
+        "* Then: rerun __all__ tests",
+        "Done: the build is green & ready for review.",
+    ]
+    return "\n".join(rng.choice(sentences) for _ in range(rng.randint(20, 80)))
+
+
+SCENARIOS = {
+    "code blocks": code_block_log,
+    "bullet lists": bullet_list_log,
+    "diffs": diff_log,
+    "chat": chat_log,
+}
+
+
+def bench(func, corpus: list[str], repeat: int) -> float:
+    """Returns the best time in microseconds per KB of input."""
+    total_kb = sum(len(text) for text in corpus) / 1024
+    best = min(timeit.repeat(lambda: [func(text) for text in corpus], number=1, repeat=repeat))
+    return best * 1e6 / total_kb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'scenario':<14}{'KB':>8}{'legacy µs/KB':>15}{'single-pass µs/KB':>20}{'split µs/KB':>14}"
+          f"{'validate µs/KB':>17}{'legacy repaired':>18}")
+    for name, make in SCENARIOS.items():
+        corpus = [make(rng) for _ in range(50)]
+        converted = [markdown_to_html(text) for text in corpus]
+        kb = sum(len(text) for text in corpus) / 1024
+        legacy = bench(legacy_convert_to_html, corpus, args.repeat)
+        current = bench(markdown_to_html, corpus, args.repeat)
+        split = bench(split_html, converted, args.repeat)
+        validate = bench(repair_html, converted, args.repeat)
+        # Messages the old converter produced that Telegram would have rejected (one wasted round trip each)
+        repaired = sum(1 for text in corpus if repair_html(legacy_convert_to_html(text))[1])
+        print(f"{name:<14}{kb:>8.0f}{legacy:>15.1f}{current:>20.1f}{split:>14.1f}{validate:>17.1f}{repaired:>13}/{len(corpus)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Start-up time of the entry points, measured in fresh processes against the fake Bot API.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--lines N] [--budget MS]
+
+Reports the best and median wall time of:
+  * importing telegram_handler (the plain client) and server (the MCP server)
+  * tg_send.py sending one message, start to exit
+  * tg_send.py streaming --lines lines from stdin over one connection
+Exits with status 1 if sending one message with tg_send.py takes longer than --budget.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_bot_api import FakeBotAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sending one message should cost less than importing the MCP server alone (~1s); most of
+# it is interpreter start-up, importing httpx and building its TLS context
+STARTUP_BUDGET_MS = 600
+
+
+async def run(argv: list[str], env: dict, stdin: bytes = None) -> float:
+    """Runs a command to completion and returns its wall time in seconds."""
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *argv, cwd=ROOT, env=env,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate(stdin)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(argv)} exited with {process.returncode}: {stderr.decode()[-500:]}")
+    return elapsed
+
+
+async def measure(name: str, argv: list[str], env: dict, runs: int, stdin: bytes = None) -> float:
+    times = [await run(argv, env, stdin) for _ in range(runs)]
+    best, median = min(times) * 1000, statistics.median(times) * 1000
+    print(f"  {name:<40} best={best:8.1f} ms   median={median:8.1f} ms")
+    return median
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--lines", type=int, default=1000)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS, help="budget for one tg_send.py message (ms)")
+    args = parser.parse_args()
+
+    fake = FakeBotAPI()
+    await fake.start()
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": fake.token,
+        "TELEGRAM_GROUP_ID": str(fake.chat_id),
+        "TELEGRAM_API_BASE_URL": fake.base_url,
+        "TELEGRAM_STATE_DB": os.path.join(tempfile.mkdtemp(prefix="telegram-mcp-bench-"), "state.db"),
+    }
+    python = sys.executable
+    print(f"fake Bot API at {fake.base_url}, {args.runs} runs each\n")
+    try:
+        await measure("python (empty interpreter)", [python, "-c", "pass"], env, args.runs)
+        await measure("import telegram_handler", [python, "-c", "import telegram_handler"], env, args.runs)
+        await measure("import server", [python, "-c", "import server"], env, args.runs)
+        one = await measure("tg_send.py: one message", [python, "tg_send.py", "--thread", "100", "hello"], env, args.runs)
+
+        lines = "".join(f"step {i}: compiled module_{i}.py\n" for i in range(args.lines)).encode()
+        sent_before = fake.requests.get("sendMessage", 0)
+        await measure(f"tg_send.py: {args.lines} lines from stdin", [python, "tg_send.py", "--thread", "100", "--plain"], env, 1, stdin=lines)
+        print(f"  {'':<40} {fake.requests.get('sendMessage', 0) - sent_before} messages")
+    finally:
+        await fake.stop()
+
+    verdict = "within" if one <= args.budget else "OVER"
+    print(f"\ntg_send.py one-message median {one:.1f} ms is {verdict} the {args.budget:.0f} ms budget")
+    return 0 if one <= args.budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
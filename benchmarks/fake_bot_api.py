@@ -0,0 +1,312 @@
+"""
+In-process fake of the Telegram Bot API endpoints this server uses.
+
+It speaks real HTTP on localhost, so TelegramHandler talks to it exactly as it would to
+api.telegram.org once TELEGRAM_API_BASE_URL points at `FakeBotAPI.base_url`. Latency,
+429s and 5xx errors can be injected, and "human" replies are pushed with `user_reply`
+and `user_click`.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+from email.parser import BytesParser
+from email.policy import HTTP
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from local_http import HttpServer
+
+
+class FakeBotAPI:
+    def __init__(self, token: str = "123:fake", chat_id: int = -1001234567890, latency: float = 0.0,
+                 error_rate_429: float = 0.0, error_rate_5xx: float = 0.0, retry_after: int = 1, seed: int = None):
+        self.token = token
+        self.chat_id = chat_id
+        self.latency = latency
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        # Room for document uploads (Telegram allows bots 50 MB)
+        self.server = HttpServer(self._handle, max_body_size=60 * 1024 * 1024)
+
+        # Optional async hook called with every message the bot sends (e.g. to auto-reply)
+        self.on_message = None
+
+        self.messages: list[dict] = []
+        self.uploads: list[dict] = []  # every document received as a file (not by file_id)
+        self.requests: dict[str, int] = {}
+        self.injected_errors = 0
+        # Topics closed or deleted (by the bot, or by a test standing in for a user)
+        self.closed_topics: set[int] = set()
+        self.deleted_topics: set[int] = set()
+        self._updates: list[dict] = []
+        self._update_pushed: dict[int, float] = {}
+        self._new_update = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._next_thread_id = 100
+
+        self._methods = {
+            "createForumTopic": self._create_forum_topic,
+            "closeForumTopic": self._close_forum_topic,
+            "deleteForumTopic": self._delete_forum_topic,
+            "sendMessage": self._send_message,
+            "sendDocument": self._send_document,
+            "editMessageText": self._edit_message_text,
+            "editMessageReplyMarkup": self._edit_message_reply_markup,
+            "answerCallbackQuery": self._ok,
+            "getUpdates": self._get_updates,
+            "setWebhook": self._ok,
+            "deleteWebhook": self._ok,
+        }
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+    @property
+    def base_url(self) -> str:
+        """Value for TELEGRAM_API_BASE_URL."""
+        return self.server.url
+
+    # --- Simulated human ---
+
+    def user_reply(self, thread_id: int, text: str) -> int:
+        """Queues a text message from a user in the topic. Returns its update_id."""
+        return self._push_update({
+            "message": {
+                "message_id": self._message_id(),
+                "message_thread_id": thread_id,
+                "chat": {"id": self.chat_id, "type": "supergroup"},
+                "from": {"id": 1, "is_bot": False, "first_name": "Human"},
+                "date": int(time.time()),
+                "text": text,
+            }
+        })
+
+    def user_click(self, thread_id: int, data: str, message_id: int = None) -> int:
+        """
+        Queues a button click (callback_query) in the topic. Returns its update_id.
+        Like Telegram, the message comes with its text and keyboard if the bot sent it.
+        """
+        message = {
+            "message_id": message_id or self._message_id(),
+            "message_thread_id": thread_id,
+            "chat": {"id": self.chat_id, "type": "supergroup"},
+            "date": int(time.time()),
+        }
+        sent = self._find_message(message_id)
+        if sent is not None:
+            message.update({key: sent[key] for key in ("date", "text", "reply_markup") if key in sent})
+        return self._push_update({
+            "callback_query": {
+                "id": str(self.random.getrandbits(48)),
+                "from": {"id": 1, "is_bot": False, "first_name": "Human"},
+                "data": data,
+                "message": message,
+            }
+        })
+
+    def user_press(self, message_id: int, text: str) -> int:
+        """Clicks the button labelled `text` on a message the bot sent. Returns the update_id."""
+        message = self._find_message(message_id)
+        for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+            for button in row:
+                if button["text"] == text:
+                    return self.user_click(message["message_thread_id"], button["callback_data"], message_id)
+        raise KeyError(f"no button {text!r} on message {message_id}")
+
+    def pushed_at(self, update_id: int) -> float:
+        """time.perf_counter() at which an update was queued, for latency measurements."""
+        return self._update_pushed[update_id]
+
+    def _push_update(self, update: dict) -> int:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        update["update_id"] = update_id
+        self._updates.append(update)
+        self._update_pushed[update_id] = time.perf_counter()
+        self._new_update.set()
+        return update_id
+
+    def _find_message(self, message_id: int):
+        return next((m for m in self.messages if m["message_id"] == message_id), None) if message_id else None
+
+    def _message_id(self) -> int:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    # --- HTTP ---
+
+    async def _handle(self, method: str, path: str, headers: dict, body: bytes):
+        prefix = f"/bot{self.token}/"
+        if not path.startswith(prefix):
+            return self._error(404, "Not Found")
+        endpoint = path[len(prefix):].split("?", 1)[0]
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+        handler = self._methods.get(endpoint)
+        if handler is None:
+            return self._error(404, "Not Found: method not found")
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        # getUpdates is left alone so the injected faults hit the send path
+        if endpoint != "getUpdates":
+            roll = self.random.random()
+            if roll < self.error_rate_429:
+                self.injected_errors += 1
+                return self._error(429, f"Too Many Requests: retry after {self.retry_after}", {"retry_after": self.retry_after})
+            if roll < self.error_rate_429 + self.error_rate_5xx:
+                self.injected_errors += 1
+                return self._error(502, "Bad Gateway")
+
+        try:
+            if headers.get("content-type", "").startswith("multipart/form-data"):
+                data = _parse_multipart(headers["content-type"], body)
+            else:
+                data = json.loads(body) if body else {}
+        except ValueError:
+            return self._error(400, "Bad Request: invalid request body")
+        return await handler(data)
+
+    def _reply(self, result, status: int = 200):
+        return status, json.dumps({"ok": True, "result": result}).encode(), "application/json"
+
+    def _error(self, status: int, description: str, parameters: dict = None):
+        payload = {"ok": False, "error_code": status, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return status, json.dumps(payload).encode(), "application/json"
+
+    async def _ok(self, data: dict):
+        return self._reply(True)
+
+    async def _create_forum_topic(self, data: dict):
+        thread_id = self._next_thread_id
+        self._next_thread_id += 1
+        return self._reply({"message_thread_id": thread_id, "name": data.get("name", ""), "icon_color": 7322096})
+
+    async def _close_forum_topic(self, data: dict):
+        self.closed_topics.add(data.get("message_thread_id"))
+        return self._reply(True)
+
+    async def _delete_forum_topic(self, data: dict):
+        self.deleted_topics.add(data.get("message_thread_id"))
+        return self._reply(True)
+
+    async def _send_message(self, data: dict):
+        if data.get("message_thread_id") in self.deleted_topics:
+            return self._error(400, "Bad Request: message thread not found")
+        if data.get("message_thread_id") in self.closed_topics:
+            return self._error(400, "Bad Request: TOPIC_CLOSED")
+        if not data.get("text"):
+            return self._error(400, "Bad Request: message text is empty")
+        if len(data["text"]) > 4096:
+            return self._error(400, "Bad Request: message is too long")
+        for row in data.get("reply_markup", {}).get("inline_keyboard", []):
+            for button in row:
+                if len(button.get("callback_data", "").encode()) > 64:
+                    return self._error(400, "Bad Request: BUTTON_DATA_INVALID")
+
+        message = {
+            "message_id": self._message_id(),
+            "message_thread_id": data.get("message_thread_id"),
+            "chat": {"id": self.chat_id, "type": "supergroup"},
+            "date": int(time.time()),
+            "text": data["text"],
+        }
+        if "reply_markup" in data:
+            message["reply_markup"] = data["reply_markup"]
+        self.messages.append(message)
+
+        if self.on_message:
+            await self.on_message(message)
+        return self._reply(message)
+
+    async def _edit_message_text(self, data: dict):
+        message = self._find_message(data.get("message_id"))
+        if message is None:
+            return self._error(400, "Bad Request: message to edit not found")
+        if message.get("text") == data.get("text"):
+            return self._error(400, "Bad Request: message is not modified: specified new message content and reply markup are exactly the same")
+        message["text"] = data.get("text")
+        message["edits"] = message.get("edits", 0) + 1
+        return self._reply(message)
+
+    async def _edit_message_reply_markup(self, data: dict):
+        message = self._find_message(data.get("message_id"))
+        if message is None:
+            return self._error(400, "Bad Request: message to edit not found")
+        markup = data.get("reply_markup")
+        if markup == message.get("reply_markup"):
+            return self._error(400, "Bad Request: message is not modified: specified new message content and reply markup are exactly the same")
+        if markup:
+            message["reply_markup"] = markup
+        else:
+            message.pop("reply_markup", None)
+        return self._reply(message)
+
+    async def _send_document(self, data: dict):
+        document = data.get("document")
+        if isinstance(document, tuple):
+            # A new upload: the file_id is derived from the content, like a real one is stable per file
+            file_name, content = document
+            file_id = "BQAC" + hashlib.sha256(content).hexdigest()[:32]
+            self.uploads.append({"file_name": file_name, "size": len(content), "file_id": file_id})
+        elif isinstance(document, str) and document.startswith("BQAC"):
+            file_id, file_name, content = document, "document", b""
+        else:
+            return self._error(400, "Bad Request: wrong file identifier/HTTP URL specified")
+
+        message = {
+            "message_id": self._message_id(),
+            "message_thread_id": int(data["message_thread_id"]) if data.get("message_thread_id") else None,
+            "chat": {"id": self.chat_id, "type": "supergroup"},
+            "date": int(time.time()),
+            "document": {"file_id": file_id, "file_unique_id": file_id[-16:], "file_name": file_name, "file_size": len(content)},
+        }
+        if data.get("caption"):
+            message["caption"] = data["caption"]
+        self.messages.append(message)
+        return self._reply(message)
+
+    async def _get_updates(self, data: dict):
+        offset = data.get("offset")
+        if offset:
+            # Like Telegram: an offset confirms every update before it
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+
+        deadline = time.monotonic() + float(data.get("timeout", 0))
+        while not self._updates:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self._reply(self._updates[:100])
+
+
+def _parse_multipart(content_type: str, body: bytes) -> dict:
+    """Form fields as strings and uploaded files as (file name, bytes)."""
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    if not message.is_multipart():
+        raise ValueError("not a multipart body")
+    data = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        content = part.get_payload(decode=True)
+        file_name = part.get_filename()
+        data[name] = (file_name, content) if file_name else content.decode()
+    return data
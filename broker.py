@@ -0,0 +1,512 @@
+"""
+Local broker that lets any number of server.py processes share one bot.
+
+Telegram allows a single getUpdates poller (or webhook) per bot, so every MCP server
+started by another agent or IDE window would fight over it. The broker is the one
+process that talks to the update stream; it also owns the rate limiter and the outbox
+worker. Servers connect to it over a Unix domain socket and exchange newline-delimited
+JSON messages:
+
+  server -> broker  {"op": "subscribe", "threads": [thread_id, ...]}
+                    {"op": "call", "id": n, "method": "sendMessage", "data": {...}}
+                    {"op": "outbox", "entries": [entry_id, ...]}
+                    {"op": "stats", "id": n}
+  broker -> server  {"op": "update", "thread_id": t, "update": {...}}
+                    {"op": "wake", "thread_id": t}
+                    {"id": n, "result": {...}} or {"id": n, "error": {...}}
+                    {"op": "settled", "entry": entry_id, "message": {...} or "error": {...}}
+
+The broker journals every update in the shared state database (store.py) before
+confirming it, and only then sends it in an "update" to the servers subscribed to its
+thread, which add it to their history and wake their waiters. The waiters still take
+their reply from the journal, so a server that was not connected at the time (or that
+subscribed late, which is what "wake" is for) finds it there. Outbox entries are written
+to the database by the server and sent by the broker. So a broker that dies loses
+nothing; the next one resumes from the stored offset and the queued messages.
+
+The first server that needs the broker starts it (python broker.py) and later ones
+connect to it; it exits after TELEGRAM_BROKER_IDLE seconds without clients. A server
+whose broker dies starts a new one; if that fails a few times in a row, the server
+talks to Telegram directly from then on. A broker that could not be started is not
+waited for again by the servers started in the next BROKER_RETRY_AFTER seconds.
+With TELEGRAM_BROKER=off, or where Unix sockets are unavailable, every server talks to
+Telegram directly as before.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import subprocess
+from collections import OrderedDict
+import httpx
+# Loads .env before store.py reads TELEGRAM_STATE_DB
+from telegram_handler import TelegramHandler, TELEGRAM_UPDATE_MODE
+from store import STATE_DB_PATH
+from outbox import Outbox
+from metrics import metrics
+
+# "auto": use the broker, starting it if needed; "off": talk to Telegram directly
+TELEGRAM_BROKER = os.getenv("TELEGRAM_BROKER", "auto").lower()
+# Next to the state database by default, since the broker and its clients must share it
+TELEGRAM_BROKER_SOCKET = os.getenv("TELEGRAM_BROKER_SOCKET") or STATE_DB_PATH + ".sock"
+BROKER_LOCK_PATH = TELEGRAM_BROKER_SOCKET + ".lock"
+BROKER_LOG_PATH = STATE_DB_PATH + ".broker.log"
+# The broker exits after this many seconds without clients and with nothing left to send
+TELEGRAM_BROKER_IDLE = float(os.getenv("TELEGRAM_BROKER_IDLE", "300"))
+
+# How long a server waits for a broker it started (or lost) to accept connections
+BROKER_START_TIMEOUT = 10.0
+BROKER_RETRY_INTERVAL = 0.1
+# A broker that could not take the lock is started again no sooner than this
+BROKER_SPAWN_INTERVAL = 2.0
+# A server that lost its broker gives up after this many reconnects of BROKER_START_TIMEOUT each
+BROKER_MAX_RECONNECTS = 3
+# After a broker failed to start, servers don't wait for (or start) one again for this long
+BROKER_RETRY_AFTER = 300.0
+IDLE_CHECK_INTERVAL = 5.0
+# Longest line either side accepts (a message is at most a few KB of JSON)
+MAX_LINE_SIZE = 4 * 1024 * 1024
+# Outbox results kept for servers whose "outbox" message arrives after the send
+MAX_UNCLAIMED_RESULTS = 1000
+# How long a server waits for the broker's stats before reporting without them
+STATS_TIMEOUT = 5.0
+
+
+def broker_available() -> bool:
+    return TELEGRAM_BROKER != "off" and hasattr(socket, "AF_UNIX")
+
+
+def mark_failed(path: str):
+    """Notes that no broker could be started on the socket, for the servers started next."""
+    try:
+        open(path + ".failed", "w").close()
+    except OSError:
+        pass
+
+
+def failed_recently(path: str) -> bool:
+    try:
+        return time.time() - os.path.getmtime(path + ".failed") < BROKER_RETRY_AFTER
+    except OSError:
+        return False
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode() + b"\n"
+
+
+def encode_error(error: Exception) -> dict:
+    """An exception as JSON, keeping what callers inspect: the HTTP status and Telegram's answer."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return {"status": error.response.status_code, "body": error.response.text}
+    return {"message": str(error) or type(error).__name__, "transient": isinstance(error, httpx.TransportError)}
+
+
+def decode_error(error: dict, endpoint: str) -> Exception:
+    """The exception the direct call would have raised, so error handling works the same through the broker."""
+    if "status" in error:
+        request = httpx.Request("POST", f"broker:///{endpoint}")
+        response = httpx.Response(error["status"], text=error["body"], request=request)
+        return httpx.HTTPStatusError(f"Telegram returned {error['status']} for {endpoint}: {error['body']}",
+                                     request=request, response=response)
+    if error.get("transient"):
+        return httpx.NetworkError(error["message"])
+    return Exception(error["message"])
+
+
+class Broker:
+    """
+    The daemon side: accepts servers on the socket, runs their Bot API calls through one
+    connection pool and rate limiter, sends the shared outbox and tells each server about
+    the updates journaled for the threads it subscribed to.
+    """
+
+    def __init__(self, telegram: TelegramHandler, path: str = TELEGRAM_BROKER_SOCKET, idle_timeout: float = TELEGRAM_BROKER_IDLE):
+        self.telegram = telegram
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.outbox = Outbox(telegram, on_settle=self._settled)
+        self._server = None
+        # Connected servers and the threads each one subscribed to
+        self._clients: dict[asyncio.StreamWriter, set[int]] = {}
+        # Outbox entry -> the server waiting for its delivery
+        self._claims: dict[int, asyncio.StreamWriter] = {}
+        self._unclaimed: OrderedDict[int, dict] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+        self._idle_since = time.monotonic()
+
+        # Reporting
+        self.calls = 0
+
+    async def start(self):
+        # Only the holder of the lock gets here, so a socket file left behind is stale
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path, limit=MAX_LINE_SIZE)
+        os.chmod(self.path, 0o600)
+        try:
+            os.unlink(self.path + ".failed")
+        except OSError:
+            pass
+        self.telegram.dispatcher.listeners.append(self._dispatched)
+        self.outbox.start()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        left = await self.outbox.drain(5.0)
+        if left:
+            print(f"{left} message(s) left in the outbox; they will be sent by the next broker", file=sys.stderr)
+        await self.outbox.stop()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    async def serve_until_idle(self, stop: asyncio.Event):
+        """Returns once `stop` is set or nobody used the broker for `idle_timeout` seconds."""
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), min(IDLE_CHECK_INTERVAL, self.idle_timeout))
+            except asyncio.TimeoutError:
+                pass
+            if self._clients or self.outbox.stats()["pending"]:
+                self._idle_since = time.monotonic()
+            elif time.monotonic() - self._idle_since >= self.idle_timeout:
+                print(f"No clients for {self.idle_timeout:g}s, exiting", file=sys.stderr)
+                return
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients[writer] = set()
+        try:
+            while line := await reader.readline():
+                self._handle(writer, json.loads(line))
+        except (ConnectionError, ValueError) as e:
+            print(f"Dropping broker client: {e}", file=sys.stderr)
+        finally:
+            del self._clients[writer]
+            for entry_id in [entry_id for entry_id, claimant in self._claims.items() if claimant is writer]:
+                del self._claims[entry_id]
+            self._idle_since = time.monotonic()
+            writer.close()
+
+    def _handle(self, writer: asyncio.StreamWriter, message: dict):
+        op = message.get("op")
+        if op == "subscribe":
+            threads = set(message["threads"]) - self._clients[writer]
+            self._clients[writer] |= threads
+            # Anything journaled before the subscription took effect is already in the database
+            for thread_id in threads:
+                self._send(writer, {"op": "wake", "thread_id": thread_id})
+        elif op == "call":
+            task = asyncio.ensure_future(self._call(writer, message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif op == "outbox":
+            for entry_id in message["entries"]:
+                result = self._unclaimed.pop(entry_id, None)
+                if result is not None:
+                    self._send(writer, result)
+                else:
+                    self._claims[entry_id] = writer
+            self.outbox.wake()
+        elif op == "stats":
+            self._send(writer, {"id": message["id"], "result": self.stats()})
+        else:
+            print(f"Unknown broker message: {op!r}", file=sys.stderr)
+
+    async def _call(self, writer: asyncio.StreamWriter, message: dict):
+        self.calls += 1
+        try:
+            result = await self.telegram._make_request("POST", message["method"], message.get("data"))
+            reply = {"id": message["id"], "result": result}
+        except Exception as e:
+            reply = {"id": message["id"], "error": encode_error(e)}
+        self._send(writer, reply)
+
+    def _dispatched(self, entries: list[tuple[dict, int]]):
+        for update, thread_id in entries:
+            for writer, threads in self._clients.items():
+                if thread_id in threads:
+                    self._send(writer, {"op": "update", "thread_id": thread_id, "update": update})
+
+    def _settled(self, entry_id: int, thread_id: int, message: dict, error: Exception):
+        result = {"op": "settled", "entry": entry_id}
+        if error is not None:
+            result["error"] = encode_error(error)
+        else:
+            result["message"] = message
+        writer = self._claims.pop(entry_id, None)
+        if writer is not None:
+            self._send(writer, result)
+            return
+        # The server may not have claimed it yet (or is gone); keep the result for a while
+        self._unclaimed[entry_id] = result
+        while len(self._unclaimed) > MAX_UNCLAIMED_RESULTS:
+            self._unclaimed.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        What happens in the broker on behalf of the servers: its metrics (the Bot API
+        calls, as MetricsRegistry.export()), rate limiter and outbox.
+        """
+        return {
+            "metrics": metrics.export(),
+            "rate_limiter": self.telegram.rate_limiter.stats(),
+            "outbox": self.outbox.stats(),
+            "clients": len(self._clients),
+            "calls": self.calls,
+        }
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, message: dict):
+        if not writer.is_closing():
+            writer.write(_encode(message))
+
+
+class BrokerClient:
+    """
+    The server side of the socket: forwards Bot API calls and outbox entries to the
+    broker, and wakes the local waiters when it journals an update for a thread this
+    process subscribed to. When the broker goes away, calls wait for the connection to
+    come back (starting a new broker if allowed) instead of failing at once. If it doesn't
+    come back, the handler is switched to talking to Telegram directly: its dispatcher
+    starts polling and on_fallback() is awaited to start the rest (outbox, webhook).
+    """
+
+    def __init__(self, telegram: TelegramHandler, path: str = TELEGRAM_BROKER_SOCKET, spawn: bool = True,
+                 on_fallback=None):
+        self.telegram = telegram
+        self.path = path
+        self.spawn = spawn
+        self.on_fallback = on_fallback
+        self._writer = None
+        self._reader = None
+        self._connected = asyncio.Event()
+        self._task = None
+        self._last_spawn = 0.0
+        self._next_id = 1
+        self._calls: dict[int, tuple[str, asyncio.Future]] = {}
+        self._threads: set[int] = set()
+        # Outbox entry -> on_settled(entry_id, message, error)
+        self._claims: dict[int, object] = {}
+
+    @classmethod
+    async def connect(cls, telegram: TelegramHandler, path: str = TELEGRAM_BROKER_SOCKET, spawn: bool = True,
+                      on_fallback=None):
+        """
+        Connects to the broker, starting it first if `spawn` allows. Returns None if no
+        broker can be used, in which case the caller talks to Telegram directly.
+        """
+        if not broker_available():
+            return None
+        client = cls(telegram, path, False, on_fallback)
+        # One that could not start a moment ago is only used if it has come up since
+        wait = spawn and not failed_recently(path)
+        client.spawn = wait
+        if not await client._open(BROKER_START_TIMEOUT if wait else 0):
+            if wait:
+                print(f"Telegram broker did not start (see {BROKER_LOG_PATH}); using Telegram directly", file=sys.stderr)
+                mark_failed(path)
+            return None
+        client.spawn = spawn
+        client._task = asyncio.ensure_future(client._run())
+        return client
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._disconnected()
+
+    async def call(self, endpoint: str, data: dict = None) -> dict:
+        """Calls a Bot API method through the broker; raises what the direct call would raise."""
+        return await self._request({"op": "call", "method": endpoint, "data": data}, endpoint)
+
+    async def stats(self) -> dict:
+        """The broker's Broker.stats(): the Bot API metrics, rate limiter and outbox of every server it serves."""
+        return await asyncio.wait_for(self._request({"op": "stats"}, "stats"), STATS_TIMEOUT)
+
+    async def _request(self, message: dict, endpoint: str) -> dict:
+        if not self._connected.is_set():
+            try:
+                await asyncio.wait_for(self._connected.wait(), BROKER_START_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise httpx.ConnectError("Telegram broker unavailable")
+        call_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = (endpoint, future)
+        try:
+            self._writer.write(_encode({**message, "id": call_id}))
+            return await future
+        finally:
+            self._calls.pop(call_id, None)
+
+    def subscribe(self, thread_id: int):
+        """Asks to be told about updates journaled for the thread from now on."""
+        if thread_id not in self._threads:
+            self._threads.add(thread_id)
+            self._send({"op": "subscribe", "threads": [thread_id]})
+
+    def claim(self, entry_id: int, on_settled):
+        """Has the broker send an outbox entry and report its delivery to on_settled(entry_id, message, error)."""
+        self._claims[entry_id] = on_settled
+        self._send({"op": "outbox", "entries": [entry_id]})
+
+    def _send(self, message: dict):
+        # While disconnected, _open() replays subscriptions and claims on the new connection
+        if self._connected.is_set():
+            self._writer.write(_encode(message))
+
+    async def _open(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE_SIZE)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return False
+                if self.spawn and time.monotonic() - self._last_spawn >= BROKER_SPAWN_INTERVAL:
+                    self._last_spawn = time.monotonic()
+                    spawn_broker()
+                await asyncio.sleep(BROKER_RETRY_INTERVAL)
+
+        self._connected.set()
+        if self._threads:
+            self._send({"op": "subscribe", "threads": sorted(self._threads)})
+        if self._claims:
+            self._send({"op": "outbox", "entries": sorted(self._claims)})
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                while line := await self._reader.readline():
+                    self._handle(json.loads(line))
+            except (ConnectionError, ValueError) as e:
+                print(f"Error reading from the Telegram broker: {e}", file=sys.stderr)
+            self._disconnected()
+            print("Lost the Telegram broker, reconnecting", file=sys.stderr)
+            for attempt in range(BROKER_MAX_RECONNECTS):
+                if await self._open(BROKER_START_TIMEOUT):
+                    break
+                print(f"Telegram broker unavailable (attempt {attempt + 1} of {BROKER_MAX_RECONNECTS})", file=sys.stderr)
+            else:
+                await self._fall_back()
+                return
+            # Updates may have been journaled while we were away
+            self.telegram.dispatcher.wake_all()
+
+    async def _fall_back(self):
+        """Stops using the broker: from now on this process polls and sends on its own."""
+        print(f"Telegram broker did not come back (see {BROKER_LOG_PATH}); using Telegram directly", file=sys.stderr)
+        mark_failed(self.path)
+        # Ends with this task; nothing left for close() to stop
+        self._task = None
+        if self.telegram.broker is self:
+            self.telegram.broker = None
+        dispatcher = self.telegram.dispatcher
+        dispatcher.poll = TELEGRAM_UPDATE_MODE != "webhook"
+        dispatcher.start()
+        # Replies the broker journaled before it died
+        dispatcher.wake_all()
+        if self.on_fallback is not None:
+            await self.on_fallback()
+
+    def _disconnected(self):
+        self._connected.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for endpoint, future in self._calls.values():
+            if not future.done():
+                future.set_exception(httpx.NetworkError(f"Lost the Telegram broker during {endpoint}"))
+
+    def _handle(self, message: dict):
+        if "id" in message:
+            endpoint, future = self._calls.get(message["id"], (None, None))
+            if future is None or future.done():
+                return
+            if "error" in message:
+                future.set_exception(decode_error(message["error"], endpoint))
+            else:
+                future.set_result(message["result"])
+            return
+
+        op = message.get("op")
+        if op == "update":
+            self.telegram._record_update(message["thread_id"], message["update"])
+            self.telegram.dispatcher.wake(message["thread_id"])
+        elif op == "wake":
+            self.telegram.dispatcher.wake(message["thread_id"])
+        elif op == "settled":
+            on_settled = self._claims.pop(message["entry"], None)
+            if on_settled is not None:
+                error = decode_error(message["error"], "sendMessage") if "error" in message else None
+                on_settled(message["entry"], message.get("message"), error)
+
+
+def spawn_broker():
+    """Starts `python broker.py` in the background, detached from this process."""
+    with open(BROKER_LOG_PATH, "a") as log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+            cwd=os.path.dirname(os.path.abspath(__file__)), start_new_session=True,
+        )
+
+
+async def main() -> int:
+    import fcntl
+    from webhook import WebhookReceiver
+
+    # One broker per socket: one started while another runs exits at once
+    lock = open(BROKER_LOCK_PATH, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return 0
+
+    telegram = TelegramHandler()
+    broker = Broker(telegram)
+    # Reported to the servers with the rest of the broker's metrics (see Broker.stats)
+    metrics.gauge("telegram_rate_limiter_queue_length", "Requests currently waiting on the rate limiter",
+                  lambda: telegram.rate_limiter.queue_length)
+    metrics.gauge("telegram_rate_limiter_wait_seconds_total", "Total time requests waited on the rate limiter",
+                  lambda: telegram.rate_limiter.total_wait)
+    webhook = None
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await broker.start()
+        if TELEGRAM_UPDATE_MODE == "webhook":
+            webhook = WebhookReceiver(telegram, telegram.dispatcher)
+            await webhook.start()
+        print(f"Telegram broker listening on {broker.path} (pid {os.getpid()})", file=sys.stderr)
+        await broker.serve_until_idle(stop)
+    finally:
+        if webhook:
+            await webhook.stop()
+        await broker.stop()
+        await telegram.close()
+        lock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,94 @@
+import os
+import time
+import secrets
+from collections import OrderedDict
+
+# Button questions are remembered this long after their last use, and at most this many at once
+CALLBACK_TTL_SECONDS = float(os.getenv("TELEGRAM_CALLBACK_TTL", str(7 * 24 * 3600)))
+MAX_CALLBACK_QUESTIONS = int(os.getenv("TELEGRAM_CALLBACK_QUESTIONS", "10000"))
+
+# Only the start of the question is kept, to tell which question a click answered
+MAX_QUESTION_TEXT = 200
+
+
+class ButtonQuestion:
+    """The options of one message with buttons, under the token its callback_data starts with."""
+
+    __slots__ = ("token", "thread_id", "question", "options", "last_used", "answered")
+
+    def __init__(self, token: str, thread_id: int, question: str, options: list[str]):
+        self.token = token
+        self.thread_id = thread_id
+        self.question = question[:MAX_QUESTION_TEXT]
+        self.options = list(options)
+        self.last_used = time.time()
+        self.answered = None   # the option picked, once a click was accepted
+
+
+class CallbackRegistry:
+    """
+    Short callback_data tokens for inline buttons. A message's buttons share one random
+    token and carry "<token>:<index>", a dozen bytes whatever the option text, so long
+    or non-Latin options never hit Telegram's 64-byte limit and options with a common
+    prefix never collide. Resolving a click is one dict lookup. Questions are kept in
+    LRU order and dropped after `ttl` seconds unused or beyond `max_questions`, so
+    memory stays bounded however many questions are asked.
+    """
+
+    def __init__(self, ttl: float = CALLBACK_TTL_SECONDS, max_questions: int = MAX_CALLBACK_QUESTIONS):
+        self.ttl = ttl
+        self.max_questions = max_questions
+        self._questions: OrderedDict[str, ButtonQuestion] = OrderedDict()
+
+        # Reporting
+        self.expired = 0
+
+    def register(self, thread_id: int, question: str, options: list[str]) -> list[str]:
+        """Remembers the options and returns the callback_data of each, in order."""
+        self._expire()
+        token = secrets.token_urlsafe(6)
+        while token in self._questions:
+            token = secrets.token_urlsafe(6)
+        self._questions[token] = ButtonQuestion(token, thread_id, question, options)
+        return [f"{token}:{index}" for index in range(len(options))]
+
+    def resolve(self, data: str):
+        """The (ButtonQuestion, option) a callback_data stands for, or None if it is not one of ours."""
+        token, _, index = data.partition(":")
+        entry = self._questions.get(token)
+        if entry is None or not index.isdigit() or int(index) >= len(entry.options):
+            return None
+        entry.last_used = time.time()
+        self._questions.move_to_end(token)
+        return entry, entry.options[int(index)]
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        while self._questions:
+            entry = next(iter(self._questions.values()))
+            if entry.last_used >= cutoff and len(self._questions) < self.max_questions:
+                break
+            del self._questions[entry.token]
+            self.expired += 1
+
+    def stats(self) -> dict:
+        return {
+            "questions": len(self._questions),
+            "answered": sum(1 for entry in self._questions.values() if entry.answered is not None),
+            "expired": self.expired,
+        }
+
+
+def button_text(callback: dict):
+    """
+    The text of the clicked button, read from the keyboard Telegram sends back with the
+    message, for clicks the registry does not know (another process, a restart, or
+    buttons sent before tokens were used). None if the keyboard is not there.
+    """
+    data = callback.get("data")
+    keyboard = (callback.get("message") or {}).get("reply_markup", {}).get("inline_keyboard", [])
+    for row in keyboard:
+        for button in row:
+            if button.get("callback_data") == data:
+                return button.get("text")
+    return None
@@ -0,0 +1,370 @@
+import re
+import html
+
+# Telegram rejects messages longer than this many characters
+MAX_MESSAGE_LENGTH = 4096
+
+_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*>')
+
+# One alternation covers every construct, so the whole text is converted in a single scan.
+# Every branch starts with a literal character, which lets the regex engine skip plain text
+# quickly; order matters where branches share it (``` before `, ** before a bullet).
+_MARKDOWN_RE = re.compile(
+    r'(?P<fence>```)'                               # code block (closed with str.find, see _render)
+    r'|`(?P<code>[^`\n]+)`'                         # inline code
+    r'|\*\*(?P<bold>[^\n]+?)\*\*'                    # **bold**
+    r'|__(?P<bold2>[^\n]+?)__'                       # __bold__
+    r'|_(?<!\w_)(?P<italic>[^\n]+?)_(?!\w)'          # _italic_, but not inside snake_case_names
+    r'|[*-](?<![^\n][*-])(?P<bullet>[ \t]+)',         # list item at the start of a line
+)
+
+# The same constructs minus the line-level ones, for the inside of bold and italic spans
+_INLINE_RE = re.compile(
+    r'`(?P<code>[^`\n]+)`'
+    r'|\*\*(?P<bold>[^\n]+?)\*\*'
+    r'|__(?P<bold2>[^\n]+?)__'
+    r'|_(?<!\w_)(?P<italic>[^\n]+?)_(?!\w)'
+)
+
+_LANGUAGE_RE = re.compile(r'^[a-zA-Z0-9+#]+$')
+
+
+def _has_markup(text: str) -> bool:
+    return "`" in text or "*" in text or "_" in text
+
+
+def _render(pattern: re.Pattern, text: str) -> str:
+    """Escapes the plain text between matches and renders each construct, left to right."""
+    out = []
+    pos = 0
+    while True:
+        match = pattern.search(text, pos)
+        if match is None:
+            break
+        if match.start() > pos:
+            out.append(html.escape(text[pos:match.start()]))
+        pos = match.end()
+
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "fence":
+            # Finding the closing fence with str.find is much faster than a lazy regex over the block
+            end = text.find("```", pos)
+            if end == -1:
+                # Unclosed block: keep the backticks as text
+                out.append(value)
+                continue
+            value = text[pos:end]
+            pos = end + 3
+
+        if kind == "bullet":
+            out.append("• ")
+        elif kind == "code":
+            out.append(f"<code>{html.escape(value)}</code>")
+        elif kind == "fence":
+            content = value.strip()
+            # Remove language identifier if present (e.g. ```python)
+            first_line_break = content.find('\n')
+            if -1 < first_line_break < 20 and _LANGUAGE_RE.match(content[:first_line_break].strip()):
+                content = content[first_line_break + 1:]
+            out.append(f"<pre>{html.escape(content)}</pre>")
+        else:
+            inner = _render(_INLINE_RE, value) if _has_markup(value) else html.escape(value)
+            out.append(f"<i>{inner}</i>" if kind == "italic" else f"<b>{inner}</b>")
+
+    if pos < len(text):
+        out.append(html.escape(text[pos:]))
+    return "".join(out)
+
+
+def markdown_to_html(text: str) -> str:
+    """
+    Converts standard Markdown to Telegram-supported HTML in a single pass.
+    Handles code blocks, inline code, bold, italic and list bullets; everything
+    else is HTML-escaped. Code is never formatted, and underscores inside words
+    (snake_case_name) are left alone.
+    """
+    return _render(_MARKDOWN_RE, text)
+
+
+# Tags Telegram's HTML parse mode accepts (https://core.telegram.org/bots/api#html-style)
+ALLOWED_TAGS = frozenset({
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "span", "tg-spoiler",
+    "a", "tg-emoji", "code", "pre", "blockquote",
+})
+# Only tags and characters that might be wrong are matched: an & that starts one of the
+# entities Telegram understands (&lt; &gt; &amp; &quot; and numeric ones) is skipped by the scan.
+# The leading lookahead lets the regex engine jump straight to the next <, > or &.
+_HTML_TOKEN_RE = re.compile(
+    r'(?=[<>&])(?:'
+    r'(?P<tag><(?P<close>/?)(?P<name>[a-zA-Z][a-zA-Z0-9-]*)(?P<attrs>\s[^<>]*)?>)'
+    r'|(?P<stray>[<>]|&(?!(?:lt|gt|amp|quot|#[0-9]+|#[xX][0-9a-fA-F]+);))'
+    r')'
+)
+_ESCAPES = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+
+
+def _tag_problem(name: str, attrs: str, stack: list[str]):
+    """Why Telegram would reject this opening tag where it stands, or None if it is fine."""
+    if name not in ALLOWED_TAGS:
+        return "unsupported_tag"
+    if name == "span" and "tg-spoiler" not in attrs:
+        return "unsupported_tag"
+    if name == "a" and "href=" not in attrs:
+        return "unsupported_tag"
+    if stack and stack[-1] in ("code", "pre") and not (name == "code" and stack[-1] == "pre"):
+        # Nothing can be nested in code, except the <code class="language-x"> of a <pre>
+        return "nested_in_code"
+    return None
+
+
+def repair_html(text: str) -> tuple[str, list[str]]:
+    """
+    Checks Telegram HTML against the tags, entities and nesting rules Telegram
+    enforces, and fixes what it would reject: unsupported or misplaced tags,
+    stray <, > and & and unknown entities are escaped, misnested tags are
+    closed and reopened, and unmatched or unclosed tags are balanced.
+    Returns the HTML (unchanged if it was valid) and the kinds of fixes made.
+    """
+    fixes = []
+    out = []
+    stack: list[str] = []          # names of the open tags
+    open_tags: list[str] = []      # their opening tag text, to reopen them after a misnested close
+    pos = 0
+    for match in _HTML_TOKEN_RE.finditer(text):
+        if match.start() > pos:
+            out.append(text[pos:match.start()])
+        pos = match.end()
+        token = match.group(0)
+
+        if match.group("stray"):
+            # A bare <, > or &, or an entity Telegram doesn't know (e.g. &nbsp;)
+            fixes.append("stray_char")
+            out.append(_ESCAPES[token])
+        elif not match.group("close"):
+            name = match.group("name").lower()
+            problem = _tag_problem(name, match.group("attrs") or "", stack)
+            if problem:
+                fixes.append(problem)
+                out.append(html.escape(token, quote=False))
+            else:
+                stack.append(name)
+                open_tags.append(token)
+                out.append(token)
+        else:
+            name = match.group("name").lower()
+            if name not in stack:
+                # Closes nothing (or a tag that was escaped above)
+                fixes.append("unmatched_close")
+                out.append(html.escape(token, quote=False))
+                continue
+            depth = len(stack) - 1 - stack[::-1].index(name)
+            if depth != len(stack) - 1:
+                fixes.append("misnested")
+            inner, inner_tags = stack[depth + 1:], open_tags[depth + 1:]
+            out.extend(f"</{n}>" for n in reversed(inner))
+            out.append(token)
+            del stack[depth:], open_tags[depth:]
+            # Reopen the inner tags that were cut short
+            for n, tag in zip(inner, inner_tags):
+                if _tag_problem(n, tag, stack) is None:
+                    stack.append(n)
+                    open_tags.append(tag)
+                    out.append(tag)
+
+    if pos < len(text):
+        out.append(text[pos:])
+    if stack:
+        fixes.append("unclosed_tag")
+        out.extend(f"</{n}>" for n in reversed(stack))
+
+    if not fixes:
+        return text, fixes
+    return "".join(out), fixes
+
+
+class _HtmlSplitter:
+    """
+    Accumulates HTML tokens into chunks of at most `limit` characters.
+    Tracks the open tags so a chunk can always be closed (and the next one reopened),
+    and remembers the last cut point outside of any tag so spans are kept whole
+    whenever they fit in a chunk.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks: list[str] = []
+        self.stack: list[tuple[str, str]] = []  # open tags as (name, opening tag text)
+        self.closing = 0  # length of the closing tags needed for `stack`
+        self._restart([])
+
+    def _restart(self, parts: list[str], content: bool = False):
+        self.parts = parts
+        self.size = sum(len(p) for p in parts)
+        self.content = content  # whether the chunk holds more than reopened tags
+        self.safe = None        # (part index, offset, chars to drop) of the last cut outside any tag
+
+    def _room(self) -> int:
+        return self.limit - self.size - self.closing
+
+    def _emit(self, parts: list[str], open_tags: list[tuple[str, str]]):
+        chunk = "".join(parts) + "".join(f"</{name}>" for name, _ in reversed(open_tags))
+        if chunk.strip():
+            self.chunks.append(chunk)
+
+    def _flush(self):
+        """Ends the chunk here, closing open tags and reopening them in the next one."""
+        if self.content:
+            self._emit(self.parts, self.stack)
+        self._restart([tag for _, tag in self.stack])
+
+    def _cut_at_safe(self) -> bool:
+        """Ends the chunk at the last point outside any tag, if that keeps it at least half full."""
+        if self.safe is None:
+            return False
+        index, offset, drop = self.safe
+        head = self.parts[:index]
+        if index < len(self.parts):
+            head.append(self.parts[index][:offset])
+        if sum(len(p) for p in head) < self.limit // 2:
+            return False
+
+        tail = self.parts[index + 1:]
+        if index < len(self.parts):
+            tail.insert(0, self.parts[index][offset + drop:])
+        # Nothing is open at the safe point, and the tail itself reopens whatever is open now
+        self._emit(head, [])
+        self._restart(tail, content=any(tail))
+        return True
+
+    def open_tag(self, name: str, tag: str):
+        needed = len(tag) + len(name) + 3
+        if self.content and needed > self._room() and not self._cut_at_safe():
+            self._flush()
+        if not self.stack and self.content:
+            self.safe = (len(self.parts), 0, 0)
+        self.parts.append(tag)
+        self.size += len(tag)
+        self.stack.append((name, tag))
+        self.closing += len(name) + 3
+
+    def close_tag(self, name: str, tag: str):
+        # Closing tags are always budgeted for in `closing`, so they never force a cut
+        self.parts.append(tag)
+        self.size += len(tag)
+        if self.stack and self.stack[-1][0] == name:
+            self.stack.pop()
+            self.closing -= len(name) + 3
+        if not self.stack:
+            self.safe = (len(self.parts), 0, 0)
+
+    def add_text(self, text: str):
+        pos = 0
+        end = len(text)
+        while pos < end:
+            room = self._room()
+            if end - pos <= room:
+                if not self.stack:
+                    newline = text.rfind("\n", pos)
+                    if newline >= 0:
+                        self.safe = (len(self.parts), newline - pos, 1)
+                self.parts.append(text[pos:] if pos else text)
+                self.size += end - pos
+                self.content = True
+                return
+
+            if not self.stack and room > 0:
+                # Outside any tag, the last line break that fits is the best cut
+                newline = text.rfind("\n", pos, pos + room + 1)
+                if newline >= 0:
+                    self.parts.append(text[pos:newline])
+                    self.size += newline - pos
+                    self.content = self.content or newline > pos
+                    pos = newline + 1
+                    self._flush()
+                    continue
+
+            if self.content and self._cut_at_safe():
+                continue
+
+            # The span does not fit even in a fresh chunk: cut inside it
+            cut, drop = _break_point(text, pos, room)
+            if cut == pos and not self.content:
+                cut = pos + max(room, 1)
+            if cut > pos:
+                self.parts.append(text[pos:cut])
+                self.size += cut - pos
+                self.content = True
+            pos = cut + drop
+            self._flush()
+
+    def finish(self) -> list[str]:
+        if self.content:
+            self._emit(self.parts, self.stack)
+        return self.chunks
+
+
+def _break_point(text: str, pos: int, room: int) -> tuple[int, int]:
+    """Where to cut `text` after `pos` to fit in `room`: (cut index, separator chars to drop)."""
+    if room <= 0:
+        return pos, 0
+    limit = pos + room
+    newline = text.rfind("\n", pos + 1, limit + 1)
+    if newline > 0:
+        return newline, 1
+    space = text.rfind(" ", pos + 1, limit)
+    cut = space + 1 if space > 0 else limit
+    # Never split an entity such as &amp;
+    amp = text.rfind("&", max(pos, cut - 10), cut)
+    if amp != -1 and ";" not in text[amp:cut]:
+        cut = amp
+    return cut, 0
+
+
+def split_html(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Splits Telegram HTML into chunks of at most `limit` characters.
+    Chunks are cut at a newline outside of any tag when possible; a span that is
+    itself too long (e.g. a huge <pre>) is cut inside, closing its open tags at the
+    end of one chunk and reopening them at the start of the next, so every chunk
+    is valid HTML on its own. Runs in a single pass over the input.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    splitter = _HtmlSplitter(limit)
+    pos = 0
+    for match in _TAG_RE.finditer(text):
+        if match.start() > pos:
+            splitter.add_text(text[pos:match.start()])
+        name = match.group(2).lower()
+        if match.group(1):
+            splitter.close_tag(name, match.group(0))
+        else:
+            splitter.open_tag(name, match.group(0))
+        pos = match.end()
+    if pos < len(text):
+        splitter.add_text(text[pos:])
+    return splitter.finish()
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Splits plain text into chunks of at most `limit` characters, preferring line breaks."""
+    chunks = []
+    pos = 0
+    while len(text) - pos > limit:
+        newline = text.rfind("\n", pos + 1, pos + limit + 1)
+        if newline > 0:
+            chunks.append(text[pos:newline])
+            pos = newline + 1
+        else:
+            chunks.append(text[pos:pos + limit])
+            pos += limit
+    if text[pos:].strip() or not chunks:
+        chunks.append(text[pos:])
+    return chunks
+
+
+def html_to_text(text: str) -> str:
+    """Strips tags and entities, for resending a rejected HTML chunk as plain text."""
+    return html.unescape(_TAG_RE.sub("", text))
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+from collections import deque, OrderedDict
+
+# Per-thread caps on the messages kept, and on how many threads are remembered at once
+HISTORY_MAX_MESSAGES = int(os.getenv("TELEGRAM_HISTORY_MESSAGES", "200"))
+HISTORY_MAX_BYTES = int(os.getenv("TELEGRAM_HISTORY_BYTES", str(256 * 1024)))
+HISTORY_MAX_THREADS = int(os.getenv("TELEGRAM_HISTORY_THREADS", "100"))
+
+# Longer texts are cut when recorded (Telegram messages are at most 4096 characters anyway)
+MAX_ENTRY_TEXT = 4096
+
+
+class HistoryEntry:
+    """One message or button click in a thread. Slots keep it to a few dozen bytes plus the text."""
+
+    __slots__ = ("ts", "outgoing", "kind", "author", "text", "message_id", "size")
+
+    def __init__(self, ts: float, outgoing: bool, kind: str, author, text: str, message_id=None):
+        self.ts = ts
+        self.outgoing = outgoing
+        self.kind = kind
+        self.author = author
+        self.text = text
+        self.message_id = message_id
+        self.size = sys.getsizeof(self) + sys.getsizeof(text)
+
+    def to_dict(self) -> dict:
+        entry = {
+            "ts": round(self.ts, 3),
+            "from": "bot" if self.outgoing else (self.author or "user"),
+            "kind": self.kind,
+            "text": self.text,
+        }
+        if self.message_id is not None:
+            entry["message_id"] = self.message_id
+        return entry
+
+
+class ThreadHistory:
+    """
+    The most recent messages of each thread, in memory, for agents that lost their context.
+    A thread keeps at most `max_messages` entries and `max_bytes` of them (oldest dropped
+    first), and at most `max_threads` threads are kept, the least recently active
+    dropped first, so memory stays bounded however many topics the server has seen.
+    """
+
+    def __init__(self, max_messages: int = HISTORY_MAX_MESSAGES, max_bytes: int = HISTORY_MAX_BYTES,
+                 max_threads: int = HISTORY_MAX_THREADS):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_threads = max_threads
+        self._threads: OrderedDict[int, deque] = OrderedDict()
+        self._sizes: dict[int, int] = {}
+
+        # Reporting
+        self.evicted_threads = 0
+
+    def record(self, thread_id: int, text: str, outgoing: bool, kind: str = "message", author: str = None,
+               message_id: int = None):
+        if self.max_messages <= 0 or self.max_threads <= 0:
+            return
+        if len(text) > MAX_ENTRY_TEXT:
+            text = text[:MAX_ENTRY_TEXT] + "…"
+        entry = HistoryEntry(time.time(), outgoing, kind, author, text, message_id)
+
+        entries = self._threads.get(thread_id)
+        if entries is None:
+            entries = self._threads[thread_id] = deque()
+            self._sizes[thread_id] = 0
+            while len(self._threads) > self.max_threads:
+                oldest, _ = self._threads.popitem(last=False)
+                del self._sizes[oldest]
+                self.evicted_threads += 1
+        else:
+            self._threads.move_to_end(thread_id)
+
+        entries.append(entry)
+        size = self._sizes[thread_id] + entry.size
+        while entries and (len(entries) > self.max_messages or size > self.max_bytes):
+            size -= entries.popleft().size
+        self._sizes[thread_id] = size
+
+    def record_update(self, thread_id: int, update: dict, button_text: str = None):
+        """Records an incoming message or callback_query (as `button_text`, the option clicked, if given)."""
+        callback = update.get("callback_query")
+        if callback:
+            message = callback.get("message", {})
+            text = button_text if button_text is not None else callback.get("data", "")
+            self.record(thread_id, text, False, "callback", _author(callback.get("from")), message.get("message_id"))
+            return
+
+        message = update.get("message")
+        if not message:
+            return
+        text = message.get("text") or message.get("caption")
+        kind = "message"
+        if text is None:
+            # A photo, document, sticker...: note what it was
+            kind = next((key for key in ("photo", "document", "voice", "video", "sticker", "audio") if key in message), "other")
+            text = f"[{kind}]"
+        self.record(thread_id, text, False, kind, _author(message.get("from")), message.get("message_id"))
+
+    def get(self, thread_id: int, limit: int = None, since: float = None) -> list[HistoryEntry]:
+        """The thread's entries after `since` (a Unix time), oldest first, at most the last `limit`."""
+        entries = self._threads.get(thread_id)
+        if not entries:
+            return []
+        if since is None:
+            selected = list(entries)
+        else:
+            selected = [entry for entry in entries if entry.ts > since]
+        if limit is not None:
+            selected = selected[-limit:] if limit > 0 else []
+        return selected
+
+    def stats(self) -> dict:
+        return {
+            "threads": len(self._threads),
+            "entries": sum(len(entries) for entries in self._threads.values()),
+            "bytes": sum(self._sizes.values()),
+            "evicted_threads": self.evicted_threads,
+        }
+
+
+def _author(user: dict):
+    if not user:
+        return None
+    return user.get("username") or user.get("first_name")
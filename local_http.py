@@ -0,0 +1,104 @@
+import sys
+import asyncio
+from http import HTTPStatus
+
+# Bodies larger than this are refused (Telegram updates are a few KB)
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class HttpServer:
+    """
+    Minimal asyncio HTTP/1.1 server for local endpoints (webhook receiver, test fakes).
+    `handler(method, path, headers, body)` is awaited per request and returns
+    (status, body bytes, content type). Header names are lower-cased.
+    Connections are kept alive until the client closes them.
+    """
+
+    def __init__(self, handler, host: str = "127.0.0.1", port: int = 0, max_body_size: int = MAX_BODY_SIZE):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self._server = None
+        self._connections: set[asyncio.Task] = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        # Report the real port when an ephemeral one (0) was requested
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Don't wait for requests still in progress, e.g. a long poll held open by a fake
+            for task in self._connections:
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request = await _read_request(reader, self.max_body_size)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, payload, content_type = await self.handler(method, path, headers, body)
+                except Exception as e:
+                    print(f"Error handling {method} {path}: {e}", file=sys.stderr)
+                    status, payload, content_type = 500, b"", "text/plain"
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(_response(status, payload, content_type, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Cancelled by stop(); ending the connection task quietly is all that's left to do
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+async def _read_request(reader: asyncio.StreamReader, max_body_size: int = MAX_BODY_SIZE):
+    """Reads one request as (method, path, headers, body), or None if the client went away."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length > max_body_size:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, headers, body
+
+
+def _response(status: int, body: bytes, content_type: str, keep_alive: bool = True) -> bytes:
+    reason = HTTPStatus(status).phrase
+    head = (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
@@ -0,0 +1,91 @@
+import os
+import sys
+import asyncio
+from formatting import MAX_MESSAGE_LENGTH
+
+# Leave headroom for the Markdown-to-HTML expansion
+LOG_MAX_CHARS = min(int(os.getenv("TELEGRAM_LOG_MAX_CHARS", "3500")), MAX_MESSAGE_LENGTH)
+LOG_FLUSH_INTERVAL = float(os.getenv("TELEGRAM_LOG_FLUSH_INTERVAL", "2.0"))
+
+
+class LogBuffer:
+    """
+    Coalesces broadcast_log calls per thread into a single message.
+    A thread's buffer is flushed when it would grow past `max_chars`, when
+    `flush_interval` seconds have passed since its first pending line, or
+    explicitly (e.g. right before a question is asked in that thread).
+    Flushes of the same thread are serialized, so log order is preserved.
+    """
+
+    def __init__(self, send, max_chars: int = LOG_MAX_CHARS, flush_interval: float = LOG_FLUSH_INTERVAL):
+        # send(thread_id, text) is awaited once per flush
+        self._send = send
+        self.max_chars = max_chars
+        self.flush_interval = flush_interval
+        self._pending: dict[int, list[str]] = {}
+        self._sizes: dict[int, int] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+        # Reporting
+        self.logs = 0
+        self.flushes = 0
+
+    async def add(self, thread_id: int, text: str):
+        """Buffers one log line, flushing first if it would not fit in the current batch."""
+        self.logs += 1
+        size = self._sizes.get(thread_id, 0)
+        if size and size + 1 + len(text) > self.max_chars:
+            await self.flush(thread_id)
+            size = 0
+
+        self._pending.setdefault(thread_id, []).append(text)
+        self._sizes[thread_id] = size + (1 if size else 0) + len(text)
+
+        if self._sizes[thread_id] >= self.max_chars:
+            await self.flush(thread_id)
+        elif thread_id not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[thread_id] = loop.call_later(self.flush_interval, self._flush_later, thread_id)
+
+    def _flush_later(self, thread_id: int):
+        self._timers.pop(thread_id, None)
+        task = asyncio.ensure_future(self._flush_quietly(thread_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_quietly(self, thread_id: int):
+        try:
+            await self.flush(thread_id)
+        except Exception as e:
+            print(f"Error flushing logs for thread {thread_id}: {e}", file=sys.stderr)
+
+    async def flush(self, thread_id: int):
+        """Sends everything buffered for the thread as one message."""
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        async with lock:
+            timer = self._timers.pop(thread_id, None)
+            if timer:
+                timer.cancel()
+            lines = self._pending.pop(thread_id, None)
+            self._sizes.pop(thread_id, None)
+            if not lines:
+                return
+
+            self.flushes += 1
+            await self._send(thread_id, "\n".join(lines))
+
+    async def flush_all(self):
+        for thread_id in list(self._pending):
+            await self._flush_quietly(thread_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "logs": self.logs,
+            "flushes": self.flushes,
+            "pending_threads": len(self._pending),
+            "pending_chars": sum(self._sizes.values()),
+        }
@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import asyncio
+import bisect
+
+# Latency buckets in seconds: Bot API calls are ~50ms-1s, long polls and human replies much longer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+# Serve Prometheus text on this port (0 = off) and/or dump it to this file periodically
+TELEGRAM_METRICS_PORT = int(os.getenv("TELEGRAM_METRICS_PORT", "0"))
+TELEGRAM_METRICS_FILE = os.getenv("TELEGRAM_METRICS_FILE", "")
+TELEGRAM_METRICS_DUMP_INTERVAL = float(os.getenv("TELEGRAM_METRICS_DUMP_INTERVAL", "60"))
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        return {_label_text(key) or "total": value for key, value in self.values.items()}
+
+    def export(self) -> dict:
+        return {"type": "counter", "values": [[list(key), value] for key, value in self.values.items()]}
+
+    def merge(self, exported: dict):
+        """Adds the values of another process's counter (from export())."""
+        for key, value in exported["values"]:
+            self.inc(value, **dict(key))
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_text(key)} {value}" for key, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; observing a value is a bisect and two additions."""
+
+    def __init__(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # labels -> [bucket counts (+Inf last), sum, count]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def _quantile(self, counts: list[int], total: int, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile."""
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        result = {}
+        for key, (counts, total, count) in self.values.items():
+            result[_label_text(key) or "total"] = {
+                "count": count,
+                "sum": round(total, 4),
+                "avg": round(total / count, 4) if count else 0.0,
+                "p50_le": self._quantile(counts, count, 0.5),
+                "p99_le": self._quantile(counts, count, 0.99),
+            }
+        return result
+
+    def export(self) -> dict:
+        return {"type": "histogram", "buckets": list(self.buckets),
+                "values": [[list(key), entry] for key, entry in self.values.items()]}
+
+    def merge(self, exported: dict):
+        """Adds the observations of another process's histogram (from export()) with the same buckets."""
+        if tuple(exported["buckets"]) != tuple(self.buckets):
+            return
+        for key, (counts, total, count) in exported["values"]:
+            key = tuple(tuple(pair) for pair in key)
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(key)} {count}")
+        return lines
+
+
+class Gauge:
+    """A value read from `read()` whenever metrics are reported, e.g. a queue length."""
+
+    def __init__(self, name: str, description: str, read):
+        self.name = name
+        self.description = description
+        self.read = read
+
+    def snapshot(self):
+        return self.read()
+
+    def export(self) -> dict:
+        return {"type": "gauge", "value": self.read()}
+
+    def merge(self, exported: dict):
+        """Adds another process's reading (e.g. both processes' queue lengths)."""
+        read = self.read
+        self.read = lambda: read() + exported["value"]
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.started = time.time()
+        self._metrics: dict[str, object] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, description))
+
+    def histogram(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, description, buckets))
+
+    def gauge(self, name: str, description: str, read) -> Gauge:
+        gauge = self._metrics[name] = Gauge(name, description, read)
+        return gauge
+
+    def export(self) -> dict:
+        """Every metric as JSON, for combined() in another process (e.g. the broker's Bot API metrics)."""
+        exported = {}
+        for name, metric in self._metrics.items():
+            exported[name] = {"description": metric.description, **metric.export()}
+        return exported
+
+    def combined(self, exported: dict) -> "MetricsRegistry":
+        """
+        A copy of this registry with another process's metrics (from export()) added in:
+        counters and histograms are summed label by label, gauges are added up.
+        """
+        registry = MetricsRegistry()
+        registry.started = self.started
+        for name, metric in self._metrics.items():
+            if isinstance(metric, Gauge):
+                registry.gauge(name, metric.description, metric.read)
+            elif isinstance(metric, Histogram):
+                registry.histogram(name, metric.description, metric.buckets).merge(metric.export())
+            else:
+                registry.counter(name, metric.description).merge(metric.export())
+        for name, other in exported.items():
+            metric = registry._metrics.get(name)
+            if metric is None:
+                if other["type"] == "counter":
+                    metric = registry.counter(name, other["description"])
+                elif other["type"] == "histogram":
+                    metric = registry.histogram(name, other["description"], tuple(other["buckets"]))
+                else:
+                    metric = registry.gauge(name, other["description"], lambda: 0)
+            metric.merge(other)
+        return registry
+
+    def snapshot(self) -> dict:
+        snapshot = {name: metric.snapshot() for name, metric in self._metrics.items()}
+        # Leave out counters and histograms that have not seen anything yet
+        return {name: value for name, value in snapshot.items() if value != {}}
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """Writes the Prometheus text atomically (e.g. for node_exporter's textfile collector)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """
+    Serves the registry as Prometheus text on /metrics and/or dumps it to a file periodically.
+    With `collect` (an async callable returning a registry), what it returns is reported
+    instead, e.g. the registry combined with the broker's metrics.
+    """
+
+    def __init__(self, registry: MetricsRegistry, port: int = TELEGRAM_METRICS_PORT, path: str = TELEGRAM_METRICS_FILE,
+                 interval: float = TELEGRAM_METRICS_DUMP_INTERVAL, collect=None):
+        self.registry = registry
+        self.collect = collect
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self._server = None
+        self._task = None
+
+    async def start(self):
+        if self.port:
+            # Imported here so the metrics module stays dependency-free when no endpoint is configured
+            from local_http import HttpServer
+            self._server = HttpServer(self._handle, "127.0.0.1", self.port)
+            await self._server.start()
+        if self.path:
+            self._task = asyncio.get_running_loop().create_task(self._dump_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.path:
+            await self._dump()
+        if self._server is not None:
+            await self._server.stop()
+            self._server = None
+
+    async def _handle(self, method: str, path: str, headers: dict, body: bytes):
+        if path.split("?", 1)[0] != "/metrics":
+            return 404, b"", "text/plain"
+        registry = await self._current()
+        return 200, registry.render_prometheus().encode(), "text/plain; version=0.0.4"
+
+    async def _current(self) -> MetricsRegistry:
+        return await self.collect() if self.collect is not None else self.registry
+
+    async def _dump_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._dump()
+
+    async def _dump(self):
+        registry = await self._current()
+        try:
+            registry.dump(self.path)
+        except OSError as e:
+            print(f"Error writing metrics to {self.path}: {e}", file=sys.stderr)
+
+
+metrics = MetricsRegistry()
+
+api_latency = metrics.histogram("telegram_api_request_duration_seconds", "Bot API call latency by method")
+api_requests = metrics.counter("telegram_api_requests_total", "Bot API calls by method and outcome")
+api_bytes_sent = metrics.counter("telegram_api_bytes_sent_total", "Request body bytes sent to the Bot API by method")
+api_retries = metrics.counter("telegram_api_retries_total", "Bot API calls retried after a 429, by method")
+html_checked = metrics.counter("telegram_html_checked_total", "Outgoing HTML messages validated before sending, by outcome")
+html_repairs = metrics.counter("telegram_html_repairs_total", "Problems fixed locally in outgoing HTML, by kind")
+html_fallbacks = metrics.counter("telegram_html_fallback_total", "Messages resent as plain text after Telegram rejected the HTML")
+file_uploads = metrics.counter("telegram_file_uploads_total", "Files sent with sendDocument, by how (uploaded, gzipped, cached)")
+reply_wait = metrics.histogram("telegram_reply_wait_seconds", "Time humans took to answer, by thread")
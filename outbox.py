@@ -0,0 +1,264 @@
+import os
+import sys
+import time
+import asyncio
+import secrets
+import httpx
+from rate_limiter import backoff_delay
+
+# Back-off of a thread whose next message could not be sent: doubles from 1s up to this, with jitter
+OUTBOX_RETRY_MAX = float(os.getenv("TELEGRAM_OUTBOX_RETRY_MAX", "60"))
+OUTBOX_RETRY_INITIAL = 1.0
+
+# How often drain() looks at the queue while waiting for it to empty
+DRAIN_POLL_INTERVAL = 0.05
+
+# Queued messages stay with the process that holds their lease; it renews the lease while it runs,
+# and another process adopts them once it has run out
+OUTBOX_LEASE_SECONDS = 60.0
+OUTBOX_LEASE_RENEW_INTERVAL = 15.0
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether sending again later may work: network errors, rate limits and Telegram-side errors."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+def describe(error: Exception) -> str:
+    """A one-line reason for the log and the queue: Telegram's description when there is one."""
+    if isinstance(error, httpx.HTTPStatusError):
+        try:
+            description = error.response.json().get("description")
+        except ValueError:
+            description = None
+        return f"{error.response.status_code} {description or error.response.reason_phrase}"
+    return str(error) or type(error).__name__
+
+
+class Outbox:
+    """
+    Sends messages from the on-disk queue (store.OutboxQueue) in the background.
+    enqueue() only writes the message to disk, so callers never wait on the network.
+    Each thread is drained by its own sender, oldest message first, so threads are
+    sent to concurrently (as fast as the rate limiter allows) while every thread keeps
+    its order. A message that fails with a transient error stays at the head of its
+    thread and is retried with back-off; as soon as any send succeeds again, every
+    deferred thread is retried at once.
+    Several processes may share the queue: each sends only the messages it leased
+    (its own, and those left behind by a process that stopped or died), so none is
+    sent twice and nobody else's back-off is reset.
+    When the handler is connected to a broker, the broker's outbox sends the messages
+    (the queue is the same database) and this one only tracks their delivery.
+    """
+
+    def __init__(self, telegram, on_settle=None):
+        self.telegram = telegram
+        # on_settle(entry_id, thread_id, message, error) is called for every message sent or dropped
+        self.on_settle = on_settle
+        # Lease holder name of this outbox in the shared queue
+        self.owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+        # Delivery of messages enqueued by this process: entry id -> (thread_id, future, payload)
+        self._futures: dict[int, tuple[int, asyncio.Future, dict]] = {}
+        self._senders: dict[int, asyncio.Task] = {}
+        self._wake = None
+        self._task = None
+        self._deferred = False
+        self._renewed = 0.0
+
+        # Reporting
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stops sending; whatever is still queued is sent by the next process that looks at the queue."""
+        tasks = list(self._senders.values())
+        running = self._task is not None
+        if running:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._senders.clear()
+        if running:
+            # No need to wait for the lease to run out
+            self.telegram.outbox_queue.release(self.owner)
+        for _, future, _ in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    def enqueue(self, thread_id: int, text: str, parse_mode: str = "HTML", buttons: list[str] = None,
+                silent_mode: bool = True) -> asyncio.Future:
+        """
+        Queues a message for the thread and returns a future that resolves to the sent
+        message, or to the error if it can never be sent. `silent_mode` is passed on to
+        send_message when it is sent, by whichever process that is.
+        """
+        payload = {"text": text, "parse_mode": parse_mode, "buttons": buttons, "silent_mode": silent_mode}
+        if buttons:
+            # Registered here, in the process that waits for the click, even when a broker sends it
+            payload["callback_data"] = self.telegram.callbacks.register(thread_id, text, buttons)
+        if self.telegram.broker is not None:
+            # Unowned, for the broker to adopt
+            entry_id = self.telegram.outbox_queue.add(thread_id, payload)
+        else:
+            entry_id = self.telegram.outbox_queue.add(thread_id, payload, self.owner, time.time() + OUTBOX_LEASE_SECONDS)
+        future = asyncio.get_running_loop().create_future()
+        # Most callers never look at the outcome; don't warn about errors nobody retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._futures[entry_id] = (thread_id, future, payload)
+        if self.telegram.broker is not None:
+            self.telegram.broker.claim(entry_id, self._settle_remote)
+        else:
+            self.start()
+            self._wake.set()
+        return future
+
+    def wake(self):
+        """Looks at the queue now, e.g. after another process added to it."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def settled(self, thread_id: int, timeout: float = None):
+        """Waits (up to `timeout` seconds) until the messages this process queued for the thread are sent or failed."""
+        futures = [future for queued_thread, future, _ in self._futures.values() if queued_thread == thread_id]
+        if futures:
+            await asyncio.wait(futures, timeout=timeout)
+
+    async def drain(self, timeout: float) -> int:
+        """Waits up to `timeout` seconds for every due message to be sent. Returns how many are still queued."""
+        if self.telegram.broker is not None:
+            # The broker sends them (and keeps at it after we exit); wait for the ones queued here
+            futures = [future for _, future, _ in self._futures.values()]
+            if futures:
+                await asyncio.wait(futures, timeout=timeout)
+            return sum(not future.done() for future in futures)
+        queue = self.telegram.outbox_queue
+        deadline = time.monotonic() + timeout
+        while self._task is not None and time.monotonic() < deadline:
+            now = time.time()
+            if not self._senders and not any(next_attempt <= now for _, next_attempt in queue.heads(self.owner)):
+                break
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        return queue.pending(self.owner)
+
+    async def _run(self):
+        """
+        Keeps the leases of this outbox's messages, adopts messages left without one, starts
+        a sender for every thread whose next message is due, then sleeps until one is.
+        """
+        queue = self.telegram.outbox_queue
+        while True:
+            self._wake.clear()
+            now = time.time()
+            if now - self._renewed >= OUTBOX_LEASE_RENEW_INTERVAL:
+                queue.renew(self.owner, now + OUTBOX_LEASE_SECONDS)
+                self._renewed = now
+            queue.adopt(self.owner, now + OUTBOX_LEASE_SECONDS)
+            next_due = now + OUTBOX_LEASE_RENEW_INTERVAL
+            for thread_id, next_attempt in queue.heads(self.owner):
+                if thread_id in self._senders:
+                    continue
+                if next_attempt <= now:
+                    task = asyncio.ensure_future(self._drain(thread_id))
+                    self._senders[thread_id] = task
+                    task.add_done_callback(lambda _, thread_id=thread_id: self._sender_done(thread_id))
+                else:
+                    next_due = min(next_due, next_attempt)
+
+            # asyncio.wait rather than wait_for, which can swallow stop()'s cancellation
+            # when the wake-up comes at the same moment (Python < 3.12)
+            waiter = asyncio.ensure_future(self._wake.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=max(0.0, next_due - time.time()))
+            finally:
+                waiter.cancel()
+
+    def _sender_done(self, thread_id: int):
+        self._senders.pop(thread_id, None)
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _drain(self, thread_id: int):
+        """Sends the thread's queued messages in order until it is empty or its head has to wait."""
+        queue = self.telegram.outbox_queue
+        while (entry := queue.next_for(thread_id, self.owner)) is not None:
+            entry_id, payload, attempts, next_attempt, sent_chunks = entry
+            if next_attempt > time.time():
+                return
+            try:
+                message = await self.telegram.send_message(
+                    thread_id, payload["text"], parse_mode=payload["parse_mode"], buttons=payload["buttons"],
+                    silent_mode=payload.get("silent_mode", True),
+                    callback_data=payload.get("callback_data"),
+                    # A long message that failed part-way resumes after the parts already delivered
+                    sent_chunks=sent_chunks, on_chunk_sent=lambda count, entry_id=entry_id: queue.chunk_sent(entry_id, count),
+                )
+            except Exception as e:
+                reason = describe(e)
+                if is_transient(e):
+                    # Keep the message (and the rest of the thread behind it) for later
+                    attempts += 1
+                    delay = backoff_delay(attempts, OUTBOX_RETRY_INITIAL, OUTBOX_RETRY_MAX)
+                    queue.defer(entry_id, attempts, time.time() + delay, reason)
+                    self.retries += 1
+                    self._deferred = True
+                    print(f"Outbox: sending to thread {thread_id} failed ({reason}); retrying in {delay:.1f}s", file=sys.stderr)
+                    return
+                queue.fail(entry_id, reason)
+                self.failed += 1
+                print(f"Outbox: dropping message to thread {thread_id}: {reason}", file=sys.stderr)
+                self._settle(entry_id, thread_id, error=e)
+                continue
+
+            queue.remove(entry_id)
+            self.sent += 1
+            self._settle(entry_id, thread_id, message)
+            if self._deferred:
+                # Telegram is reachable again: retry every deferred thread now instead of waiting out its back-off
+                self._deferred = False
+                if queue.retry_now(self.owner):
+                    self._wake.set()
+
+    def _settle(self, entry_id: int, thread_id: int, message: dict = None, error: Exception = None):
+        if self.on_settle is not None:
+            self.on_settle(entry_id, thread_id, message, error)
+        _, future, _ = self._futures.pop(entry_id, (None, None, None))
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(message)
+
+    def _settle_remote(self, entry_id: int, message: dict = None, error: Exception = None):
+        """Delivery of a message the broker sent for us."""
+        thread_id, _, payload = self._futures.get(entry_id, (None, None, None))
+        if thread_id is None:
+            return
+        if error is not None:
+            self.failed += 1
+        else:
+            self.sent += 1
+            self.telegram._record_sent(thread_id, payload["text"], payload["buttons"], message)
+        self._settle(entry_id, thread_id, message, error)
+
+    def stats(self) -> dict:
+        return {
+            **self.telegram.outbox_queue.depth(),
+            "senders": len(self._senders),
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed_sends": self.failed,
+        }
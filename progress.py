@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import asyncio
+import secrets
+from collections import OrderedDict
+
+# At most one edit per progress message this often; later updates are merged into a trailing edit.
+# Edits count against the group's 20 messages/minute like sends, so one bar uses at most 6 of them
+PROGRESS_MIN_INTERVAL = float(os.getenv("TELEGRAM_PROGRESS_MIN_INTERVAL", "10.0"))
+
+# Leave headroom for the title, the bar and the Markdown-to-HTML expansion
+MAX_PROGRESS_TEXT = 3000
+# Progress messages remembered at once; the oldest are dropped first
+MAX_PROGRESS_HANDLES = 1000
+
+BAR_WIDTH = 10
+
+
+def render_progress(title: str, text: str = None, percent: float = None, done: bool = False) -> str:
+    """The Markdown of a progress message: title, optional bar and the latest status text."""
+    lines = [f"{'✅' if done else '⏳'} **{title}**"]
+    if percent is not None:
+        percent = max(0.0, min(100.0, percent))
+        filled = round(percent / 100 * BAR_WIDTH)
+        lines.append(f"`{'▓' * filled}{'░' * (BAR_WIDTH - filled)}` {percent:.0f}%")
+    if text:
+        lines.append(text if len(text) <= MAX_PROGRESS_TEXT else "…" + text[-MAX_PROGRESS_TEXT:])
+    return "\n".join(lines)
+
+
+class Progress:
+    """One progress message and the state last sent to Telegram."""
+
+    def __init__(self, handle: str, thread_id: int, title: str, message_id: int, sent: str):
+        self.handle = handle
+        self.thread_id = thread_id
+        self.title = title
+        self.message_id = message_id
+        self.text = None
+        self.percent = None
+        self.done = False
+        self.sent = sent            # the Markdown Telegram currently shows
+        self.last_edit = time.monotonic()
+        self.timer = None           # pending trailing edit
+        self.lock = asyncio.Lock()  # edits of one message go out in order
+
+    def render(self) -> str:
+        return render_progress(self.title, self.text, self.percent, self.done)
+
+
+class ProgressTracker:
+    """
+    Progress messages that are edited in place instead of posting a new message per update.
+    Edits of a message are at least `min_interval` seconds apart: an update arriving
+    sooner is held, and only the latest one is sent when the interval is up. Updates
+    that would not change the message are not sent at all.
+    """
+
+    def __init__(self, send, edit, min_interval: float = PROGRESS_MIN_INTERVAL, max_handles: int = MAX_PROGRESS_HANDLES):
+        # send(thread_id, text) -> sent message, edit(message_id, text); both awaited
+        self._send = send
+        self._edit = edit
+        self.min_interval = min_interval
+        self.max_handles = max_handles
+        self._progress: OrderedDict[str, Progress] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+
+        # Reporting
+        self.updates = 0
+        self.edits = 0
+
+    async def start(self, thread_id: int, title: str) -> Progress:
+        """Posts the progress message and returns its handle."""
+        text = render_progress(title)
+        message = await self._send(thread_id, text)
+        progress = Progress(secrets.token_hex(4), thread_id, title, message["message_id"], text)
+        self._progress[progress.handle] = progress
+        while len(self._progress) > self.max_handles:
+            _, oldest = self._progress.popitem(last=False)
+            if oldest.timer:
+                oldest.timer.cancel()
+        return progress
+
+    def get(self, handle: str):
+        return self._progress.get(handle)
+
+    async def update(self, handle: str, text: str = None, percent: float = None, done: bool = False) -> str:
+        """
+        Records the latest state and edits the message if the interval allows.
+        Returns "edited", "scheduled" (a trailing edit will send it), "unchanged" or "unknown".
+        A final update (`done`) is sent right away and closes the handle.
+        """
+        progress = self._progress.get(handle)
+        if progress is None:
+            return "unknown"
+        self.updates += 1
+        if text is not None:
+            progress.text = text
+        if percent is not None:
+            progress.percent = percent
+        if done:
+            progress.done = True
+            del self._progress[handle]
+
+        if progress.render() == progress.sent:
+            return "unchanged"
+
+        wait = progress.last_edit + self.min_interval - time.monotonic()
+        if done or wait <= 0:
+            await self._flush(progress)
+            return "edited"
+        if progress.timer is None:
+            loop = asyncio.get_running_loop()
+            progress.timer = loop.call_later(wait, self._flush_later, progress)
+        return "scheduled"
+
+    def _flush_later(self, progress: Progress):
+        progress.timer = None
+        task = asyncio.ensure_future(self._flush_quietly(progress))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_quietly(self, progress: Progress):
+        try:
+            await self._flush(progress)
+        except Exception as e:
+            print(f"Error updating progress in thread {progress.thread_id}: {e}", file=sys.stderr)
+
+    async def _flush(self, progress: Progress):
+        """Edits the message to the latest state, if that differs from what it shows."""
+        async with progress.lock:
+            if progress.timer:
+                progress.timer.cancel()
+                progress.timer = None
+            text = progress.render()
+            if text == progress.sent:
+                return
+            progress.sent = text
+            progress.last_edit = time.monotonic()
+            self.edits += 1
+            await self._edit(progress.message_id, text)
+
+    async def flush_all(self):
+        """Sends the pending trailing edits now (e.g. on shutdown)."""
+        for progress in list(self._progress.values()):
+            if progress.timer:
+                await self._flush_quietly(progress)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._progress),
+            "updates": self.updates,
+            "edits": self.edits,
+        }
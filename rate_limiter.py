@@ -0,0 +1,170 @@
+import os
+import time
+import random
+import asyncio
+
+
+def parse_rate(value: str, default: tuple[float, float] = None) -> tuple[float, float]:
+    """Parses a "count/seconds" budget such as "20/60" into (count, seconds)."""
+    if not value:
+        return default
+    try:
+        count, _, seconds = value.partition("/")
+        return float(count), float(seconds or 1)
+    except ValueError:
+        return default
+
+
+# Telegram's documented limits: ~30 messages/s overall and ~20 messages/minute per group.
+# Topics share the group budget and Telegram has no limit of its own per topic, so the
+# per-topic budget is off unless set (e.g. "10/60" keeps one chatty topic from starving the others).
+GLOBAL_RATE = parse_rate(os.getenv("TELEGRAM_RATE_GLOBAL"), (30, 1))
+CHAT_RATE = parse_rate(os.getenv("TELEGRAM_RATE_CHAT"), (20, 60))
+TOPIC_RATE = parse_rate(os.getenv("TELEGRAM_RATE_TOPIC"), None)
+
+# Idle buckets are dropped once this many are tracked
+MAX_TRACKED_BUCKETS = 1000
+
+
+def backoff_delay(failures: int, initial: float = 1.0, maximum: float = 60.0) -> float:
+    """
+    Delay before retrying after `failures` consecutive failures: doubles from `initial`
+    up to `maximum`, with jitter so clients that failed together don't retry in lockstep.
+    """
+    ceiling = min(maximum, initial * 2 ** (failures - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class TokenBucket:
+    """Classic token bucket: `count` tokens refilled evenly over `seconds`."""
+
+    def __init__(self, count: float, seconds: float):
+        self.capacity = count
+        self.rate = count / seconds
+        self.tokens = count
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class RateLimiter:
+    """
+    Schedules Bot API sends against the global, per-chat and (optional) per-topic budgets.
+    Callers wait in `acquire` instead of failing; a 429 from Telegram blocks the
+    affected chat (or everything) for the `retry_after` it asked for.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, topic_rate=TOPIC_RATE):
+        self.chat_rate = chat_rate
+        self.topic_rate = topic_rate
+        self._global = TokenBucket(*global_rate)
+        self._chats: dict = {}
+        self._topics: dict = {}
+
+        # Reporting
+        self.queue_length = 0
+        self.max_queue_length = 0
+        self.requests = 0
+        self.delayed_requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.rate_limited = 0
+
+    def _bucket(self, buckets: dict, key, rate: tuple[float, float]) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= MAX_TRACKED_BUCKETS:
+                now = time.monotonic()
+                for idle in [k for k, b in buckets.items() if b.is_idle(now)]:
+                    del buckets[idle]
+            bucket = buckets[key] = TokenBucket(*rate)
+        return bucket
+
+    def _buckets_for(self, chat_id, thread_id) -> list[TokenBucket]:
+        buckets = [self._global]
+        if chat_id is not None:
+            buckets.append(self._bucket(self._chats, str(chat_id), self.chat_rate))
+            if thread_id is not None and self.topic_rate is not None:
+                buckets.append(self._bucket(self._topics, (str(chat_id), thread_id), self.topic_rate))
+        return buckets
+
+    async def acquire(self, chat_id=None, thread_id=None) -> float:
+        """Waits until every budget that applies has a free slot. Returns the seconds waited."""
+        buckets = self._buckets_for(chat_id, thread_id)
+        start = time.monotonic()
+        queued = False
+        try:
+            while True:
+                now = time.monotonic()
+                wait = max(bucket.delay(now) for bucket in buckets)
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.consume()
+                    break
+
+                if not queued:
+                    queued = True
+                    self.queue_length += 1
+                    self.max_queue_length = max(self.max_queue_length, self.queue_length)
+                await asyncio.sleep(wait)
+        finally:
+            if queued:
+                self.queue_length -= 1
+
+        waited = time.monotonic() - start
+        self.requests += 1
+        if queued:
+            self.delayed_requests += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def pause(self, retry_after: float, chat_id=None):
+        """Blocks the chat (or, without a chat, every request) after a 429."""
+        self.rate_limited += 1
+        if chat_id is not None:
+            bucket = self._bucket(self._chats, str(chat_id), self.chat_rate)
+        else:
+            bucket = self._global
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+
+    def stats(self) -> dict:
+        return {
+            "queue_length": self.queue_length,
+            "max_queue_length": self.max_queue_length,
+            "requests": self.requests,
+            "delayed_requests": self.delayed_requests,
+            "total_wait_seconds": round(self.total_wait, 3),
+            "max_wait_seconds": round(self.max_wait, 3),
+            "avg_wait_seconds": round(self.total_wait / self.delayed_requests, 3) if self.delayed_requests else 0.0,
+            "rate_limited_responses": self.rate_limited,
+        }
+
+
+def combine_stats(a: dict, b: dict) -> dict:
+    """The stats() of two limiters (e.g. this process's and the broker's) as if they were one."""
+    combined = {key: a[key] + b[key] for key in ("queue_length", "requests", "delayed_requests", "rate_limited_responses")}
+    combined["max_queue_length"] = max(a["max_queue_length"], b["max_queue_length"])
+    combined["total_wait_seconds"] = round(a["total_wait_seconds"] + b["total_wait_seconds"], 3)
+    combined["max_wait_seconds"] = max(a["max_wait_seconds"], b["max_wait_seconds"])
+    delayed = combined["delayed_requests"]
+    combined["avg_wait_seconds"] = round(combined["total_wait_seconds"] / delayed, 3) if delayed else 0.0
+    return combined
@@ -1,9 +1,11 @@
 import sys
 import os
+import asyncio
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from server import TelegramHandler, TELEGRAM_GROUP_ID
+# The plain Telegram client: no MCP server is loaded just to send one message
+from telegram_handler import TelegramHandler
 
-def main():
+async def main():
     if len(sys.argv) < 2:
         print("Usage: python send_message.py <message>")
         return
@@ -13,14 +15,15 @@ def main():
     
     telegram = TelegramHandler()
     
-    # Try to find an existing topic or create one
-    # For now, let's just create a new session topic "Antigravity Chat"
+    # Reuse the "Antigravity Chat" topic (created on first use)
     try:
-        topic_id = telegram.create_forum_topic("Antigravity Chat")
-        telegram.send_message(topic_id, message)
+        topic_id = await telegram.create_forum_topic("Antigravity Chat")
+        await telegram.send_message(topic_id, message)
         print("✅ Message sent successfully!")
     except Exception as e:
         print(f"❌ Failed to send message: {e}")
+    finally:
+        await telegram.close()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
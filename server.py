@@ -1,237 +1,211 @@
 import os
 import sys
+import json
 import time
 import asyncio
-import httpx
-import re
-import html
-from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 from mcp.server.fastmcp import FastMCP
+# The Telegram client lives in its own module so scripts can use it without loading the MCP stack;
+# TelegramHandler, UpdateDispatcher and TELEGRAM_GROUP_ID are still importable from here
+from telegram_handler import TelegramHandler, UpdateDispatcher, TELEGRAM_GROUP_ID, TELEGRAM_UPDATE_MODE
+from log_buffer import LogBuffer
+from progress import ProgressTracker
+from webhook import WebhookReceiver
+from metrics import metrics, MetricsRegistry, MetricsExporter, html_checked, html_fallbacks
+from rate_limiter import combine_stats
+from tickets import TicketBook
+from outbox import Outbox
+from broker import BrokerClient, TELEGRAM_BROKER_SOCKET
 
-# Load environment variables from the script's directory
-script_dir = os.path.dirname(os.path.abspath(__file__))
-env_path = os.path.join(script_dir, '.env')
-load_dotenv(env_path)
+# Merge broadcast_log calls per thread (see log_buffer.py for the flush thresholds)
+TELEGRAM_LOG_BATCHING = os.getenv("TELEGRAM_LOG_BATCHING", "").lower() in ("1", "true", "yes")
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TELEGRAM_GROUP_ID = os.getenv("TELEGRAM_GROUP_ID")
+# Write logs and questions to the on-disk outbox and send them in the background (see outbox.py)
+TELEGRAM_OUTBOX = os.getenv("TELEGRAM_OUTBOX", "true").lower() in ("1", "true", "yes")
 
-if not TELEGRAM_BOT_TOKEN or not TELEGRAM_GROUP_ID:
-    raise ValueError("Missing TELEGRAM_BOT_TOKEN or TELEGRAM_GROUP_ID environment variables")
+# How long files and progress messages wait for the messages queued before them in their thread
+OUTBOX_ORDER_TIMEOUT = 10.0
 
-API_BASE_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+telegram = TelegramHandler()
 
-class TelegramHandler:
-    def __init__(self):
-        self.client = httpx.Client(timeout=30.0)
+# Messages survive outages and restarts, and tools return before they are sent
+outbox = Outbox(telegram) if TELEGRAM_OUTBOX else None
 
-    def _make_request(self, method: str, endpoint: str, data: dict = None):
-        url = f"{API_BASE_URL}/{endpoint}"
-        try:
-            response = self.client.request(method, url, json=data)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            print(f"Error calling Telegram API: {e.response.text}", file=sys.stderr)
-            raise
-        except Exception as e:
-            print(f"Unexpected error: {e}", file=sys.stderr)
-            raise
-
-    def create_forum_topic(self, name: str) -> int:
-        """Creates a new forum topic in the supergroup and returns the message_thread_id."""
-        data = {
-            "chat_id": TELEGRAM_GROUP_ID,
-            "name": name
-        }
-        result = self._make_request("POST", "createForumTopic", data)
-        if result.get("ok"):
-            return result["result"]["message_thread_id"]
-        raise Exception(f"Failed to create topic: {result}")
-
-    def _convert_to_html(self, text: str) -> str:
-        """
-        Converts standard Markdown to Telegram-supported HTML.
-        Handles code blocks, inline code, bold, and italic.
-        """
-        # 1. Split by code blocks to avoid escaping inside code
-        parts = re.split(r'(```.*?```)', text, flags=re.DOTALL)
-        
-        html_parts = []
-        for part in parts:
-            if part.startswith('```') and part.endswith('```'):
-                # Code block: Extract content, escape HTML, wrap in <pre>
-                content = part[3:-3].strip()
-                # Remove language identifier if present (e.g. ```python)
-                first_line_break = content.find('\n')
-                if first_line_break > -1 and first_line_break < 20:
-                    # Check if the first line looks like a language ID
-                    lang_line = content[:first_line_break].strip()
-                    if re.match(r'^[a-zA-Z0-9+#]+$', lang_line):
-                        content = content[first_line_break+1:]
-                
-                escaped_content = html.escape(content)
-                html_parts.append(f'<pre>{escaped_content}</pre>')
-            else:
-                # Normal text: Escape HTML first, then apply formatting
-                escaped_text = html.escape(part)
-                
-                # Bold: **text** -> <b>text</b>
-                escaped_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', escaped_text)
-                # Bold: __text__ -> <b>text</b>
-                escaped_text = re.sub(r'__(.*?)__', r'<b>\1</b>', escaped_text)
-                
-                # Italic: *text* -> <i>text</i> (Be careful with lists)
-                # We only match * if it's not at the start of a line (list item)
-                # Or just support _text_ for italic to be safe
-                escaped_text = re.sub(r'_(.*?)_', r'<i>\1</i>', escaped_text)
-                
-                # Inline code: `text` -> <code>text</code>
-                escaped_text = re.sub(r'`(.*?)`', r'<code>\1</code>', escaped_text)
-                
-                # Lists: * item or - item -> • item
-                # Match start of string or newline, followed by * or - and a space
-                escaped_text = re.sub(r'(^|\n)[\*\-]\s+', r'\1• ', escaped_text)
-                
-                html_parts.append(escaped_text)
-        
-        return "".join(html_parts)
-
-    def send_message(self, thread_id: int, text: str, parse_mode: str = "HTML", buttons: list[str] = None, silent_mode: bool = False) -> dict:
-        """
-        Sends a message to a specific topic.
-        Converts Markdown to HTML by default.
-        """
-        # Convert text if using HTML and it looks like Markdown
-        final_text = text
-        if parse_mode == "HTML":
-            final_text = self._convert_to_html(text)
-
-        data = {
-            "chat_id": TELEGRAM_GROUP_ID,
-            "message_thread_id": thread_id,
-            "text": final_text,
-            "parse_mode": parse_mode
-        }
+async def _post(thread_id: int, text: str, buttons: list[str] = None, silent_mode: bool = False) -> asyncio.Future:
+    """Queues a message (or sends it right away without an outbox); returns the future of its delivery."""
+    if outbox:
+        return outbox.enqueue(thread_id, text, buttons=buttons, silent_mode=silent_mode)
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(await telegram.send_message(thread_id, text, buttons=buttons, silent_mode=silent_mode))
+    return future
 
-        if buttons:
-            # Create inline keyboard (1 column layout for simplicity and long text support)
-            keyboard = [[{"text": btn, "callback_data": btn[:64]}] for btn in buttons]
-            data["reply_markup"] = {"inline_keyboard": keyboard}
+async def _flush_logs(thread_id: int, ordered: bool = False):
+    """
+    Queues the thread's buffered logs. With `ordered`, also waits for the thread's queued
+    messages to go out, for messages that bypass the outbox (files, progress) and must follow them.
+    """
+    if log_buffer:
+        await log_buffer.flush(thread_id)
+    if ordered and outbox:
+        await outbox.settled(thread_id, OUTBOX_ORDER_TIMEOUT)
 
-        try:
-            # Try sending with formatting
-            result = self._make_request("POST", "sendMessage", data)
-            if result.get("ok"):
-                return result["result"]
-            else:
-                if not silent_mode:
-                    print(f"Telegram API Error: {result}", file=sys.stderr)
-        except Exception as e:
-            if not silent_mode:
-                print(f"Failed to send with {parse_mode}: {e}", file=sys.stderr)
-
-        # Fallback: Try plain text if HTML failed
-        if not silent_mode:
-            print("Retrying as plain text...", file=sys.stderr)
-        del data["parse_mode"]
-        data["text"] = text # Restore original text
-        result = self._make_request("POST", "sendMessage", data)
-        if result.get("ok"):
-            return result["result"]
-
-        raise Exception(f"Failed to send message: {result}")
-
-    def get_updates(self, offset: int = None, silent_mode: bool = False) -> list:
-        """Fetches updates from Telegram."""
-        data = {
-            "timeout": 10,  # Long polling timeout
-            "allowed_updates": ["message", "callback_query"]
-        }
-        if offset:
-            data["offset"] = offset
+async def _wait_for_answer(thread_id: int, delivery: asyncio.Future, silent_mode: bool = False) -> str:
+    """Waits for the reply to a question, failing if the question itself can never be delivered."""
+    waiter = asyncio.ensure_future(telegram.wait_for_reply(thread_id, silent_mode=silent_mode))
+    try:
+        await asyncio.wait({waiter, delivery}, return_when=asyncio.FIRST_COMPLETED)
+        if not waiter.done():
+            if delivery.cancelled():
+                # The outbox stopped (the server is shutting down) before the question went out
+                raise Exception("The question was not sent: the outbox was stopped")
+            if delivery.exception() is not None:
+                raise delivery.exception()
+        return await waiter
+    finally:
+        waiter.cancel()
 
-        try:
-            response = self.client.post(f"{API_BASE_URL}/getUpdates", json=data, timeout=15.0)
-            response.raise_for_status()
-            result = response.json()
-            if result.get("ok"):
-                return result["result"]
-            return []
-        except Exception as e:
-            if not silent_mode:
-                print(f"Error getting updates: {e}", file=sys.stderr)
-            return []
-
-    def wait_for_reply(self, thread_id: int, silent_mode: bool = False) -> str:
-        """Blocks until a user replies in the specified thread (text or button click)."""
-        if not silent_mode:
-            print(f"Waiting for reply in thread {thread_id}...", file=sys.stderr)
-        
-        updates = self.get_updates(silent_mode=silent_mode)
-        last_update_id = 0
-        if updates:
-            last_update_id = updates[-1]["update_id"]
-
-        while True:
-            updates = self.get_updates(offset=last_update_id + 1, silent_mode=silent_mode)
-            
-            for update in updates:
-                last_update_id = update["update_id"]
-                
-                # Handle Text Message
-                message = update.get("message")
-                if message:
-                    msg_thread_id = message.get("message_thread_id")
-                    chat_id = str(message.get("chat", {}).get("id"))
-                    
-                    if chat_id == TELEGRAM_GROUP_ID and msg_thread_id == thread_id:
-                        if "text" in message:
-                            return message["text"]
-
-                # Handle Button Click (Callback Query)
-                callback = update.get("callback_query")
-                if callback:
-                    message = callback.get("message")
-                    # Note: In forums, message_thread_id is inside the message object
-                    msg_thread_id = message.get("message_thread_id")
-                    chat_id = str(message.get("chat", {}).get("id"))
-
-                    if chat_id == TELEGRAM_GROUP_ID and msg_thread_id == thread_id:
-                        # Answer the callback (stop loading animation)
-                        try:
-                            self._make_request("POST", "answerCallbackQuery", {"callback_query_id": callback["id"]})
-                        except:
-                            pass
-                        
-                        selection = callback["data"]
-                        # Send a confirmation message so it appears in chat history
-                        self.send_message(thread_id, f"🔘 **Selected:** {selection}", silent_mode=silent_mode)
-                        
-                        return selection
-            
-            time.sleep(2)
+async def _send_log(thread_id: int, text: str):
+    if outbox:
+        outbox.enqueue(thread_id, text)
+        return
+    await telegram.send_message(thread_id, text, silent_mode=True)
+
+# Optional batching: broadcast_log calls are merged per thread into fewer messages
+log_buffer = LogBuffer(_send_log) if TELEGRAM_LOG_BATCHING else None
+
+metrics.gauge("telegram_rate_limiter_queue_length", "Requests currently waiting on the rate limiter",
+              lambda: telegram.rate_limiter.queue_length)
+metrics.gauge("telegram_rate_limiter_wait_seconds_total", "Total time requests waited on the rate limiter",
+              lambda: telegram.rate_limiter.total_wait)
+
+async def _send_progress(thread_id: int, text: str) -> dict:
+    return await telegram.send_message(thread_id, text, silent_mode=True)
+
+async def _edit_progress(message_id: int, text: str):
+    await telegram.edit_message(message_id, text)
+
+# Progress messages edited in place by update_progress
+progress_tracker = ProgressTracker(_send_progress, _edit_progress)
+
+# Questions asked with ask_human whose replies are collected later
+tickets = TicketBook()
+
+metrics.gauge("telegram_tickets_pending", "ask_human tickets still waiting for a reply", tickets.pending)
+if outbox:
+    metrics.gauge("telegram_outbox_pending", "Messages waiting in the outbox", lambda: outbox.stats()["pending"])
+if log_buffer:
+    metrics.gauge("telegram_log_buffer_pending_chars", "Log text waiting to be flushed", lambda: log_buffer.stats()["pending_chars"])
+
+async def _broker_stats():
+    """Broker.stats() when connected to a broker (it makes the Bot API calls), else None."""
+    if telegram.broker is None:
+        return None
+    try:
+        return await telegram.broker.stats()
+    except Exception as e:
+        print(f"Error getting stats from the broker: {e!r}", file=sys.stderr)
+        return None
+
+def _with_broker(broker_stats: dict = None) -> MetricsRegistry:
+    """This process's metrics, with the broker's added in when there is one."""
+    if broker_stats is None:
+        return metrics
+    return metrics.combined(broker_stats["metrics"])
+
+async def _collect_metrics() -> MetricsRegistry:
+    return _with_broker(await _broker_stats())
+
+# Receives the updates in webhook mode when this process talks to Telegram itself
+webhook_receiver = None
+
+async def _go_direct():
+    """Starts what the broker does otherwise: the outbox and, if configured, the webhook receiver."""
+    global webhook_receiver
+    if outbox:
+        # Sends whatever an earlier run (or the broker) left queued
+        outbox.start()
+    if TELEGRAM_UPDATE_MODE == "webhook" and webhook_receiver is None:
+        webhook_receiver = WebhookReceiver(telegram, telegram.dispatcher)
+        await webhook_receiver.start()
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """
+    Connects to the broker (see broker.py), starting it if needed. Without one (or once
+    it is gone for good), starts the outbox and the webhook receiver if configured. On
+    shutdown gives queued messages a few seconds to go out and releases connections and pollers.
+    """
+    global webhook_receiver
+    exporter = MetricsExporter(metrics, collect=_collect_metrics)
+    await exporter.start()
+    telegram.broker = await BrokerClient.connect(telegram, on_fallback=_go_direct)
+    if telegram.broker:
+        print(f"Sharing the bot through the broker at {TELEGRAM_BROKER_SOCKET}", file=sys.stderr)
+    else:
+        await _go_direct()
+    try:
+        yield
+    finally:
+        if webhook_receiver:
+            await webhook_receiver.stop()
+            webhook_receiver = None
+        if log_buffer:
+            await log_buffer.flush_all()
+        await progress_tracker.flush_all()
+        if outbox:
+            left = await outbox.drain(5.0)
+            if left:
+                print(f"{left} message(s) still queued in the outbox; they stay on disk until sent", file=sys.stderr)
+            await outbox.stop()
+        tickets.close_all()
+        await telegram.close()
+        await exporter.stop()
 
 # Initialize MCP Server
-mcp = FastMCP("Telegram Human-in-the-Loop")
-telegram = TelegramHandler()
+mcp = FastMCP("Telegram Human-in-the-Loop", lifespan=lifespan)
 
 @mcp.tool()
-def init_task_session(task_name: str) -> str:
+async def init_task_session(task_name: str, new_topic: bool = False) -> str:
     """
-    Creates a new Telegram forum topic for a task.
+    Opens the Telegram forum topic for a task.
+    Reuses the topic created earlier for the same task name, if any.
     Returns the thread_id as a string.
+
+    Args:
+        task_name: The topic name.
+        new_topic: If True, always create a fresh topic.
     """
     try:
-        thread_id = telegram.create_forum_topic(task_name)
+        thread_id = await telegram.create_forum_topic(task_name, reuse=not new_topic)
         return str(thread_id)
     except Exception as e:
         return f"Error creating task session: {str(e)}"
 
 @mcp.tool()
-def broadcast_log(thread_id: str, message: str, silent_mode: bool = False) -> str:
+async def close_stale_topics(max_idle_hours: float = 24, delete: bool = False) -> str:
+    """
+    Closes every task topic that has not been used for a while.
+    Returns a summary of the topics closed.
+
+    Args:
+        max_idle_hours: Topics unused for longer than this are closed.
+        delete: If True, delete the topics instead of closing them.
+    """
+    try:
+        names = await telegram.close_stale_topics(max_idle_hours * 3600, delete=delete)
+        if not names:
+            return "No stale topics"
+        action = "Deleted" if delete else "Closed"
+        return f"{action} {len(names)} topic(s): " + ", ".join(names)
+    except Exception as e:
+        return f"Error closing stale topics: {str(e)}"
+
+@mcp.tool()
+async def broadcast_log(thread_id: str, message: str, silent_mode: bool = False) -> str:
     """
     Sends a log message to the Telegram topic.
+    With the outbox enabled the message is queued on disk and sent in the background,
+    so it is not lost if Telegram is unreachable for a while.
     Returns a confirmation string.
 
     Args:
@@ -240,7 +214,13 @@ def broadcast_log(thread_id: str, message: str, silent_mode: bool = False) -> st
         silent_mode: If True, suppress terminal output (for Telegram mode)
     """
     try:
-        telegram.send_message(int(thread_id), message, silent_mode=silent_mode)
+        if log_buffer:
+            await log_buffer.add(int(thread_id), message)
+            return "Log queued successfully"
+        if outbox:
+            outbox.enqueue(int(thread_id), message)
+            return "Log queued successfully"
+        await telegram.send_message(int(thread_id), message, silent_mode=silent_mode)
         return "Log sent successfully"
     except Exception as e:
         if not silent_mode:
@@ -248,7 +228,7 @@ def broadcast_log(thread_id: str, message: str, silent_mode: bool = False) -> st
         return f"Error broadcasting log: {str(e)}"
 
 @mcp.tool()
-def ask_human_and_wait(thread_id: str, question: str, options: list[str] = None, silent_mode: bool = False) -> str:
+async def ask_human_and_wait(thread_id: str, question: str, options: list[str] = None, silent_mode: bool = False, timeout_s: float = None) -> str:
     """
     Sends a message to the Telegram topic and WAITS for a user reply.
     Use this to ask for the next instruction or clarification.
@@ -259,17 +239,25 @@ def ask_human_and_wait(thread_id: str, question: str, options: list[str] = None,
         options: Optional list of short strings (max 3-4) to present as buttons.
                  Example: ["Run Tests", "Deploy", "Explain Code"]
         silent_mode: If True, suppress terminal output (for Telegram mode)
+        timeout_s: Optional deadline in seconds. A reply that arrives later is kept
+                   and returned by the next wait in this thread.
 
     Returns the user's reply text (or the button label selected).
     """
     try:
-        # 1. Send the question/message with buttons
-        telegram.send_message(int(thread_id), question, buttons=options)
+        # 1. Deliver any buffered logs first so they appear before the question
+        await _flush_logs(int(thread_id))
 
-        # 2. Wait for reply (with silent mode option)
-        answer = telegram.wait_for_reply(int(thread_id), silent_mode=silent_mode)
+        # 2. Send the question/message with buttons (queued behind the logs in the outbox)
+        delivery = await _post(int(thread_id), question, buttons=options, silent_mode=silent_mode)
+
+        # 3. Wait for reply (with silent mode option), up to the deadline if there is one
+        try:
+            answer = await asyncio.wait_for(_wait_for_answer(int(thread_id), delivery, silent_mode=silent_mode), timeout_s)
+        except asyncio.TimeoutError:
+            return f"No reply within {timeout_s:g} seconds"
 
-        # 3. No auto-acknowledgement needed for natural chat flow
+        # 4. No auto-acknowledgement needed for natural chat flow
         # The Agent will reply naturally in the next turn.
 
         return answer
@@ -278,5 +266,272 @@ def ask_human_and_wait(thread_id: str, question: str, options: list[str] = None,
             print(f"Error asking human: {str(e)}", file=sys.stderr)
         return f"Error asking human: {str(e)}"
 
+@mcp.tool()
+async def send_file(thread_id: str, path: str, caption: str = None, silent_mode: bool = False) -> str:
+    """
+    Uploads a file (e.g. full test output, a build log or a diff) to the Telegram topic
+    as a document. Use this instead of broadcast_log for large artifacts.
+    Large text files are gzipped, and a file already uploaded is not uploaded again.
+
+    Args:
+        thread_id: The Telegram topic ID.
+        path: Path of the file on this machine.
+        caption: Optional short description shown under the file.
+        silent_mode: If True, suppress terminal output (for Telegram mode)
+    """
+    try:
+        await _flush_logs(int(thread_id), ordered=True)
+        message = await telegram.send_document(int(thread_id), os.path.expanduser(path), caption=caption, silent_mode=silent_mode)
+        how = {"cached": "reused earlier upload", "gzipped": "gzipped", "uploaded": "uploaded"}[message["upload"]]
+        return f"File sent successfully ({how})"
+    except Exception as e:
+        if not silent_mode:
+            print(f"Error sending file: {str(e)}", file=sys.stderr)
+        return f"Error sending file: {str(e)}"
+
+@mcp.tool()
+async def start_progress(thread_id: str, title: str) -> str:
+    """
+    Posts a progress message in the Telegram topic that update_progress then edits in place.
+    Use this for long-running steps instead of one broadcast_log per step.
+    Returns the progress handle.
+
+    Args:
+        thread_id: The Telegram topic ID.
+        title: What is in progress (e.g. "Running test suite").
+    """
+    try:
+        await _flush_logs(int(thread_id), ordered=True)
+        progress = await progress_tracker.start(int(thread_id), title)
+        return progress.handle
+    except Exception as e:
+        return f"Error starting progress: {str(e)}"
+
+@mcp.tool()
+async def update_progress(handle: str, text: str = None, percent: float = None, done: bool = False) -> str:
+    """
+    Updates a progress message started with start_progress.
+    Call it as often as you like: edits are rate-limited and merged, and only the
+    latest state is shown.
+
+    Args:
+        handle: The handle returned by start_progress.
+        text: Current status line (keeps the previous one if omitted).
+        percent: Completion from 0 to 100 (keeps the previous value if omitted).
+        done: If True, mark the progress as finished; the handle is closed.
+    """
+    try:
+        result = await progress_tracker.update(handle, text=text, percent=percent, done=done)
+        if result == "unknown":
+            return f"Error updating progress: unknown handle {handle}"
+        return {"edited": "Progress updated", "scheduled": "Progress update queued", "unchanged": "Progress unchanged"}[result]
+    except Exception as e:
+        return f"Error updating progress: {str(e)}"
+
+@mcp.tool()
+async def ask_many_and_wait(thread_ids: list[str], question: str, options: list[str] = None, mode: str = "all",
+                            quorum: int = None, timeout_s: float = None, silent_mode: bool = False) -> str:
+    """
+    Sends the same question to several Telegram topics at once and waits for their replies.
+    All topics are watched through the one shared update stream.
+
+    Args:
+        thread_ids: The Telegram topic IDs (e.g. one per sub-task).
+        question: The text to send to every topic.
+        options: Optional list of short strings to present as buttons.
+        mode: "first" returns on the first answer, "all" waits for every topic,
+              "quorum" returns once `quorum` topics have answered.
+        quorum: Number of answers needed in "quorum" mode.
+        timeout_s: Optional deadline in seconds; whatever arrived by then is returned.
+        silent_mode: If True, suppress terminal output (for Telegram mode)
+
+    Returns JSON: {"answers": {thread_id: reply}, "pending": [thread_id, ...], "errors": {thread_id: error}}.
+    Replies that arrive after the call returns are kept for the next wait in their topic.
+    """
+    if mode not in ("first", "all", "quorum"):
+        return f"Error asking humans: unknown mode {mode!r}"
+    if mode == "quorum" and not quorum:
+        return "Error asking humans: quorum mode needs a quorum"
+    needed = {"first": 1, "all": len(thread_ids), "quorum": min(quorum or 0, len(thread_ids))}[mode]
+
+    answers, errors = {}, {}
+
+    async def ask(thread_id: str) -> str:
+        await _flush_logs(int(thread_id))
+        delivery = await _post(int(thread_id), question, buttons=options, silent_mode=True)
+        return await _wait_for_answer(int(thread_id), delivery, silent_mode=True)
+
+    # 1. Send the question everywhere and start all the waits concurrently
+    tasks = {asyncio.ensure_future(ask(thread_id)): thread_id for thread_id in thread_ids}
+    deadline = None if timeout_s is None else time.monotonic() + timeout_s
+
+    # 2. Collect answers until enough have arrived, every topic is done or the deadline passes
+    pending = set(tasks)
+    try:
+        while pending and len(answers) < needed:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                try:
+                    answers[tasks[task]] = task.result()
+                except Exception as e:
+                    errors[tasks[task]] = str(e)
+                    if not silent_mode:
+                        print(f"Error asking human in thread {tasks[task]}: {str(e)}", file=sys.stderr)
+            # Topics that failed can never answer
+            needed = min(needed, len(thread_ids) - len(errors))
+    finally:
+        # 3. Stop waiting on the rest; their replies stay in the journal
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    return json.dumps({
+        "answers": answers,
+        "pending": [thread_id for thread_id in thread_ids if thread_id not in answers and thread_id not in errors],
+        "errors": errors,
+    }, ensure_ascii=False)
+
+@mcp.tool()
+async def ask_human(thread_id: str, question: str, options: list[str] = None, silent_mode: bool = False) -> str:
+    """
+    Sends a question to the Telegram topic WITHOUT waiting for the reply.
+    Returns a ticket id at once; keep working and collect the answer later with
+    check_reply or await_reply.
+
+    Args:
+        thread_id: The Telegram topic ID.
+        question: The text to send.
+        options: Optional list of short strings (max 3-4) to present as buttons.
+        silent_mode: If True, suppress terminal output (for Telegram mode)
+    """
+    try:
+        # 1. Deliver any buffered logs first so they appear before the question
+        await _flush_logs(int(thread_id))
+
+        # 2. Send the question/message with buttons
+        delivery = await _post(int(thread_id), question, buttons=options, silent_mode=silent_mode)
+
+        # 3. Wait for the reply in the background
+        ticket = tickets.open(int(thread_id), question, _wait_for_answer(int(thread_id), delivery, silent_mode=True))
+        return ticket.id
+    except Exception as e:
+        if not silent_mode:
+            print(f"Error asking human: {str(e)}", file=sys.stderr)
+        return f"Error asking human: {str(e)}"
+
+@mcp.tool()
+async def check_reply(ticket: str) -> str:
+    """
+    Checks whether the question behind an ask_human ticket has been answered, without waiting.
+    Returns JSON with "status" ("pending", "answered", "failed" or "unknown") and, once
+    answered, the "reply". An answered ticket is closed after it is returned.
+
+    Args:
+        ticket: The ticket id returned by ask_human.
+    """
+    entry = tickets.get(ticket)
+    if entry is None:
+        return json.dumps({"ticket": ticket, "status": "unknown"})
+    status = entry.status()
+    if status["status"] != "pending":
+        tickets.close(ticket)
+    return json.dumps(status)
+
+@mcp.tool()
+async def await_reply(ticket: str, timeout_s: float = 60) -> str:
+    """
+    Waits up to `timeout_s` seconds for the answer to an ask_human ticket.
+    Returns the same JSON as check_reply; on timeout the status is still "pending"
+    and the ticket stays open.
+
+    Args:
+        ticket: The ticket id returned by ask_human.
+        timeout_s: How long to wait before returning.
+    """
+    entry = tickets.get(ticket)
+    if entry is None:
+        return json.dumps({"ticket": ticket, "status": "unknown"})
+    # asyncio.wait never cancels the ticket's own wait when it times out
+    await asyncio.wait({entry.task}, timeout=timeout_s)
+    return await check_reply(ticket)
+
+@mcp.tool()
+async def get_thread_history(thread_id: str, limit: int = 20, since: float = None) -> str:
+    """
+    Returns the recent messages of a Telegram topic as JSON, oldest first: what the bot
+    sent, what humans wrote and which buttons they clicked. Use this to catch up on a
+    task topic after a context reset.
+    Only what this server has seen since it started is available, up to a bounded number
+    of messages per topic.
+
+    Args:
+        thread_id: The Telegram topic ID.
+        limit: Return at most this many of the latest messages.
+        since: Only messages after this Unix timestamp (e.g. the "ts" of the last one you saw).
+    """
+    try:
+        entries = telegram.history.get(int(thread_id), limit=limit, since=since)
+        return json.dumps([entry.to_dict() for entry in entries], ensure_ascii=False, indent=2)
+    except Exception as e:
+        return f"Error getting thread history: {str(e)}"
+
+@mcp.tool()
+async def get_outbox_status() -> str:
+    """
+    Returns the state of the outbox as JSON: messages still waiting to be sent (in total,
+    per topic and how many are backing off after an error), the age of the oldest one,
+    and messages dropped because Telegram rejected them.
+    """
+    if not outbox:
+        return json.dumps({"enabled": False})
+    try:
+        return json.dumps({"enabled": True, **outbox.stats()}, indent=2)
+    except Exception as e:
+        return f"Error getting outbox status: {str(e)}"
+
+@mcp.tool()
+async def get_server_stats() -> str:
+    """
+    Returns server metrics as JSON: Bot API latency and outcomes per method, bytes sent,
+    429 retries, HTML repaired locally and plain-text fallbacks, human reply wait times per thread,
+    and the state of the rate limiter, outbox, progress messages, thread history, button
+    registry and log buffer. With a broker, the calls it made for this and the other servers
+    are included, and "broker" shows its clients and outbox.
+    """
+    broker_stats = await _broker_stats()
+    registry = _with_broker(broker_stats)
+    stats = {
+        "uptime_seconds": round(time.time() - metrics.started, 1),
+        "metrics": registry.snapshot(),
+        "rate_limiter": telegram.rate_limiter.stats(),
+    }
+    if broker_stats is not None:
+        # Only uploads use this process's limiter; everything else queues in the broker's
+        stats["rate_limiter"] = combine_stats(stats["rate_limiter"], broker_stats["rate_limiter"])
+        stats["broker"] = {"clients": broker_stats["clients"], "calls": broker_stats["calls"], "outbox": broker_stats["outbox"]}
+    # Messages sent by the broker were checked there
+    checked_counter = registry.counter(html_checked.name, html_checked.description)
+    fallbacks = sum(registry.counter(html_fallbacks.name, html_fallbacks.description).values.values())
+    checked = sum(checked_counter.values.values())
+    if checked:
+        # Each server-side fallback costs a rejected sendMessage plus a resend
+        stats["html"] = {
+            "checked": checked,
+            "repaired_locally": checked_counter.values.get((("outcome", "repaired"),), 0),
+            "server_fallbacks": fallbacks,
+            "server_fallback_rate": round(fallbacks / checked, 4),
+        }
+    if outbox:
+        stats["outbox"] = outbox.stats()
+    stats["progress"] = progress_tracker.stats()
+    stats["history"] = telegram.history.stats()
+    stats["callbacks"] = telegram.callbacks.stats()
+    if log_buffer:
+        stats["log_buffer"] = log_buffer.stats()
+    return json.dumps(stats, indent=2)
+
 if __name__ == "__main__":
     mcp.run()
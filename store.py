@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import sqlite3
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+STATE_DB_PATH = os.getenv("TELEGRAM_STATE_DB") or os.path.join(script_dir, "telegram_state.db")
+
+# Reuse a registered topic only if it was used within this many seconds (0 = forever)
+TOPIC_TTL_SECONDS = float(os.getenv("TELEGRAM_TOPIC_TTL", "0"))
+
+# Journal entries are kept this long, then pruned: consumed ones and replies nobody waited for alike
+JOURNAL_RETENTION_SECONDS = 7 * 24 * 3600
+# A long-running process prunes again this often
+PRUNE_INTERVAL_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal (
+    update_id INTEGER PRIMARY KEY,
+    thread_id INTEGER,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    consumed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS journal_thread ON journal (thread_id, consumed, ts);
+CREATE TABLE IF NOT EXISTS topics (
+    name TEXT PRIMARY KEY,
+    thread_id INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS topics_thread ON topics (thread_id);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    thread_id INTEGER NOT NULL,
+    created REAL NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    sent_chunks INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_thread ON outbox (status, thread_id, id);
+CREATE TABLE IF NOT EXISTS uploads (
+    sha256 TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+# Columns added since a table was first created, added to older databases on open: (table, column, definition)
+MIGRATIONS = [
+    ("outbox", "owner", "TEXT"),
+    ("outbox", "lease_until", "REAL NOT NULL DEFAULT 0"),
+    ("outbox", "sent_chunks", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+class StateStore:
+    """
+    Small local SQLite store (WAL mode) that makes update handling survive restarts.
+    It keeps the last confirmed getUpdates offset and a journal of every incoming
+    message and callback_query, so replies are never lost between polls or processes.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        # Autocommit mode; multi-statement writes use explicit transactions
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self._pruned = 0.0
+        self.prune()
+
+    def close(self):
+        self.conn.close()
+
+    def _migrate(self):
+        for table, column, definition in MIGRATIONS:
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column in columns:
+                continue
+            try:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            except sqlite3.OperationalError:
+                # Another process opening the same database added it first
+                if column not in {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}:
+                    raise
+
+    def get_offset(self):
+        """The next update_id to request, or None if nothing was ever confirmed."""
+        row = self.conn.execute("SELECT value FROM state WHERE key = 'offset'").fetchone()
+        return int(row[0]) if row else None
+
+    def record_updates(self, entries: list[tuple[dict, int]], offset: int = None):
+        """
+        Journals (update, thread_id) pairs and advances the offset in one transaction,
+        so an update is only confirmed to Telegram once it is safely on disk.
+        """
+        now = time.time()
+        if now - self._pruned > PRUNE_INTERVAL_SECONDS:
+            self.prune()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO journal (update_id, thread_id, ts, kind, payload) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (update["update_id"], thread_id, now, "callback_query" if "callback_query" in update else "message", json.dumps(update))
+                    for update, thread_id in entries
+                ],
+            )
+            if offset is not None:
+                self.conn.execute(
+                    "INSERT INTO state (key, value) VALUES ('offset', ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (str(offset),),
+                )
+
+    def next_reply(self, thread_id: int):
+        """The oldest unconsumed journal entry for the thread as (update_id, update), or None."""
+        row = self.conn.execute(
+            "SELECT update_id, payload FROM journal WHERE thread_id IS ? AND consumed = 0 ORDER BY ts, update_id LIMIT 1",
+            (thread_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def consume(self, update_id: int) -> bool:
+        """Marks an entry as handled. Returns False if another waiter got to it first."""
+        cursor = self.conn.execute("UPDATE journal SET consumed = 1 WHERE update_id = ? AND consumed = 0", (update_id,))
+        return cursor.rowcount == 1
+
+    def release(self, update_id: int):
+        """Puts a consumed entry back, e.g. when its waiter was cancelled before handing it over."""
+        self.conn.execute("UPDATE journal SET consumed = 0 WHERE update_id = ?", (update_id,))
+
+    def prune(self, retention: float = JOURNAL_RETENTION_SECONDS):
+        """Deletes journal entries older than `retention`, read or not, and old failed outbox entries."""
+        self._pruned = time.time()
+        cutoff = self._pruned - retention
+        self.conn.execute("DELETE FROM journal WHERE ts < ?", (cutoff,))
+        self.conn.execute("DELETE FROM outbox WHERE status = 'failed' AND created < ?", (cutoff,))
+
+
+class TopicRegistry:
+    """
+    Persistent name -> message_thread_id map, so a task name maps to one forum topic
+    instead of a new topic per session. Entries expire `ttl` seconds after last use.
+    """
+
+    def __init__(self, store: StateStore, ttl: float = TOPIC_TTL_SECONDS):
+        self.conn = store.conn
+        self.ttl = ttl
+
+    def lookup(self, name: str):
+        """The thread_id registered under `name` if it has not expired, else None."""
+        row = self.conn.execute("SELECT thread_id, last_used FROM topics WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        thread_id, last_used = row
+        if self.ttl and time.time() - last_used > self.ttl:
+            return None
+        self.touch(thread_id)
+        return thread_id
+
+    def register(self, name: str, thread_id: int):
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO topics (name, thread_id, created, last_used) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET thread_id = excluded.thread_id, created = excluded.created, last_used = excluded.last_used",
+            (name, thread_id, now, now),
+        )
+
+    def touch(self, thread_id: int):
+        self.conn.execute("UPDATE topics SET last_used = ? WHERE thread_id = ?", (time.time(), thread_id))
+
+    def forget(self, thread_id: int):
+        self.conn.execute("DELETE FROM topics WHERE thread_id = ?", (thread_id,))
+
+    def stale(self, max_idle: float) -> list[tuple[str, int]]:
+        """(name, thread_id) of topics unused for more than `max_idle` seconds, oldest first."""
+        return self.conn.execute(
+            "SELECT name, thread_id FROM topics WHERE last_used < ? ORDER BY last_used",
+            (time.time() - max_idle,),
+        ).fetchall()
+
+    def cleanup(self) -> int:
+        """Drops entries past the TTL. Returns how many were removed."""
+        if not self.ttl:
+            return 0
+        cursor = self.conn.execute("DELETE FROM topics WHERE last_used < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+
+class UploadCache:
+    """
+    Persistent content hash -> Telegram file_id map, so a file that was uploaded once
+    is sent again by reference instead of being uploaded a second time.
+    """
+
+    def __init__(self, store: StateStore):
+        self.conn = store.conn
+
+    def lookup(self, sha256: str):
+        """(file_id, file_name) of an earlier upload of this content, or None."""
+        row = self.conn.execute("SELECT file_id, file_name FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE uploads SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+        return row[0], row[1]
+
+    def register(self, sha256: str, file_id: str, file_name: str, size: int):
+        self.conn.execute(
+            "INSERT INTO uploads (sha256, file_id, file_name, size, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (sha256) DO UPDATE SET file_id = excluded.file_id, file_name = excluded.file_name, "
+            "size = excluded.size, last_used = excluded.last_used",
+            (sha256, file_id, file_name, size, time.time()),
+        )
+
+    def forget(self, sha256: str):
+        self.conn.execute("DELETE FROM uploads WHERE sha256 = ?", (sha256,))
+
+
+class OutboxQueue:
+    """
+    Messages waiting to be sent, on disk, so they survive outages and restarts.
+    Every pending entry belongs to one process (its `owner`) that holds a lease on it
+    and keeps renewing it; only the owner sends it, so processes sharing the database
+    never send each other's messages. Entries whose lease ran out (their process died
+    or stopped) are adopted by the next process that looks, and entries added without
+    an owner (by a server whose broker sends them) are adopted by the broker.
+    Entries are taken oldest first within a thread; an entry that keeps failing is
+    deferred (with its thread behind it), and one that can never be sent is marked failed.
+    """
+
+    def __init__(self, store: StateStore):
+        self.conn = store.conn
+
+    def add(self, thread_id: int, payload: dict, owner: str = None, lease_until: float = 0.0) -> int:
+        cursor = self.conn.execute(
+            "INSERT INTO outbox (thread_id, created, payload, owner, lease_until) VALUES (?, ?, ?, ?, ?)",
+            (thread_id, time.time(), json.dumps(payload), owner, lease_until),
+        )
+        return cursor.lastrowid
+
+    def adopt(self, owner: str, lease_until: float) -> int:
+        """Takes over the pending entries nobody holds a lease on, due at once. Returns how many."""
+        cursor = self.conn.execute(
+            "UPDATE outbox SET owner = ?, lease_until = ?, next_attempt = 0 "
+            "WHERE status = 'pending' AND lease_until < ? AND owner IS NOT ?",
+            (owner, lease_until, time.time(), owner),
+        )
+        return cursor.rowcount
+
+    def renew(self, owner: str, lease_until: float):
+        self.conn.execute("UPDATE outbox SET lease_until = ? WHERE status = 'pending' AND owner = ?", (lease_until, owner))
+
+    def release(self, owner: str):
+        """Gives up the owner's pending entries, so whichever process looks next sends them."""
+        self.conn.execute("UPDATE outbox SET lease_until = 0 WHERE status = 'pending' AND owner = ?", (owner,))
+
+    def heads(self, owner: str) -> list[tuple[int, float]]:
+        """(thread_id, next_attempt) of every thread with pending entries of the owner, from its oldest one."""
+        return self.conn.execute(
+            "SELECT thread_id, next_attempt FROM outbox WHERE id IN "
+            "(SELECT MIN(id) FROM outbox WHERE status = 'pending' AND owner = ? GROUP BY thread_id)",
+            (owner,),
+        ).fetchall()
+
+    def next_for(self, thread_id: int, owner: str):
+        """
+        The owner's oldest pending entry in the thread as (id, payload, attempts, next_attempt, sent_chunks),
+        or None. `sent_chunks` is how many parts of a long message are already delivered.
+        """
+        row = self.conn.execute(
+            "SELECT id, payload, attempts, next_attempt, sent_chunks FROM outbox "
+            "WHERE status = 'pending' AND thread_id = ? AND owner = ? ORDER BY id LIMIT 1",
+            (thread_id, owner),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2], row[3], row[4]
+
+    def chunk_sent(self, entry_id: int, sent_chunks: int):
+        """Records that the first `sent_chunks` parts of the entry's message are delivered."""
+        self.conn.execute("UPDATE outbox SET sent_chunks = ? WHERE id = ?", (sent_chunks, entry_id))
+
+    def remove(self, entry_id: int):
+        self.conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+    def defer(self, entry_id: int, attempts: int, next_attempt: float, error: str):
+        self.conn.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+            (attempts, next_attempt, error, entry_id),
+        )
+
+    def retry_now(self, owner: str) -> int:
+        """Makes the owner's deferred entries due again (e.g. once sending works again). Returns how many."""
+        cursor = self.conn.execute(
+            "UPDATE outbox SET next_attempt = 0 WHERE status = 'pending' AND owner = ? AND next_attempt > 0", (owner,)
+        )
+        return cursor.rowcount
+
+    def pending(self, owner: str) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending' AND owner = ?", (owner,)).fetchone()[0]
+
+    def fail(self, entry_id: int, error: str):
+        self.conn.execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, entry_id))
+
+    def depth(self) -> dict:
+        """Pending entries per thread, failed entries, and the age of the oldest pending one."""
+        now = time.time()
+        per_thread = dict(self.conn.execute(
+            "SELECT thread_id, COUNT(*) FROM outbox WHERE status = 'pending' GROUP BY thread_id"
+        ).fetchall())
+        oldest, deferred = self.conn.execute(
+            "SELECT MIN(created), SUM(next_attempt > ?) FROM outbox WHERE status = 'pending'", (now,)
+        ).fetchone()
+        failed = self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+        return {
+            "pending": sum(per_thread.values()),
+            "deferred": deferred or 0,
+            "failed": failed,
+            "oldest_pending_seconds": round(now - oldest, 1) if oldest else 0.0,
+            "pending_by_thread": per_thread,
+        }
@@ -0,0 +1,747 @@
+import os
+import sys
+import time
+import asyncio
+import importlib.util
+import httpx
+from dotenv import load_dotenv
+
+# Load environment variables from the script's directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(script_dir, '.env')
+load_dotenv(env_path)
+
+# Imported after .env is loaded, since they read their own settings at import time
+from rate_limiter import RateLimiter, backoff_delay
+from history import ThreadHistory
+from callbacks import CallbackRegistry, button_text
+from store import StateStore, TopicRegistry, UploadCache, OutboxQueue
+from uploads import PreparedUpload, file_digest, MAX_UPLOAD_SIZE
+from metrics import api_latency, api_requests, api_bytes_sent, api_retries, html_checked, html_repairs, html_fallbacks, reply_wait, file_uploads
+from formatting import markdown_to_html, repair_html, split_html, split_text, html_to_text
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_GROUP_ID = os.getenv("TELEGRAM_GROUP_ID")
+
+# Point this at a local Bot API server (or the fake in benchmarks/) instead of api.telegram.org
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
+API_BASE_URL = f"{TELEGRAM_API_BASE_URL}/bot{TELEGRAM_BOT_TOKEN}"
+
+# HTTP/2 is optional: it needs the `h2` package (pip install "httpx[http2]")
+TELEGRAM_HTTP2 = os.getenv("TELEGRAM_HTTP2", "").lower() in ("1", "true", "yes")
+
+# One pooled client is shared by every call, so sends and long polls reuse warm connections
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+
+# "polling" (getUpdates) or "webhook" (see webhook.py for its settings)
+TELEGRAM_UPDATE_MODE = os.getenv("TELEGRAM_UPDATE_MODE", "polling").lower()
+
+# Seconds Telegram holds a getUpdates call open when nothing arrives (Telegram allows up to 50)
+TELEGRAM_POLL_TIMEOUT = min(50, max(0, int(os.getenv("TELEGRAM_POLL_TIMEOUT", "50"))))
+# The HTTP timeout of a long poll is the poll timeout plus this margin
+POLL_TIMEOUT_MARGIN = 10.0
+# Back-off after a failed poll doubles from the first value up to the second, with jitter
+POLL_BACKOFF_INITIAL = 1.0
+POLL_BACKOFF_MAX = 60.0
+# On a first run, updates dated this long before the start still count as new (allows for clock skew)
+BACKLOG_MARGIN = 60.0
+
+# How many times a request is re-queued after a 429 before giving up
+MAX_RATE_LIMIT_RETRIES = 5
+
+# Uploads may take much longer than a JSON call to send their body
+UPLOAD_TIMEOUT = httpx.Timeout(30.0, write=300.0)
+
+# Telegram's limit for document captions
+MAX_CAPTION_LENGTH = 1024
+
+# 400 descriptions meaning the topic itself can't be posted to (deleted or closed by hand)
+TOPIC_GONE_ERRORS = ("thread not found", "TOPIC_CLOSED", "TOPIC_DELETED")
+
+class TelegramHandler:
+    """
+    Bot API client for one forum group. Creating it is cheap: the credentials are
+    checked and the HTTP client, state database and update poller are set up on first use.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._client = None
+        self.rate_limiter = RateLimiter()
+        # Recent messages per thread, in both directions
+        self.history = ThreadHistory()
+        # callback_data tokens of the buttons sent -> their options
+        self.callbacks = CallbackRegistry()
+        self._dispatcher = None
+        self._store = None
+        self._topics = None
+        self._uploads = None
+        self._outbox_queue = None
+        # A connected broker.BrokerClient when another process owns the bot (see broker.py)
+        self.broker = None
+
+    async def close(self):
+        """Stops the update poller and closes the pooled connections."""
+        if self.broker is not None:
+            await self.broker.close()
+            self.broker = None
+        if self._dispatcher is not None:
+            await self._dispatcher.stop()
+            self._dispatcher = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+            self._topics = None
+            self._uploads = None
+            self._outbox_queue = None
+
+    async def _make_request(self, method: str, endpoint: str, data: dict = None, files: dict = None):
+        """
+        Calls a Bot API method with `data` as JSON, or as multipart form fields when
+        `files` ({field: (file_name, open binary file)}) are uploaded with it.
+        """
+        if self.broker is not None and not files:
+            # The broker's connection pool and rate limiter serve every process on this machine
+            return await self.broker.call(endpoint, data)
+
+        url = f"{API_BASE_URL}/{endpoint}"
+        chat_id = data.get("chat_id") if data else None
+        thread_id = data.get("message_thread_id") if data else None
+
+        retries = 0
+        while True:
+            # Queue behind the rate limiter instead of provoking a 429
+            waited = await self.rate_limiter.acquire(chat_id, thread_id)
+            if waited >= 1:
+                print(f"Rate limiter delayed {endpoint} by {waited:.1f}s", file=sys.stderr)
+
+            start = time.perf_counter()
+            response = None
+            try:
+                if files:
+                    # Streamed from the start again on every attempt
+                    for _, file in files.values():
+                        file.seek(0)
+                    # Multipart form fields are strings
+                    fields = {key: str(value) for key, value in data.items()}
+                    response = await self.client.request(method, url, data=fields, files=files, timeout=UPLOAD_TIMEOUT)
+                else:
+                    response = await self.client.request(method, url, json=data)
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPStatusError as e:
+                retry_after = self._retry_after(e.response)
+                if retry_after is not None and retries < MAX_RATE_LIMIT_RETRIES:
+                    retries += 1
+                    api_retries.inc(method=endpoint)
+                    self.rate_limiter.pause(retry_after, chat_id)
+                    print(f"Rate limited on {endpoint}, retrying in {retry_after}s", file=sys.stderr)
+                    continue
+                print(f"Error calling Telegram API: {e.response.text}", file=sys.stderr)
+                raise
+            except Exception as e:
+                print(f"Unexpected error: {e}", file=sys.stderr)
+                raise
+            finally:
+                self._observe(endpoint, start, response)
+
+    @staticmethod
+    def _observe(endpoint: str, start: float, response: httpx.Response = None):
+        """Records latency, outcome and bytes sent for one Bot API call."""
+        api_latency.observe(time.perf_counter() - start, method=endpoint)
+        if response is None:
+            api_requests.inc(method=endpoint, status="network_error")
+            return
+        api_requests.inc(method=endpoint, status=str(response.status_code))
+        api_bytes_sent.inc(int(response.request.headers.get("content-length", 0)), method=endpoint)
+
+    @staticmethod
+    def _retry_after(response: httpx.Response):
+        """Returns the back-off Telegram asked for on a 429, or None for any other error."""
+        if response.status_code != 429:
+            return None
+        try:
+            return float(response.json().get("parameters", {}).get("retry_after", 1))
+        except (ValueError, AttributeError):
+            return 1.0
+
+    async def create_forum_topic(self, name: str, reuse: bool = True) -> int:
+        """
+        Returns the message_thread_id of the forum topic for `name`.
+        Reuses the topic registered under that name unless `reuse` is False or the
+        entry has expired; otherwise creates a new topic and registers it.
+        """
+        if reuse:
+            thread_id = self.topics.lookup(name)
+            if thread_id is not None:
+                return thread_id
+
+        data = {
+            "chat_id": TELEGRAM_GROUP_ID,
+            "name": name
+        }
+        result = await self._make_request("POST", "createForumTopic", data)
+        if result.get("ok"):
+            thread_id = result["result"]["message_thread_id"]
+            self.topics.register(name, thread_id)
+            return thread_id
+        raise Exception(f"Failed to create topic: {result}")
+
+    async def close_stale_topics(self, max_idle: float, delete: bool = False) -> list[str]:
+        """
+        Closes (or deletes) every registered topic unused for `max_idle` seconds and
+        removes it from the registry. Returns the names of the topics handled.
+        """
+        self.topics.cleanup()
+        endpoint = "deleteForumTopic" if delete else "closeForumTopic"
+        handled = []
+        for name, thread_id in self.topics.stale(max_idle):
+            data = {
+                "chat_id": TELEGRAM_GROUP_ID,
+                "message_thread_id": thread_id
+            }
+            try:
+                await self._make_request("POST", endpoint, data)
+            except httpx.HTTPStatusError as e:
+                # Already closed or deleted by hand: nothing left to do but forget it
+                if e.response.status_code != 400:
+                    raise
+            self.topics.forget(thread_id)
+            handled.append(name)
+        return handled
+
+    def _convert_to_html(self, text: str) -> str:
+        """
+        Converts standard Markdown to Telegram-supported HTML.
+        Handles code blocks, inline code, bold, and italic.
+        The result is checked against Telegram's HTML rules and fixed locally, so a
+        message is never sent only to be rejected and resent as plain text.
+        """
+        result, fixes = repair_html(markdown_to_html(text))
+        html_checked.inc(outcome="repaired" if fixes else "valid")
+        for fix in fixes:
+            html_repairs.inc(kind=fix)
+        return result
+
+    async def send_message(self, thread_id: int, text: str, parse_mode: str = "HTML", buttons: list[str] = None,
+                           silent_mode: bool = False, callback_data: list[str] = None,
+                           sent_chunks: int = 0, on_chunk_sent=None) -> dict:
+        """
+        Sends a message to a specific topic.
+        Converts Markdown to HTML by default. Text over Telegram's length limit goes out
+        as several messages, in order, with the buttons on the last one. The buttons'
+        callback_data is registered here unless it was registered beforehand (see outbox.py).
+        To resume a long message, `sent_chunks` skips the parts an earlier attempt delivered;
+        on_chunk_sent(count) is called with the number delivered after each part.
+        """
+        # Convert text if using HTML and it looks like Markdown
+        if parse_mode == "HTML":
+            chunks = split_html(self._convert_to_html(text))
+        else:
+            chunks = split_text(text)
+
+        reply_markup = None
+        if buttons:
+            # Short tokens rather than the option text, which may not fit in callback_data's 64 bytes
+            if callback_data is None:
+                callback_data = self.callbacks.register(thread_id, text, buttons)
+            # Create inline keyboard (1 column layout for simplicity and long text support)
+            keyboard = [[{"text": btn, "callback_data": data}] for btn, data in zip(buttons, callback_data)]
+            reply_markup = {"inline_keyboard": keyboard}
+
+        self.topics.touch(thread_id)
+        if self.broker is not None:
+            # Hear about replies in this thread, for the history
+            self.broker.subscribe(thread_id)
+
+        result = None
+        for i, chunk in enumerate(chunks):
+            if i < sent_chunks:
+                continue
+            if len(chunks) == 1:
+                fallback_text = text
+            elif parse_mode == "HTML":
+                fallback_text = html_to_text(chunk)
+            else:
+                fallback_text = chunk
+            last = i == len(chunks) - 1
+            result = await self._send_chunk(thread_id, chunk, parse_mode, fallback_text, reply_markup if last else None, silent_mode)
+            if on_chunk_sent is not None:
+                on_chunk_sent(i + 1)
+
+        self._record_sent(thread_id, text, buttons, result)
+        return result
+
+    def _record_update(self, thread_id: int, update: dict):
+        """Adds an incoming message or button click to the thread's history."""
+        callback = update.get("callback_query")
+        self.history.record_update(thread_id, update, self._resolve_click(callback)[1] if callback else None)
+
+    def _resolve_click(self, callback: dict):
+        """
+        (ButtonQuestion, option) of a button click. For buttons the registry doesn't know,
+        the question is None and the option comes from the message's keyboard, or is the raw data.
+        """
+        data = callback.get("data", "")
+        resolved = self.callbacks.resolve(data)
+        if resolved is not None:
+            return resolved
+        return None, button_text(callback) or data
+
+    def _record_sent(self, thread_id: int, text: str, buttons: list[str], message: dict):
+        """Adds a message the bot sent to the thread's history, with its buttons."""
+        recorded = text + ("\n[" + " | ".join(buttons) + "]" if buttons else "")
+        self.history.record(thread_id, recorded, True, message_id=message.get("message_id") if message else None)
+
+    async def _send_chunk(self, thread_id: int, text: str, parse_mode: str, fallback_text: str, reply_markup: dict = None, silent_mode: bool = False) -> dict:
+        """Sends one message, resending it as plain `fallback_text` if Telegram rejects the formatting."""
+        data = {
+            "chat_id": TELEGRAM_GROUP_ID,
+            "message_thread_id": thread_id,
+            "text": text
+        }
+        if parse_mode:
+            data["parse_mode"] = parse_mode
+        if reply_markup:
+            data["reply_markup"] = reply_markup
+
+        try:
+            # Try sending with formatting
+            result = await self._make_request("POST", "sendMessage", data)
+            if result.get("ok"):
+                return result["result"]
+            else:
+                if not silent_mode:
+                    print(f"Telegram API Error: {result}", file=sys.stderr)
+                if not parse_mode:
+                    raise Exception(f"Failed to send message: {result}")
+        except httpx.HTTPStatusError as e:
+            # Only a rejected formatted message (e.g. bad entities) is worth resending as plain text;
+            # rate limits are already retried by _make_request and anything else would fail again
+            if e.response.status_code != 400 or self._topic_gone(thread_id, e.response) or not parse_mode:
+                raise
+            if not silent_mode:
+                print(f"Failed to send with {parse_mode}: {e}", file=sys.stderr)
+
+        # Fallback: Try plain text if HTML failed
+        html_fallbacks.inc()
+        if not silent_mode:
+            print("Retrying as plain text...", file=sys.stderr)
+        data.pop("parse_mode", None)
+        data["text"] = fallback_text
+        result = await self._make_request("POST", "sendMessage", data)
+        if result.get("ok"):
+            return result["result"]
+
+        raise Exception(f"Failed to send message: {result}")
+
+    def _topic_gone(self, thread_id: int, response: httpx.Response) -> bool:
+        """
+        Whether a 400 says the topic was deleted or closed in Telegram. If so the topic is
+        forgotten, so its task name gets a new one instead of the dead one again.
+        """
+        if not any(error in response.text for error in TOPIC_GONE_ERRORS):
+            return False
+        self.topics.forget(thread_id)
+        return True
+
+    async def edit_message(self, message_id: int, text: str, parse_mode: str = "HTML") -> None:
+        """
+        Replaces the text of a message the bot sent earlier.
+        Converts Markdown to HTML by default; an edit that would not change anything is ignored.
+        """
+        data = {
+            "chat_id": TELEGRAM_GROUP_ID,
+            "message_id": message_id,
+            "text": self._convert_to_html(text) if parse_mode == "HTML" else text,
+            "parse_mode": parse_mode
+        }
+        try:
+            await self._make_request("POST", "editMessageText", data)
+        except httpx.HTTPStatusError as e:
+            # Telegram refuses edits to identical content; the message already shows it
+            if e.response.status_code != 400 or "message is not modified" not in e.response.text:
+                raise
+
+    async def send_document(self, thread_id: int, path: str, caption: str = None, silent_mode: bool = False) -> dict:
+        """
+        Sends a file from disk to a topic as a document, streaming it in a multipart upload.
+        Large text files are gzipped first, and content that was uploaded before is sent
+        again by its Telegram file_id instead of being uploaded a second time.
+        Returns the sent message with an extra "upload" key: "cached", "gzipped" or "uploaded".
+        """
+        if not os.path.isfile(path):
+            raise Exception(f"File not found: {path}")
+
+        data = {
+            "chat_id": TELEGRAM_GROUP_ID,
+            "message_thread_id": thread_id
+        }
+        if caption:
+            html_caption = self._convert_to_html(caption)
+            if len(html_caption) <= MAX_CAPTION_LENGTH:
+                data["caption"] = html_caption
+                data["parse_mode"] = "HTML"
+            else:
+                data["caption"] = caption[:MAX_CAPTION_LENGTH]
+
+        self.topics.touch(thread_id)
+
+        # Hashing (and gzipping below) reads the whole file, so keep it off the event loop
+        digest = await asyncio.to_thread(file_digest, path)
+        cached = self.uploads.lookup(digest)
+        if cached:
+            file_id, _ = cached
+            try:
+                result = await self._make_request("POST", "sendDocument", {**data, "document": file_id})
+                if result.get("ok"):
+                    file_uploads.inc(how="cached")
+                    self.history.record(thread_id, caption or cached[1], True, "document", message_id=result["result"].get("message_id"))
+                    return {**result["result"], "upload": "cached"}
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 400 or self._topic_gone(thread_id, e.response):
+                    raise
+                if not silent_mode:
+                    print(f"Cached file_id was rejected, uploading again: {e.response.text}", file=sys.stderr)
+            self.uploads.forget(digest)
+
+        prepared = await asyncio.to_thread(PreparedUpload, path)
+        with prepared:
+            if prepared.size > MAX_UPLOAD_SIZE:
+                raise Exception(f"File too large for Telegram ({prepared.size / 1024 / 1024:.1f} MB, max 50 MB)")
+            with open(prepared.path, "rb") as f:
+                result = await self._make_request("POST", "sendDocument", data, files={"document": (prepared.file_name, f)})
+
+        if not result.get("ok"):
+            raise Exception(f"Failed to send file: {result}")
+        message = result["result"]
+        document = message.get("document")
+        if document:
+            self.uploads.register(digest, document["file_id"], prepared.file_name, prepared.size)
+        self.history.record(thread_id, caption or prepared.file_name, True, "document", message_id=message.get("message_id"))
+        how = "gzipped" if prepared.compressed else "uploaded"
+        file_uploads.inc(how=how)
+        return {**message, "upload": how}
+
+    async def get_updates(self, offset: int = None, timeout: int = TELEGRAM_POLL_TIMEOUT) -> list:
+        """
+        Long-polls Telegram for updates, waiting up to `timeout` seconds for one to arrive.
+        Raises on network errors and on error responses (e.g. a 409 when another
+        poller or a webhook is active for the bot).
+        """
+        data = {
+            "timeout": timeout,  # Long polling timeout
+            "allowed_updates": ["message", "callback_query"]
+        }
+        if offset:
+            data["offset"] = offset
+
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.client.post(f"{API_BASE_URL}/getUpdates", json=data, timeout=timeout + POLL_TIMEOUT_MARGIN)
+            response.raise_for_status()
+            result = response.json()
+            if not result.get("ok"):
+                raise Exception(f"Failed to get updates: {result}")
+            return result["result"]
+        finally:
+            self._observe("getUpdates", start, response)
+
+    async def set_webhook(self, url: str, secret: str, drop_pending_updates: bool = False):
+        """
+        Asks Telegram to POST updates to `url`, signed with `secret`, instead of queuing them for getUpdates.
+        With `drop_pending_updates`, the updates queued so far are discarded instead of delivered.
+        """
+        data = {
+            "url": url,
+            "secret_token": secret,
+            "allowed_updates": ["message", "callback_query"],
+            "drop_pending_updates": drop_pending_updates
+        }
+        result = await self._make_request("POST", "setWebhook", data)
+        if not result.get("ok"):
+            raise Exception(f"Failed to set webhook: {result}")
+
+    async def delete_webhook(self):
+        await self._make_request("POST", "deleteWebhook", {})
+
+    async def wait_for_reply(self, thread_id: int, silent_mode: bool = False) -> str:
+        """Blocks until a user replies in the specified thread (text or button click)."""
+        if not silent_mode:
+            print(f"Waiting for reply in thread {thread_id}...", file=sys.stderr)
+        start = time.perf_counter()
+
+        while True:
+            update = await self.dispatcher.wait(thread_id)
+
+            # Handle Text Message
+            message = update.get("message")
+            if message:
+                if "text" in message:
+                    reply_wait.observe(time.perf_counter() - start, thread=thread_id)
+                    return message["text"]
+                continue
+
+            # Handle Button Click (Callback Query)
+            callback = update.get("callback_query")
+            if callback:
+                question, selection = self._resolve_click(callback)
+                if question is not None and question.answered is not None:
+                    # Another click on buttons already answered (e.g. a double tap before they were removed)
+                    await self._answer_callback(callback, "Already answered")
+                    continue
+                try:
+                    if question is not None:
+                        question.answered = selection
+                    reply_wait.observe(time.perf_counter() - start, thread=thread_id)
+                    # Stop the loading animation and take the buttons away so they can't be clicked again
+                    await asyncio.gather(self._answer_callback(callback), self._remove_buttons(callback))
+                    # Send a confirmation message so it appears in chat history
+                    try:
+                        await self.send_message(thread_id, f"🔘 **Selected:** {selection}", silent_mode=silent_mode)
+                    except Exception as e:
+                        # Only a note for the chat: the answer must not be lost over it
+                        print(f"Could not confirm the selection in thread {thread_id}: {e}", file=sys.stderr)
+                except BaseException:
+                    # The waiter gave up (e.g. a deadline) or failed after taking the click: leave it for the next one
+                    if question is not None:
+                        question.answered = None
+                    self.dispatcher.release(thread_id, update)
+                    raise
+
+                return selection
+
+    async def _answer_callback(self, callback: dict, text: str = None):
+        """Acknowledges a button click, optionally with a short notice; failures don't matter."""
+        data = {"callback_query_id": callback["id"]}
+        if text:
+            data["text"] = text
+        try:
+            await self._make_request("POST", "answerCallbackQuery", data)
+        except Exception:
+            pass
+
+    async def _remove_buttons(self, callback: dict):
+        """Removes the inline keyboard from the message that was clicked."""
+        message_id = (callback.get("message") or {}).get("message_id")
+        if message_id is None:
+            return
+        try:
+            await self._make_request("POST", "editMessageReplyMarkup", {"chat_id": TELEGRAM_GROUP_ID, "message_id": message_id})
+        except Exception:
+            # Already gone (another waiter removed it) or too old to edit: nothing left to click either way
+            pass
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled HTTP client, created on first use."""
+        if self._client is None:
+            if not TELEGRAM_BOT_TOKEN or not TELEGRAM_GROUP_ID:
+                raise ValueError("Missing TELEGRAM_BOT_TOKEN or TELEGRAM_GROUP_ID environment variables")
+
+            http2 = TELEGRAM_HTTP2
+            if http2 and importlib.util.find_spec("h2") is None:
+                print("TELEGRAM_HTTP2 is set but the 'h2' package is missing, using HTTP/1.1", file=sys.stderr)
+                http2 = False
+            self._client = httpx.AsyncClient(timeout=30.0, limits=HTTP_LIMITS, http2=http2)
+        return self._client
+
+    @property
+    def store(self) -> StateStore:
+        """The local offset/journal database, opened on first use."""
+        if self._store is None:
+            self._store = StateStore()
+        return self._store
+
+    @property
+    def topics(self) -> TopicRegistry:
+        """The persistent task name -> thread_id registry."""
+        if self._topics is None:
+            self._topics = TopicRegistry(self.store)
+        return self._topics
+
+    @property
+    def uploads(self) -> UploadCache:
+        """The persistent content hash -> file_id cache of earlier uploads."""
+        if self._uploads is None:
+            self._uploads = UploadCache(self.store)
+        return self._uploads
+
+    @property
+    def outbox_queue(self) -> OutboxQueue:
+        """The persistent queue of messages waiting to be sent (see outbox.py)."""
+        if self._outbox_queue is None:
+            self._outbox_queue = OutboxQueue(self.store)
+        return self._outbox_queue
+
+    @property
+    def dispatcher(self) -> "UpdateDispatcher":
+        """The shared update poller, started on first use."""
+        if self._dispatcher is None:
+            # With a broker, it polls (or receives the webhook) and tells us what it journaled
+            self._dispatcher = UpdateDispatcher(self, poll=TELEGRAM_UPDATE_MODE != "webhook" and self.broker is None)
+            self._dispatcher.start()
+        return self._dispatcher
+
+
+class UpdateDispatcher:
+    """
+    Owns the single getUpdates stream for the bot.
+    Every message or callback_query from the group is written to the reply journal
+    under its message_thread_id before the offset is confirmed, and the waiters of
+    that thread are woken up. Any number of waiters share one long-poll connection,
+    no thread ever consumes another thread's reply, and replies that arrived while
+    nobody was waiting (or while the server was down) are still there afterwards.
+    """
+
+    def __init__(self, telegram: TelegramHandler, poll: bool = True):
+        self.telegram = telegram
+        self.store = telegram.store
+        # In webhook mode updates are pushed into dispatch() and nothing is polled
+        self.poll = poll
+        self._events: dict[int, asyncio.Event] = {}
+        self._offset = None
+        self._task = None
+        # Called with the (update, thread_id) pairs of every journaled batch (e.g. by the broker)
+        self.listeners = []
+
+    def start(self):
+        """Starts the background poller on the running event loop."""
+        if self.poll and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait(self, thread_id: int) -> dict:
+        """Returns the oldest unconsumed update for the thread, waiting for one if needed."""
+        while True:
+            event = self._event_for(thread_id)
+            event.clear()
+            entry = self.store.next_reply(thread_id)
+            if entry is None:
+                await event.wait()
+                continue
+
+            update_id, update = entry
+            # Another waiter on the same thread may have taken it in the meantime
+            if self.store.consume(update_id):
+                return update
+
+    def release(self, thread_id: int, update: dict):
+        """Returns a taken update to the thread's journal and wakes its waiters."""
+        self.store.release(update["update_id"])
+        self.wake(thread_id)
+
+    def wake(self, thread_id: int):
+        """Makes the thread's waiters look at the journal again."""
+        if thread_id in self._events:
+            self._events[thread_id].set()
+
+    def wake_all(self):
+        for event in self._events.values():
+            event.set()
+
+    def _event_for(self, thread_id: int) -> asyncio.Event:
+        if thread_id not in self._events:
+            self._events[thread_id] = asyncio.Event()
+            if self.telegram.broker is not None:
+                self.telegram.broker.subscribe(thread_id)
+        return self._events[thread_id]
+
+    async def _run(self):
+        # Resume right after the last update that made it into the journal
+        self._offset = self.store.get_offset()
+        # Without a stored offset this is the first run: whatever Telegram kept from before
+        # (up to 24h of chatter) answers nothing this server asked, so it is not journaled
+        backlog_before = self.telegram.started - BACKLOG_MARGIN if self._offset is None else None
+        failures = 0
+
+        while True:
+            stage = "getting"
+            try:
+                updates = await self.telegram.get_updates(offset=self._offset)
+                if updates or self._offset is None:
+                    # An empty first batch still stores an offset, so a restart doesn't skip what arrives meanwhile
+                    offset = updates[-1]["update_id"] + 1 if updates else 0
+                    if backlog_before is not None:
+                        updates = [update for update in updates if self._date_of(update) >= backlog_before]
+                    stage = "journaling"
+                    self.dispatch(updates, offset=offset)
+                    # Confirmed to Telegram by the next poll, so only once the batch is on disk
+                    self._offset = offset
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Network error, 5xx or 409 (another poller), or a journal write that failed
+                # (e.g. the database is locked): back off, then fetch the same batch again
+                failures += 1
+                delay = backoff_delay(failures, POLL_BACKOFF_INITIAL, POLL_BACKOFF_MAX)
+                reason = e
+                if isinstance(e, httpx.HTTPStatusError):
+                    delay = max(delay, self.telegram._retry_after(e.response) or 0)
+                    reason = e.response.text
+                print(f"Error {stage} updates: {reason}; retrying in {delay:.1f}s", file=sys.stderr)
+                await asyncio.sleep(delay)
+                continue
+
+            failures = 0
+            # No pause between polls: an empty batch already waited out the long poll,
+            # and after a busy one more updates are likely queued
+
+    def dispatch(self, updates: list[dict], offset: int = None):
+        """Journals the updates that belong to the group and wakes up their threads."""
+        entries = []
+        for update in updates:
+            thread_id = self._thread_of(update)
+            if thread_id is not False:
+                entries.append((update, thread_id))
+
+        # Raises if the batch could not be journaled; then nothing below has happened
+        self.store.record_updates(entries, offset)
+        for thread_id in {thread_id for _, thread_id in entries}:
+            self.wake(thread_id)
+        # The updates are safe on disk: a failure past this point must not fail the batch
+        try:
+            for update, thread_id in entries:
+                self.telegram._record_update(thread_id, update)
+        except Exception as e:
+            print(f"Error recording updates in the history: {e}", file=sys.stderr)
+        for listener in self.listeners:
+            try:
+                listener(entries)
+            except Exception as e:
+                print(f"Error in update listener: {e}", file=sys.stderr)
+
+    @staticmethod
+    def _date_of(update: dict) -> int:
+        """When a message was sent, or for a click, when the message clicked was sent (0 if unknown)."""
+        message = update.get("message") or (update.get("callback_query") or {}).get("message") or {}
+        return message.get("date", 0)
+
+    @staticmethod
+    def _thread_of(update: dict):
+        """The message_thread_id an update belongs to, or False if it is not for our group."""
+        message = update.get("message")
+        callback = update.get("callback_query")
+        if callback:
+            # Note: In forums, message_thread_id is inside the message object
+            message = callback.get("message")
+        if not message:
+            return False
+
+        chat_id = str(message.get("chat", {}).get("id"))
+        if chat_id != TELEGRAM_GROUP_ID:
+            return False
+
+        return message.get("message_thread_id")
@@ -0,0 +1,66 @@
+"""
+Shared fixtures: a FakeBotAPI on localhost and a TelegramHandler pointed at it,
+with its own state database for every test.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Read at import time by the modules under test, so set before any of them is imported.
+# The API address is only known once the fake is listening; the fixture patches it in.
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123:fake",
+    "TELEGRAM_GROUP_ID": "-1001234567890",
+    "TELEGRAM_BROKER": "off",
+    "TELEGRAM_UPDATE_MODE": "polling",
+    "TELEGRAM_POLL_TIMEOUT": "1",
+    "TELEGRAM_RATE_GLOBAL": "1000/1",
+    "TELEGRAM_RATE_CHAT": "1000/1",
+    # Tests give every handler its own database; this only keeps a stray one out of the repo
+    "TELEGRAM_STATE_DB": os.path.join(tempfile.mkdtemp(), "state.db"),
+})
+
+import pytest
+
+import telegram_handler
+from fake_bot_api import FakeBotAPI
+from store import StateStore
+
+
+@pytest.fixture
+async def fake():
+    api = FakeBotAPI(token=os.environ["TELEGRAM_BOT_TOKEN"], chat_id=int(os.environ["TELEGRAM_GROUP_ID"]), seed=1)
+    await api.start()
+    yield api
+    await api.stop()
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+@pytest.fixture
+async def make_handler(fake, state_path, monkeypatch):
+    """Creates TelegramHandlers on the fake, sharing one state database like processes on one machine."""
+    monkeypatch.setattr(telegram_handler, "API_BASE_URL", f"{fake.base_url}/bot{fake.token}")
+    handlers = []
+
+    def make():
+        handler = telegram_handler.TelegramHandler()
+        handler._store = StateStore(state_path)
+        handlers.append(handler)
+        return handler
+
+    yield make
+    for handler in handlers:
+        await handler.close()
+
+
+@pytest.fixture
+def telegram(make_handler):
+    return make_handler()
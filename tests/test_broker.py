@@ -0,0 +1,162 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+import broker as broker_module
+from broker import Broker, BrokerClient, mark_failed
+from outbox import Outbox
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to about 100 bytes, which pytest's tmp_path can exceed
+    directory = tempfile.mkdtemp(prefix="tgbroker")
+    yield os.path.join(directory, "broker.sock")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture
+async def start_broker(make_handler, socket_path, monkeypatch):
+    monkeypatch.setattr(broker_module, "TELEGRAM_BROKER", "auto")
+    brokers = []
+
+    async def start():
+        broker = Broker(make_handler(), socket_path)
+        await broker.start()
+        brokers.append(broker)
+        return broker
+
+    yield start
+    for broker in brokers:
+        if broker._server is not None:
+            await broker.stop()
+
+
+async def stop(broker: Broker):
+    """Like the broker process exiting: its poller stops too."""
+    await broker.stop()
+    await broker.telegram.close()
+
+
+@pytest.fixture
+async def connect(make_handler, socket_path):
+    async def connect(**kwargs):
+        telegram = make_handler()
+        telegram.broker = await BrokerClient.connect(telegram, socket_path, spawn=False, **kwargs)
+        assert telegram.broker is not None
+        return telegram
+
+    return connect
+
+
+async def reply(telegram, thread_id: int) -> str:
+    return await asyncio.wait_for(telegram.wait_for_reply(thread_id, silent_mode=True), 5)
+
+
+async def test_clients_share_the_brokers_poller(start_broker, connect, fake):
+    await start_broker()
+    first, second = await connect(), await connect()
+    waiting = [asyncio.ensure_future(reply(first, 100)), asyncio.ensure_future(reply(second, 101))]
+    await asyncio.sleep(0.1)
+    fake.user_reply(101, "for the second")
+    fake.user_reply(100, "for the first")
+
+    assert await asyncio.gather(*waiting) == ["for the first", "for the second"]
+    assert first.dispatcher._task is None and second.dispatcher._task is None
+    # Each client heard about its own thread only, for its history
+    assert [entry.text for entry in first.history.get(100)] == ["for the first"]
+    assert first.history.get(101) == []
+
+
+async def test_calls_and_clicks_go_through_the_broker(start_broker, connect, fake):
+    broker = await start_broker()
+    telegram = await connect()
+    message = await telegram.send_message(100, "Deploy?", buttons=["Yes", "No"], silent_mode=True)
+    assert broker.calls == 1
+
+    fake.user_press(message["message_id"], "No")
+    assert await reply(telegram, 100) == "No"
+    # The click was acknowledged and the buttons removed through the broker too
+    assert fake.requests["answerCallbackQuery"] == 1
+    assert "reply_markup" not in fake.messages[0]
+
+
+async def test_outbox_is_sent_by_the_broker(start_broker, connect, fake):
+    broker = await start_broker()
+    telegram = await connect()
+    box = Outbox(telegram)
+    futures = [box.enqueue(100, f"log {i}") for i in range(5)]
+
+    sent = await asyncio.wait_for(asyncio.gather(*futures), 5)
+    assert [message["text"] for message in sent] == [f"log {i}" for i in range(5)]
+    assert broker.outbox.sent == 5
+    assert box.sent == 5 and box._task is None
+    assert [entry.text for entry in telegram.history.get(100)] == [f"log {i}" for i in range(5)]
+    await box.stop()
+
+
+async def test_reconnects_to_a_new_broker(start_broker, connect, fake):
+    broker = await start_broker()
+    telegram = await connect()
+    waiting = asyncio.ensure_future(reply(telegram, 100))
+    await asyncio.sleep(0.1)
+    await stop(broker)
+
+    await start_broker()
+    fake.user_reply(100, "after the restart")
+    assert await waiting == "after the restart"
+    assert telegram.broker is not None
+
+
+async def test_falls_back_to_direct_when_the_broker_is_gone(start_broker, connect, fake, socket_path, monkeypatch):
+    monkeypatch.setattr(broker_module, "BROKER_START_TIMEOUT", 0.2)
+    monkeypatch.setattr(broker_module, "BROKER_MAX_RECONNECTS", 2)
+    fallbacks = []
+
+    async def on_fallback():
+        fallbacks.append(time.monotonic())
+
+    broker = await start_broker()
+    telegram = await connect(on_fallback=on_fallback)
+    waiting = asyncio.ensure_future(reply(telegram, 100))
+    await asyncio.sleep(0.1)
+    await stop(broker)
+
+    deadline = time.monotonic() + 5
+    while telegram.broker is not None:
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.05)
+    assert len(fallbacks) == 1
+    assert os.path.exists(socket_path + ".failed")
+
+    # Polls and sends on its own now
+    fake.user_reply(100, "direct")
+    assert await waiting == "direct"
+    assert telegram.dispatcher._task is not None
+    await telegram.send_message(100, "sent directly", silent_mode=True)
+    assert fake.messages[-1]["text"] == "sent directly"
+
+
+async def test_broker_that_failed_to_start_is_not_waited_for(make_handler, socket_path, monkeypatch):
+    monkeypatch.setattr(broker_module, "TELEGRAM_BROKER", "auto")
+    spawned = []
+    monkeypatch.setattr(broker_module, "spawn_broker", lambda: spawned.append(True))
+    mark_failed(socket_path)
+
+    start = time.monotonic()
+    assert await BrokerClient.connect(make_handler(), socket_path) is None
+    assert time.monotonic() - start < 1
+    assert spawned == []
+
+
+async def test_broker_that_started_since_is_used(start_broker, make_handler, socket_path):
+    mark_failed(socket_path)
+    await start_broker()
+    assert not os.path.exists(socket_path + ".failed")
+    telegram = make_handler()
+    telegram.broker = await BrokerClient.connect(telegram, socket_path)
+    assert telegram.broker is not None and telegram.broker.spawn
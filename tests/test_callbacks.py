@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from callbacks import CallbackRegistry
+
+
+def test_callback_data_fits_64_bytes_whatever_the_options():
+    registry = CallbackRegistry()
+    options = ["אפשרות ארוכה מאוד בעברית " * 5, "Same long prefix " * 10 + "A", "Same long prefix " * 10 + "B"]
+    data = registry.register(7, "Which one?", options)
+    assert len(data) == len(options) == len(set(data))
+    assert all(len(item.encode()) <= 64 for item in data)
+    for item, option in zip(data, options):
+        question, selected = registry.resolve(item)
+        assert selected == option
+        assert question.thread_id == 7
+
+
+def test_resolve_rejects_unknown_data():
+    registry = CallbackRegistry()
+    token = registry.register(7, "Q", ["a", "b"])[0].partition(":")[0]
+    assert registry.resolve("Yes") is None
+    assert registry.resolve(f"{token}:2") is None
+    assert registry.resolve(f"{token}:x") is None
+    assert registry.resolve("nope:0") is None
+
+
+def test_evicts_least_recently_used_beyond_max_questions():
+    registry = CallbackRegistry(max_questions=3)
+    first = registry.register(1, "Q1", ["a"])[0]
+    second = registry.register(2, "Q2", ["a"])[0]
+    registry.register(3, "Q3", ["a"])
+    # Clicking the first makes the second the oldest
+    assert registry.resolve(first) is not None
+    registry.register(4, "Q4", ["a"])
+
+    assert registry.resolve(second) is None
+    assert registry.resolve(first) is not None
+    assert registry.stats() == {"questions": 3, "answered": 0, "expired": 1}
+
+
+def test_expires_questions_unused_for_ttl():
+    registry = CallbackRegistry(ttl=60)
+    old = registry.register(1, "Q1", ["a"])[0]
+    registry._questions[old.partition(":")[0]].last_used -= 61
+    fresh = registry.register(2, "Q2", ["a"])[0]
+
+    assert registry.resolve(old) is None
+    assert registry.resolve(fresh) is not None
+    assert registry.stats()["expired"] == 1
+
+
+async def test_buttons_round_trip_through_telegram(telegram, fake):
+    options = ["כן, להמשיך עם השינויים המוצעים בקובץ", "לא, לבטל את כל השינויים בקובץ"]
+    message = await telegram.send_message(100, "Continue?", buttons=options, silent_mode=True)
+    # The fake rejects callback_data over 64 bytes like Telegram does
+    assert [row[0]["text"] for row in fake.messages[-1]["reply_markup"]["inline_keyboard"]] == options
+
+    fake.user_press(message["message_id"], options[1])
+    assert await telegram.wait_for_reply(100, silent_mode=True) == options[1]
+
+
+async def test_click_is_kept_when_the_confirmation_fails(telegram, fake):
+    message = await telegram.send_message(100, "Continue?", buttons=["Yes", "No"], silent_mode=True)
+    send = fake._methods["sendMessage"]
+
+    async def unavailable(data):
+        return fake._error(502, "Bad Gateway")
+
+    fake._methods["sendMessage"] = unavailable
+    fake.user_press(message["message_id"], "Yes")
+    assert await asyncio.wait_for(telegram.wait_for_reply(100, silent_mode=True), 5) == "Yes"
+    fake._methods["sendMessage"] = send
+
+
+async def test_click_is_released_when_the_waiter_is_cancelled(telegram, fake):
+    message = await telegram.send_message(100, "Continue?", buttons=["Yes", "No"], silent_mode=True)
+    telegram.dispatcher.start()
+    fake.user_press(message["message_id"], "No")
+    while telegram.store.next_reply(100) is None:
+        await asyncio.sleep(0.02)
+    # Cancelled while the click is being acknowledged
+    fake.latency = 0.5
+    waiter = asyncio.ensure_future(telegram.wait_for_reply(100, silent_mode=True))
+    await asyncio.sleep(0.3)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    fake.latency = 0.0
+    assert await asyncio.wait_for(telegram.wait_for_reply(100, silent_mode=True), 5) == "No"
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import telegram_handler
+
+
+async def journaled(telegram, thread_id: int, timeout: float = 5):
+    """Waits until the poller has journaled an update for the thread."""
+    deadline = time.monotonic() + timeout
+    while telegram.store.next_reply(thread_id) is None:
+        assert time.monotonic() < deadline, f"nothing journaled for thread {thread_id}"
+        await asyncio.sleep(0.02)
+
+
+async def test_replies_are_replayed_after_a_restart(make_handler, fake):
+    first = make_handler()
+    first.dispatcher.start()
+    fake.user_reply(100, "while nobody waited")
+    fake.user_reply(101, "for another thread")
+    await journaled(first, 101)
+    await first.close()
+
+    second = make_handler()
+    assert await asyncio.wait_for(second.wait_for_reply(100, silent_mode=True), 5) == "while nobody waited"
+    assert await asyncio.wait_for(second.wait_for_reply(101, silent_mode=True), 5) == "for another thread"
+    # Confirmed to Telegram before the restart, so not delivered a second time
+    fake.user_reply(100, "next")
+    assert await asyncio.wait_for(second.wait_for_reply(100, silent_mode=True), 5) == "next"
+    assert second.store.next_reply(100) is None
+
+
+async def test_consumed_replies_are_not_replayed(make_handler, fake):
+    first = make_handler()
+    fake.user_reply(100, "answered")
+    assert await asyncio.wait_for(first.wait_for_reply(100, silent_mode=True), 5) == "answered"
+    await first.close()
+
+    second = make_handler()
+    second.dispatcher.start()
+    fake.user_reply(100, "new")
+    assert await asyncio.wait_for(second.wait_for_reply(100, silent_mode=True), 5) == "new"
+
+
+async def test_first_run_skips_the_backlog(telegram, fake):
+    fake.user_reply(100, "from yesterday")
+    fake._updates[-1]["message"]["date"] -= 24 * 3600
+    fake.user_reply(100, "just now")
+    assert await asyncio.wait_for(telegram.wait_for_reply(100, silent_mode=True), 5) == "just now"
+
+
+async def test_failed_journal_write_fetches_the_batch_again(telegram, fake, monkeypatch):
+    monkeypatch.setattr(telegram_handler, "POLL_BACKOFF_INITIAL", 0.05)
+    record_updates = telegram.store.record_updates
+    failures = []
+
+    def locked_once(entries, offset=None):
+        if entries and not failures:
+            failures.append(offset)
+            raise RuntimeError("database is locked")
+        record_updates(entries, offset)
+
+    monkeypatch.setattr(telegram.store, "record_updates", locked_once)
+    fake.user_reply(100, "kept")
+    assert await asyncio.wait_for(telegram.wait_for_reply(100, silent_mode=True), 5) == "kept"
+    assert failures
+
+
+async def test_listener_errors_do_not_stop_the_poller(telegram, fake):
+    def broken(entries):
+        raise RuntimeError("listener bug")
+
+    telegram.dispatcher.listeners.append(broken)
+    fake.user_reply(100, "one")
+    assert await asyncio.wait_for(telegram.wait_for_reply(100, silent_mode=True), 5) == "one"
+    fake.user_reply(100, "two")
+    assert await asyncio.wait_for(telegram.wait_for_reply(100, silent_mode=True), 5) == "two"
@@ -0,0 +1,132 @@
+import re
+
+import pytest
+
+from formatting import MAX_MESSAGE_LENGTH, markdown_to_html, repair_html, split_html, split_text, html_to_text
+
+_TAG = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*>')
+
+
+def assert_balanced(html: str):
+    """Every tag is closed, in order, and nothing is closed that wasn't opened."""
+    stack = []
+    for match in _TAG.finditer(html):
+        if match.group(1):
+            assert stack and stack[-1] == match.group(2), f"unexpected </{match.group(2)}> in {html!r}"
+            stack.pop()
+        else:
+            stack.append(match.group(2))
+    assert not stack, f"unclosed {stack} in {html!r}"
+
+
+# --- split_html ---
+
+def test_split_short_text_is_one_chunk():
+    assert split_html("<b>short</b>") == ["<b>short</b>"]
+
+
+def test_split_prefers_newlines():
+    lines = [f"line {i} " + "x" * 50 for i in range(200)]
+    chunks = split_html("\n".join(lines))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= MAX_MESSAGE_LENGTH
+        # Cut between lines, never inside one
+        assert chunk.split("\n")[0].startswith("line ")
+    assert "\n".join(chunks).split("\n") == lines
+
+
+def test_split_long_pre_reopens_tags():
+    html = "<pre>" + "\n".join("code line %d" % i for i in range(1000)) + "</pre>"
+    chunks = split_html(html)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= MAX_MESSAGE_LENGTH
+        assert chunk.startswith("<pre>") and chunk.endswith("</pre>")
+        assert_balanced(chunk)
+
+
+def test_split_without_newlines_respects_limit_and_entities():
+    html = "<b>" + "&amp;" * 3000 + "</b>" + "<i>" + "y" * 5000 + "</i>"
+    chunks = split_html(html, limit=1000)
+    for chunk in chunks:
+        assert len(chunk) <= 1000
+        assert_balanced(chunk)
+        # No entity cut in half
+        assert "&" not in chunk.replace("&amp;", "")
+    assert "".join(html_to_text(chunk) for chunk in chunks) == "&" * 3000 + "y" * 5000
+
+
+def test_split_text_respects_limit():
+    text = "word " * 2000
+    chunks = split_text(text, limit=100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+# --- markdown_to_html ---
+
+@pytest.mark.parametrize("text", [
+    "call my_function_name now",
+    "set TELEGRAM_RATE_TOPIC and snake_case_value",
+    "path/to/some_module_file.py:12",
+])
+def test_markdown_leaves_snake_case_alone(text):
+    assert "<i>" not in markdown_to_html(text)
+    assert markdown_to_html(text).count("_") == text.count("_")
+
+
+def test_markdown_formats_emphasis_and_code():
+    assert markdown_to_html("**bold** and _italic_ and __bold__") == "<b>bold</b> and <i>italic</i> and <b>bold</b>"
+    assert markdown_to_html("**a_b** _c_d_") == "<b>a_b</b> <i>c_d</i>"
+    assert markdown_to_html("run `a_b **c**`") == "run <code>a_b **c**</code>"
+
+
+def test_markdown_code_block_drops_language_and_escapes():
+    html = markdown_to_html("```python\nif a < b and c & d:\n    pass_it(**kw)\n```")
+    assert html == "<pre>if a &lt; b and c &amp; d:\n    pass_it(**kw)</pre>"
+
+
+def test_markdown_escapes_html():
+    assert markdown_to_html("1 < 2 > 0 & <script>") == "1 &lt; 2 &gt; 0 &amp; &lt;script&gt;"
+
+
+def test_markdown_output_splits_into_balanced_chunks():
+    html = markdown_to_html("\n".join(f"- **item {i}** with `some_code({i})` and _notes_" for i in range(300)))
+    for chunk in split_html(html):
+        assert len(chunk) <= MAX_MESSAGE_LENGTH
+        assert_balanced(chunk)
+
+
+# --- repair_html ---
+
+def test_repair_leaves_valid_html_unchanged():
+    html = '<b>bold <i>both</i></b> <a href="https://example.com">link</a> &lt;tag&gt; &amp; &#39;'
+    assert repair_html(html) == (html, [])
+
+
+@pytest.mark.parametrize("html", [
+    "<b>unclosed",
+    "closed</i> without opening",
+    "<b><i>misnested</b></i>",
+    "<code><b>nested in code</b></code>",
+    "<div>unsupported</div>",
+    "a < b & c > d",
+])
+def test_repair_balances_and_reports(html):
+    repaired, fixes = repair_html(html)
+    assert fixes
+    assert_balanced(repaired)
+    # Already repaired: nothing left to fix
+    assert repair_html(repaired) == (repaired, [])
+
+
+def test_repair_escapes_stray_characters():
+    repaired, _ = repair_html("a < b & c")
+    assert repaired == "a &lt; b &amp; c"
+
+
+def test_split_chunks_need_no_repair():
+    html = markdown_to_html("```\n" + "\n".join(f"if a < {i} and b & c:" for i in range(600)) + "\n```")
+    for chunk in split_html(html) + split_html("<b>" + "&amp;" * 3000 + "</b>", limit=1000):
+        assert repair_html(chunk)[1] == []
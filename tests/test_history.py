@@ -0,0 +1,69 @@
+from history import ThreadHistory, MAX_ENTRY_TEXT
+
+
+def test_keeps_last_max_messages():
+    history = ThreadHistory(max_messages=3)
+    for i in range(5):
+        history.record(1, f"message {i}", outgoing=i % 2 == 0)
+    assert [entry.text for entry in history.get(1)] == ["message 2", "message 3", "message 4"]
+    assert [entry.text for entry in history.get(1, limit=2)] == ["message 3", "message 4"]
+    assert history.get(1, limit=0) == []
+
+
+def test_keeps_under_max_bytes():
+    history = ThreadHistory(max_bytes=4000)
+    for i in range(20):
+        history.record(1, f"{i:02d}" + "x" * 500, outgoing=True)
+    entries = history.get(1)
+    assert 0 < len(entries) < 20
+    assert sum(entry.size for entry in entries) <= 4000
+    assert history.stats()["bytes"] <= 4000
+    # Oldest dropped first
+    assert entries[-1].text.startswith("19")
+
+
+def test_evicts_least_recently_active_thread():
+    history = ThreadHistory(max_threads=2)
+    history.record(1, "one", outgoing=True)
+    history.record(2, "two", outgoing=True)
+    history.record(1, "one again", outgoing=False)
+    history.record(3, "three", outgoing=True)
+
+    assert history.get(2) == []
+    assert [entry.text for entry in history.get(1)] == ["one", "one again"]
+    assert history.stats()["threads"] == 2
+    assert history.stats()["evicted_threads"] == 1
+
+
+def test_long_text_is_cut():
+    history = ThreadHistory()
+    history.record(1, "x" * (MAX_ENTRY_TEXT * 2), outgoing=True)
+    assert len(history.get(1)[0].text) == MAX_ENTRY_TEXT + 1
+
+
+def test_disabled_with_zero_limits():
+    history = ThreadHistory(max_messages=0)
+    history.record(1, "ignored", outgoing=True)
+    assert history.get(1) == []
+    assert history.stats()["threads"] == 0
+
+
+def test_since_filters_by_time():
+    history = ThreadHistory()
+    history.record(1, "old", outgoing=True)
+    cutoff = history.get(1)[0].ts
+    history.record(1, "new", outgoing=False)
+    history.get(1)[-1].ts = cutoff + 1
+    assert [entry.text for entry in history.get(1, since=cutoff)] == ["new"]
+
+
+async def test_records_both_directions(telegram, fake):
+    await telegram.send_message(100, "**question**", buttons=["Yes", "No"], silent_mode=True)
+    fake.user_reply(100, "an answer")
+    assert await telegram.wait_for_reply(100, silent_mode=True) == "an answer"
+
+    entries = [entry.to_dict() for entry in telegram.history.get(100)]
+    assert [(entry["from"], entry["text"]) for entry in entries] == [
+        ("bot", "**question**\n[Yes | No]"),
+        ("Human", "an answer"),
+    ]
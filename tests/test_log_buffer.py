@@ -0,0 +1,58 @@
+import asyncio
+
+from log_buffer import LogBuffer
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, thread_id: int, text: str):
+        self.sent.append((thread_id, text))
+
+
+async def test_merges_lines_until_the_interval_is_up():
+    send = Recorder()
+    buffer = LogBuffer(send, max_chars=1000, flush_interval=0.1)
+    for i in range(3):
+        await buffer.add(1, f"line {i}")
+    await buffer.add(2, "other thread")
+    assert send.sent == []
+
+    await asyncio.sleep(0.2)
+    assert sorted(send.sent) == [(1, "line 0\nline 1\nline 2"), (2, "other thread")]
+    assert buffer.stats() == {"logs": 4, "flushes": 2, "pending_threads": 0, "pending_chars": 0}
+
+
+async def test_flushes_before_a_batch_grows_too_long():
+    send = Recorder()
+    buffer = LogBuffer(send, max_chars=20, flush_interval=60)
+    for text in ["aaaaaaaa", "bbbbbbbb", "cccccccc", "dddddddddddddddddddd"]:
+        await buffer.add(1, text)
+
+    assert send.sent == [(1, "aaaaaaaa\nbbbbbbbb"), (1, "cccccccc"), (1, "dddddddddddddddddddd")]
+    assert all(len(text) <= 20 for _, text in send.sent)
+
+
+async def test_flush_sends_at_once_and_keeps_order():
+    send = Recorder()
+    buffer = LogBuffer(send, max_chars=1000, flush_interval=60)
+    await buffer.add(1, "first")
+    await buffer.flush(1)
+    await buffer.add(1, "second")
+    await buffer.flush_all()
+
+    assert send.sent == [(1, "first"), (1, "second")]
+    # Nothing left to send
+    await buffer.flush(1)
+    assert len(send.sent) == 2
+
+
+async def test_a_failed_timed_flush_is_logged_not_raised():
+    async def broken(thread_id, text):
+        raise RuntimeError("network down")
+
+    buffer = LogBuffer(broken, max_chars=1000, flush_interval=0.05)
+    await buffer.add(1, "lost")
+    await asyncio.sleep(0.1)
+    assert buffer.stats()["pending_threads"] == 0
@@ -0,0 +1,82 @@
+from metrics import MetricsRegistry, metrics
+
+
+def test_renders_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Calls by method")
+    latency = registry.histogram("latency_seconds", "Call latency", buckets=(0.1, 1))
+    registry.gauge("queue_length", "Waiting", lambda: 3)
+    requests.inc(method="sendMessage")
+    requests.inc(2, method="sendMessage")
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, method="getUpdates")
+
+    lines = registry.render_prometheus().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{method="sendMessage"} 3' in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{method="getUpdates",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{method="getUpdates",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{method="getUpdates",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{method="getUpdates"} 3' in lines
+    assert "queue_length 3" in lines
+
+
+def test_snapshot_summarizes_histograms():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Call latency", buckets=(0.1, 1, 10))
+    for value in [0.05] * 98 + [5, 5]:
+        latency.observe(value)
+    registry.counter("unused_total", "Never incremented")
+
+    snapshot = registry.snapshot()
+    assert snapshot["latency_seconds"]["total"]["count"] == 100
+    assert snapshot["latency_seconds"]["total"]["p50_le"] == 0.1
+    assert snapshot["latency_seconds"]["total"]["p99_le"] == 10
+    assert "unused_total" not in snapshot
+
+
+def test_dump_writes_the_file(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Calls").inc()
+    path = tmp_path / "metrics.prom"
+    registry.dump(str(path))
+    assert path.read_text() == registry.render_prometheus()
+
+
+async def test_api_calls_are_measured(telegram, fake):
+    requests = metrics.counter("telegram_api_requests_total", "")
+    before = dict(requests.values)
+    await telegram.send_message(100, "hello", silent_mode=True)
+    key = (("method", "sendMessage"), ("status", "200"))
+    assert requests.values.get(key, 0) - before.get(key, 0) == 1
+
+
+def test_combined_adds_another_process_metrics():
+    local, remote = MetricsRegistry(), MetricsRegistry()
+    local.counter("requests_total", "Calls").inc(method="sendDocument")
+    remote.counter("requests_total", "Calls").inc(2, method="sendMessage")
+    remote.counter("requests_total", "Calls").inc(method="sendDocument")
+    local.histogram("latency_seconds", "Latency", buckets=(0.1, 1)).observe(0.05)
+    remote.histogram("latency_seconds", "Latency", buckets=(0.1, 1)).observe(0.5)
+    remote.histogram("remote_only_seconds", "Only in the broker", buckets=(1,)).observe(2)
+    local.gauge("queue_length", "Waiting", lambda: 1)
+    remote.gauge("queue_length", "Waiting", lambda: 2)
+
+    combined = local.combined(remote.export())
+    lines = combined.render_prometheus().splitlines()
+    assert 'requests_total{method="sendDocument"} 2' in lines
+    assert 'requests_total{method="sendMessage"} 2' in lines
+    assert "latency_seconds_count 2" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert "remote_only_seconds_count 1" in lines
+    assert "queue_length 3" in lines
+    # The local registry itself is left alone
+    assert local.snapshot()["requests_total"] == {'{method="sendDocument"}': 1}
+
+
+def test_combined_skips_histograms_with_other_buckets():
+    local, remote = MetricsRegistry(), MetricsRegistry()
+    local.histogram("latency_seconds", "Latency", buckets=(0.1, 1)).observe(0.05)
+    remote.histogram("latency_seconds", "Latency", buckets=(1, 10)).observe(5)
+    assert local.combined(remote.export()).snapshot()["latency_seconds"]["total"]["count"] == 1
@@ -0,0 +1,144 @@
+import asyncio
+
+import httpx
+import pytest
+
+import outbox
+from outbox import Outbox
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_INITIAL", 0.05)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_MAX", 0.2)
+
+
+@pytest.fixture
+async def make_outbox():
+    outboxes = []
+
+    def make(telegram):
+        box = Outbox(telegram)
+        box.start()
+        outboxes.append(box)
+        return box
+
+    yield make
+    for box in outboxes:
+        await box.stop()
+
+
+def texts_by_thread(fake) -> dict[int, list[str]]:
+    threads = {}
+    for message in fake.messages:
+        threads.setdefault(message["message_thread_id"], []).append(message["text"])
+    return threads
+
+
+async def test_keeps_order_per_thread_through_errors(telegram, fake, make_outbox):
+    fake.error_rate_5xx = 0.3
+    box = make_outbox(telegram)
+    futures = [box.enqueue(thread_id, f"{thread_id}: {i}") for i in range(10) for thread_id in range(100, 105)]
+    await asyncio.wait_for(asyncio.gather(*futures), 20)
+
+    assert fake.injected_errors > 0
+    assert box.retries > 0
+    assert texts_by_thread(fake) == {thread_id: [f"{thread_id}: {i}" for i in range(10)] for thread_id in range(100, 105)}
+    assert telegram.outbox_queue.depth()["pending"] == 0
+
+
+async def test_retries_until_telegram_is_back(telegram, fake, make_outbox):
+    fake.error_rate_5xx = 1.0
+    box = make_outbox(telegram)
+    first = box.enqueue(100, "first")
+    second = box.enqueue(100, "second")
+    await asyncio.sleep(0.5)
+    assert not first.done() and not second.done()
+    assert box.retries >= 2
+    assert telegram.outbox_queue.depth()["pending"] == 2
+
+    fake.error_rate_5xx = 0.0
+    sent = await asyncio.wait_for(asyncio.gather(first, second), 5)
+    assert [message["text"] for message in sent] == ["first", "second"]
+    assert await box.drain(1) == 0
+
+
+async def test_drops_a_rejected_message_and_sends_the_next(telegram, fake, make_outbox):
+    box = make_outbox(telegram)
+    rejected = box.enqueue(100, "")
+    after = box.enqueue(100, "after")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await asyncio.wait_for(rejected, 5)
+    assert (await asyncio.wait_for(after, 5))["text"] == "after"
+    assert box.failed == 1
+    assert telegram.outbox_queue.depth()["failed"] == 1
+
+
+async def test_resumes_long_message_after_the_parts_sent(telegram, fake, make_outbox):
+    send = fake._methods["sendMessage"]
+    calls = 0
+
+    async def fail_second_part_once(data):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            return fake._error(502, "Bad Gateway")
+        return await send(data)
+
+    fake._methods["sendMessage"] = fail_second_part_once
+    box = make_outbox(telegram)
+    text = "\n".join(f"line {i:05d} " + "x" * 80 for i in range(120))
+    await asyncio.wait_for(box.enqueue(100, text), 5)
+
+    assert box.retries == 1
+    assert len(fake.messages) == 3
+    assert "\n".join(message["text"] for message in fake.messages) == text
+
+
+async def test_processes_sharing_the_queue_send_each_message_once(make_handler, fake, make_outbox):
+    first, second = make_handler(), make_handler()
+    first_box, second_box = make_outbox(first), make_outbox(second)
+    futures = [first_box.enqueue(100, f"a{i}") for i in range(10)] + [second_box.enqueue(101, f"b{i}") for i in range(10)]
+    # Left by a process that died
+    first.outbox_queue.add(102, {"text": "orphan", "parse_mode": "HTML", "buttons": None}, "dead", 0)
+    second_box.wake()
+
+    await asyncio.wait_for(asyncio.gather(*futures), 5)
+    for _ in range(50):
+        if first.outbox_queue.depth()["pending"] == 0:
+            break
+        await asyncio.sleep(0.05)
+    assert texts_by_thread(fake) == {100: [f"a{i}" for i in range(10)], 101: [f"b{i}" for i in range(10)], 102: ["orphan"]}
+
+
+async def test_stopped_outbox_leaves_its_messages_to_another(make_handler, fake, make_outbox):
+    first, second = make_handler(), make_handler()
+    first_box, second_box = make_outbox(first), make_outbox(second)
+    fake.error_rate_5xx = 1.0
+    first_box.enqueue(100, "left behind")
+    await asyncio.sleep(0.2)
+    await first_box.stop()
+
+    fake.error_rate_5xx = 0.0
+    second_box.wake()
+    for _ in range(50):
+        if fake.messages:
+            break
+        await asyncio.sleep(0.05)
+    assert [message["text"] for message in fake.messages] == ["left behind"]
+    assert second.outbox_queue.depth()["pending"] == 0
+
+
+async def test_passes_silent_mode_on_to_the_send(telegram, fake, make_outbox, monkeypatch):
+    send_message = telegram.send_message
+    modes = []
+
+    async def recording(*args, silent_mode=False, **kwargs):
+        modes.append(silent_mode)
+        return await send_message(*args, silent_mode=silent_mode, **kwargs)
+
+    monkeypatch.setattr(telegram, "send_message", recording)
+    box = make_outbox(telegram)
+    await asyncio.wait_for(asyncio.gather(box.enqueue(100, "question", silent_mode=False), box.enqueue(100, "log")), 5)
+    assert modes == [False, True]
@@ -0,0 +1,80 @@
+import asyncio
+
+from progress import ProgressTracker, render_progress
+
+
+class FakeMessages:
+    """send/edit callables that keep what the progress message shows."""
+
+    def __init__(self):
+        self.texts = {}
+        self.edits = []
+
+    async def send(self, thread_id: int, text: str) -> dict:
+        message_id = len(self.texts) + 1
+        self.texts[message_id] = text
+        return {"message_id": message_id}
+
+    async def edit(self, message_id: int, text: str):
+        self.texts[message_id] = text
+        self.edits.append((asyncio.get_running_loop().time(), text))
+
+
+def test_render_progress():
+    assert render_progress("Tests") == "⏳ **Tests**"
+    assert render_progress("Tests", "12 passed", 42) == "⏳ **Tests**\n`▓▓▓▓░░░░░░` 42%\n12 passed"
+    assert render_progress("Tests", percent=150, done=True) == "✅ **Tests**\n`▓▓▓▓▓▓▓▓▓▓` 100%"
+
+
+async def test_updates_within_the_interval_are_merged():
+    messages = FakeMessages()
+    tracker = ProgressTracker(messages.send, messages.edit, min_interval=0.2)
+    progress = await tracker.start(100, "Tests")
+
+    results = [await tracker.update(progress.handle, text=f"{i} passed", percent=i) for i in range(1, 6)]
+    assert results == ["scheduled"] * 5
+    assert messages.edits == []
+
+    await asyncio.sleep(0.3)
+    assert [text for _, text in messages.edits] == [render_progress("Tests", "5 passed", 5)]
+    assert tracker.stats() == {"active": 1, "updates": 5, "edits": 1}
+
+
+async def test_edits_are_spaced_by_the_interval():
+    messages = FakeMessages()
+    tracker = ProgressTracker(messages.send, messages.edit, min_interval=0.1)
+    progress = await tracker.start(100, "Build")
+    for i in range(20):
+        await tracker.update(progress.handle, percent=i * 5)
+        await asyncio.sleep(0.02)
+    await tracker.flush_all()
+
+    times = [at for at, _ in messages.edits]
+    assert 2 <= len(times) < 20
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+    assert messages.texts[progress.message_id] == render_progress("Build", percent=95)
+
+
+async def test_unchanged_and_done():
+    messages = FakeMessages()
+    tracker = ProgressTracker(messages.send, messages.edit, min_interval=60)
+    progress = await tracker.start(100, "Deploy")
+
+    assert await tracker.update(progress.handle) == "unchanged"
+    assert await tracker.update(progress.handle, text="copying") == "scheduled"
+    # The final state goes out at once, whatever the interval
+    assert await tracker.update(progress.handle, text="finished", done=True) == "edited"
+    assert messages.texts[progress.message_id] == render_progress("Deploy", "finished", done=True)
+    assert await tracker.update(progress.handle, text="more") == "unknown"
+    assert len(messages.edits) == 1
+
+
+async def test_edits_the_telegram_message(telegram, fake):
+    tracker = ProgressTracker(lambda thread_id, text: telegram.send_message(thread_id, text, silent_mode=True),
+                              telegram.edit_message, min_interval=0)
+    progress = await tracker.start(100, "Tests")
+    await tracker.update(progress.handle, text="3 failed", percent=50)
+
+    [message] = fake.messages
+    assert message["edits"] == 1
+    assert message["text"] == "⏳ <b>Tests</b>\n<code>▓▓▓▓▓░░░░░</code> 50%\n3 failed"
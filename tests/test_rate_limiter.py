@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+import telegram_handler
+from rate_limiter import RateLimiter, TokenBucket, parse_rate, backoff_delay, combine_stats
+
+
+def test_parse_rate():
+    assert parse_rate("20/60") == (20.0, 60.0)
+    assert parse_rate("30") == (30.0, 1.0)
+    assert parse_rate("", (1, 1)) == (1, 1)
+    assert parse_rate("fast", None) is None
+
+
+def test_backoff_doubles_up_to_the_maximum():
+    assert 0.5 <= backoff_delay(1) <= 1
+    assert 4 <= backoff_delay(4) <= 8
+    assert 30 <= backoff_delay(20) <= 60
+
+
+def test_token_bucket_refills_evenly():
+    bucket = TokenBucket(2, 1.0)
+    now = time.monotonic()
+    for _ in range(2):
+        assert bucket.delay(now) == 0
+        bucket.consume()
+    assert bucket.delay(now) == pytest.approx(0.5, abs=0.01)
+    assert bucket.delay(now + 0.5) == pytest.approx(0, abs=0.01)
+
+
+async def test_waits_for_the_chat_budget():
+    limiter = RateLimiter(global_rate=(100, 1), chat_rate=(3, 0.3), topic_rate=None)
+    start = time.monotonic()
+    for _ in range(5):
+        await limiter.acquire(-100, 7)
+    # Two sends over the burst of 3, at one per 0.1s
+    assert time.monotonic() - start >= 0.18
+    stats = limiter.stats()
+    assert stats["requests"] == 5 and stats["delayed_requests"] == 2
+    # No per-topic budget unless one is configured
+    assert not limiter._topics
+
+
+async def test_topic_budget_when_configured():
+    limiter = RateLimiter(global_rate=(100, 1), chat_rate=(100, 1), topic_rate=(1, 0.2))
+    await limiter.acquire(-100, 7)
+    # Another topic of the same chat is not held up
+    assert await limiter.acquire(-100, 8) < 0.05
+    assert await limiter.acquire(-100, 7) >= 0.15
+
+
+async def test_pause_blocks_the_chat_only():
+    limiter = RateLimiter(global_rate=(100, 1), chat_rate=(100, 1), topic_rate=None)
+    limiter.pause(0.2, -100)
+    assert await limiter.acquire(-200) < 0.05
+    assert await limiter.acquire(-100) >= 0.15
+    assert limiter.stats()["rate_limited_responses"] == 1
+
+
+async def test_retries_after_429_with_retry_after(telegram, fake):
+    send = fake._methods["sendMessage"]
+    calls = 0
+
+    async def limited_once(data):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            return fake._error(429, "Too Many Requests: retry after 1", {"retry_after": 1})
+        return await send(data)
+
+    fake._methods["sendMessage"] = limited_once
+    start = time.monotonic()
+    await telegram.send_message(100, "hello", silent_mode=True)
+
+    assert time.monotonic() - start >= 0.9
+    assert fake.requests["sendMessage"] == 2
+    assert [message["text"] for message in fake.messages] == ["hello"]
+    assert telegram.rate_limiter.stats()["rate_limited_responses"] == 1
+
+
+async def test_gives_up_after_max_429_retries(telegram, fake, monkeypatch):
+    monkeypatch.setattr(telegram_handler, "MAX_RATE_LIMIT_RETRIES", 1)
+    fake.error_rate_429 = 1.0
+    with pytest.raises(Exception):
+        await telegram.send_message(100, "hello", silent_mode=True)
+    assert fake.requests["sendMessage"] == 2
+
+
+def test_combine_stats_of_two_limiters():
+    a = {"queue_length": 1, "max_queue_length": 4, "requests": 10, "delayed_requests": 2, "total_wait_seconds": 1.0,
+         "max_wait_seconds": 0.8, "avg_wait_seconds": 0.5, "rate_limited_responses": 0}
+    b = {"queue_length": 0, "max_queue_length": 2, "requests": 5, "delayed_requests": 3, "total_wait_seconds": 2.0,
+         "max_wait_seconds": 1.5, "avg_wait_seconds": 0.667, "rate_limited_responses": 1}
+    assert combine_stats(a, b) == {
+        "queue_length": 1, "max_queue_length": 4, "requests": 15, "delayed_requests": 5, "total_wait_seconds": 3.0,
+        "max_wait_seconds": 1.5, "avg_wait_seconds": 0.6, "rate_limited_responses": 1,
+    }
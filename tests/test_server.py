@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+import telegram_handler
+from store import StateStore
+
+
+@pytest.fixture
+async def mcp(fake, state_path, monkeypatch):
+    """The server module with its lifespan running against the fake (no broker, outbox on)."""
+    monkeypatch.setattr(telegram_handler, "API_BASE_URL", f"{fake.base_url}/bot{fake.token}")
+    server.telegram._store = StateStore(state_path)
+    async with server.lifespan(server.mcp):
+        yield server
+
+
+def answer_questions(fake, answers: dict[int, str]):
+    """Makes the human answer the next question sent to each of these threads."""
+    async def on_message(message):
+        text = answers.pop(message["message_thread_id"], None)
+        if text is not None:
+            fake.user_reply(message["message_thread_id"], text)
+
+    fake.on_message = on_message
+
+
+# --- ask_human / check_reply / await_reply ---
+
+async def test_ticket_is_answered_later(mcp, fake):
+    ticket = await mcp.ask_human("100", "Which branch?")
+    assert json.loads(await mcp.check_reply(ticket))["status"] == "pending"
+
+    await mcp.outbox.drain(5)
+    assert fake.messages[-1]["text"] == "Which branch?"
+    fake.user_reply(100, "main")
+    result = json.loads(await mcp.await_reply(ticket, timeout_s=5))
+    assert result["status"] == "answered" and result["reply"] == "main"
+    # Collected: the ticket is closed
+    assert json.loads(await mcp.check_reply(ticket))["status"] == "unknown"
+
+
+async def test_await_reply_times_out_and_keeps_the_ticket(mcp, fake):
+    ticket = await mcp.ask_human("100", "Ready?", options=["Yes", "No"])
+    assert json.loads(await mcp.await_reply(ticket, timeout_s=0.2))["status"] == "pending"
+
+    await mcp.outbox.drain(5)
+    fake.user_press(fake.messages[-1]["message_id"], "Yes")
+    assert json.loads(await mcp.await_reply(ticket, timeout_s=5))["reply"] == "Yes"
+
+
+async def test_unknown_ticket(mcp):
+    assert json.loads(await mcp.await_reply("nope", timeout_s=0))["status"] == "unknown"
+
+
+async def test_question_that_could_not_be_sent_fails_the_ticket(mcp, fake):
+    fake.closed_topics.add(100)
+    ticket = await mcp.ask_human("100", "Anyone?")
+    result = json.loads(await mcp.await_reply(ticket, timeout_s=5))
+    assert result["status"] == "failed" and "400" in result["error"]
+
+
+async def test_question_cancelled_by_the_outbox(mcp):
+    delivery = asyncio.get_running_loop().create_future()
+    delivery.cancel()
+    with pytest.raises(Exception, match="not sent"):
+        await mcp._wait_for_answer(100, delivery, silent_mode=True)
+
+
+async def test_reply_after_the_deadline_is_kept(mcp, fake):
+    assert await mcp.ask_human_and_wait("100", "Quick?", silent_mode=True, timeout_s=0.3) == "No reply within 0.3 seconds"
+    fake.user_reply(100, "late answer")
+    assert await mcp.ask_human_and_wait("100", "Still there?", silent_mode=True, timeout_s=5) == "late answer"
+
+
+# --- ask_many_and_wait ---
+
+async def test_quorum_returns_once_enough_have_answered(mcp, fake):
+    answer_questions(fake, {100: "yes", 102: "no"})
+    result = json.loads(await mcp.ask_many_and_wait(["100", "101", "102"], "Ship it?", mode="quorum", quorum=2, timeout_s=5))
+    assert result == {"answers": {"100": "yes", "102": "no"}, "pending": ["101"], "errors": {}}
+    assert sorted(message["message_thread_id"] for message in fake.messages) == [100, 101, 102]
+
+
+async def test_first_answer_wins(mcp, fake):
+    answer_questions(fake, {101: "me"})
+    result = json.loads(await mcp.ask_many_and_wait(["100", "101"], "Who takes it?", mode="first", timeout_s=5))
+    assert result["answers"] == {"101": "me"} and result["pending"] == ["100"]
+
+
+async def test_timeout_returns_what_arrived(mcp, fake):
+    answer_questions(fake, {100: "done"})
+    result = json.loads(await mcp.ask_many_and_wait(["100", "101"], "Status?", mode="all", timeout_s=0.5))
+    assert result == {"answers": {"100": "done"}, "pending": ["101"], "errors": {}}
+
+    # The late reply is kept for the next wait in its topic
+    fake.user_reply(101, "late")
+    assert await mcp.ask_human_and_wait("101", "Still there?", silent_mode=True, timeout_s=5) == "late"
+
+
+async def test_failed_topics_count_against_the_quorum(mcp, fake):
+    fake.closed_topics.add(101)
+    answer_questions(fake, {100: "ok"})
+    result = json.loads(await mcp.ask_many_and_wait(["100", "101"], "Go?", mode="all", timeout_s=5))
+    assert result["answers"] == {"100": "ok"}
+    assert list(result["errors"]) == ["101"] and result["pending"] == []
+
+
+@pytest.mark.parametrize("mode, quorum", [("most", None), ("quorum", None)])
+async def test_rejects_bad_modes(mcp, mode, quorum):
+    assert (await mcp.ask_many_and_wait(["100"], "?", mode=mode, quorum=quorum)).startswith("Error asking humans")
@@ -0,0 +1,69 @@
+import sqlite3
+
+from store import StateStore, OutboxQueue
+
+
+def message(update_id: int, thread_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {"message_thread_id": thread_id, "text": text}}
+
+
+def test_offset_and_journal_survive_reopening(state_path):
+    store = StateStore(state_path)
+    assert store.get_offset() is None
+    store.record_updates([(message(1, 100, "a"), 100), (message(2, 101, "b"), 101), (message(3, 100, "c"), 100)], offset=4)
+    store.close()
+
+    store = StateStore(state_path)
+    assert store.get_offset() == 4
+    update_id, update = store.next_reply(100)
+    assert update == message(1, 100, "a")
+    assert store.consume(update_id)
+    # Taken by another waiter already
+    assert not store.consume(update_id)
+    assert store.next_reply(100)[1]["message"]["text"] == "c"
+
+    store.release(update_id)
+    assert store.next_reply(100)[0] == update_id
+    store.close()
+
+
+def test_recording_an_update_twice_keeps_one(state_path):
+    store = StateStore(state_path)
+    store.record_updates([(message(1, 100, "a"), 100)], offset=2)
+    store.record_updates([(message(1, 100, "a"), 100)], offset=2)
+    assert store.consume(1)
+    assert store.next_reply(100) is None
+    store.close()
+
+
+def test_prune_drops_old_entries_read_or_not(state_path):
+    store = StateStore(state_path)
+    store.record_updates([(message(1, 100, "read"), 100), (message(2, 100, "unread"), 100)])
+    store.consume(1)
+    store.conn.execute("UPDATE journal SET ts = ts - 3600")
+    store.record_updates([(message(3, 100, "recent"), 100)])
+
+    store.prune(retention=60)
+    assert store.next_reply(100)[0] == 3
+    assert store.conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0] == 1
+    store.close()
+
+
+def test_adds_new_columns_to_an_old_database(state_path):
+    conn = sqlite3.connect(state_path)
+    conn.execute(
+        "CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, thread_id INTEGER NOT NULL, created REAL NOT NULL, "
+        "payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+        "next_attempt REAL NOT NULL DEFAULT 0, last_error TEXT)"
+    )
+    conn.execute("INSERT INTO outbox (thread_id, created, payload) VALUES (100, 0, '{\"text\": \"old\"}')")
+    conn.commit()
+    conn.close()
+
+    store = StateStore(state_path)
+    queue = OutboxQueue(store)
+    # Queued before the upgrade and never leased: adopted like any orphan
+    assert queue.adopt("me", 60.0) == 1
+    entry_id, payload, attempts, next_attempt, sent_chunks = queue.next_for(100, "me")
+    assert payload == {"text": "old"} and sent_chunks == 0
+    store.close()
@@ -0,0 +1,67 @@
+import pytest
+
+from metrics import html_checked
+
+
+async def test_long_message_is_split_with_buttons_on_the_last_part(telegram, fake):
+    text = "\n".join(f"**step {i}**: " + "x" * 80 for i in range(150))
+    await telegram.send_message(100, text, buttons=["Done"], silent_mode=True)
+
+    assert len(fake.messages) > 1
+    assert all(len(message["text"]) <= 4096 for message in fake.messages)
+    assert [("reply_markup" in message) for message in fake.messages] == [False] * (len(fake.messages) - 1) + [True]
+
+
+async def test_rejected_plain_text_is_not_sent_again(telegram, fake):
+    with pytest.raises(Exception):
+        await telegram.send_message(100, "", parse_mode=None, silent_mode=True)
+    assert fake.requests["sendMessage"] == 1
+
+
+async def test_rejected_html_is_resent_as_plain_text(telegram, fake):
+    send = fake._methods["sendMessage"]
+
+    async def reject_entities(data):
+        if data.get("parse_mode"):
+            return fake._error(400, "Bad Request: can't parse entities")
+        return await send(data)
+
+    fake._methods["sendMessage"] = reject_entities
+    await telegram.send_message(100, "**bold**", silent_mode=True)
+    assert fake.requests["sendMessage"] == 2
+    assert fake.messages[-1]["text"] == "**bold**"
+
+
+async def test_topics_are_reused_by_name(make_handler, fake):
+    telegram = make_handler()
+    thread_id = await telegram.create_forum_topic("task")
+    assert await telegram.create_forum_topic("task") == thread_id
+    # Kept in the state database, so another process (or a restart) finds it too
+    assert await make_handler().create_forum_topic("task") == thread_id
+    assert fake.requests["createForumTopic"] == 1
+
+    fresh = await telegram.create_forum_topic("task", reuse=False)
+    assert fresh != thread_id
+    assert await telegram.create_forum_topic("task") == fresh
+
+
+@pytest.mark.parametrize("gone", ["closed_topics", "deleted_topics"])
+async def test_a_closed_topic_is_replaced(telegram, fake, gone):
+    thread_id = await telegram.create_forum_topic("task")
+    getattr(fake, gone).add(thread_id)
+    with pytest.raises(Exception):
+        await telegram.send_message(thread_id, "hello", silent_mode=True)
+
+    new_thread_id = await telegram.create_forum_topic("task")
+    assert new_thread_id != thread_id
+    await telegram.send_message(new_thread_id, "hello", silent_mode=True)
+    assert fake.messages[-1]["message_thread_id"] == new_thread_id
+
+
+async def test_html_is_checked_locally_and_sent_once(telegram, fake):
+    before = html_checked.values.get((("outcome", "valid"),), 0)
+    await telegram.send_message(100, "**a_b** <not a tag> & `x < y`", silent_mode=True)
+
+    assert fake.requests["sendMessage"] == 1
+    assert fake.messages[-1]["text"] == "<b>a_b</b> &lt;not a tag&gt; &amp; <code>x &lt; y</code>"
+    assert html_checked.values[(("outcome", "valid"),)] == before + 1
@@ -0,0 +1,62 @@
+import gzip
+import os
+
+import pytest
+
+from uploads import PreparedUpload, file_digest, is_text_file
+
+
+@pytest.fixture
+def big_log(tmp_path):
+    path = tmp_path / "test-output.log"
+    path.write_text("".join(f"test_{i:05d} PASSED\n" for i in range(20000)))
+    return str(path)
+
+
+def test_large_text_files_are_gzipped(big_log):
+    with PreparedUpload(big_log, threshold=1024) as prepared:
+        assert prepared.compressed
+        assert prepared.file_name == "test-output.log.gz"
+        assert prepared.size < os.path.getsize(big_log) / 5
+        with gzip.open(prepared.path, "rb") as f:
+            assert f.read() == open(big_log, "rb").read()
+        tmp_path = prepared.path
+    assert not os.path.exists(tmp_path)
+
+
+def test_small_and_binary_files_are_sent_as_they_are(tmp_path, big_log):
+    binary = tmp_path / "core.bin"
+    binary.write_bytes(b"\0\1\2" * 10000)
+    assert not is_text_file(str(binary))
+    for path, threshold in [(str(binary), 1024), (big_log, 10 * 1024 * 1024)]:
+        with PreparedUpload(path, threshold=threshold) as prepared:
+            assert not prepared.compressed and prepared.path == path
+
+
+async def test_send_document_gzips_then_reuses_the_file_id(telegram, fake, big_log):
+    first = await telegram.send_document(100, big_log, caption="**full log**", silent_mode=True)
+    assert first["upload"] == "gzipped"
+    assert fake.uploads[0]["file_name"] == "test-output.log.gz"
+    assert fake.messages[-1]["caption"] == "<b>full log</b>"
+
+    # Same content in another topic: sent by file_id, not uploaded again
+    second = await telegram.send_document(101, big_log, silent_mode=True)
+    assert second["upload"] == "cached"
+    assert len(fake.uploads) == 1
+    assert second["document"]["file_id"] == first["document"]["file_id"]
+
+
+async def test_rejected_file_id_is_uploaded_again(telegram, fake, tmp_path):
+    path = tmp_path / "diff.patch"
+    path.write_text("+ added line\n")
+    telegram.uploads.register(file_digest(str(path)), "expired", "diff.patch", 13)
+
+    message = await telegram.send_document(100, str(path), silent_mode=True)
+    assert message["upload"] == "uploaded"
+    assert len(fake.uploads) == 1
+    assert telegram.uploads.lookup(file_digest(str(path)))[0] == message["document"]["file_id"]
+
+
+async def test_missing_file(telegram, tmp_path):
+    with pytest.raises(Exception, match="File not found"):
+        await telegram.send_document(100, str(tmp_path / "nope.log"))
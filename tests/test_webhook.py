@@ -0,0 +1,91 @@
+import json
+
+import httpx
+import pytest
+
+from telegram_handler import UpdateDispatcher
+from webhook import WebhookReceiver, SECRET_HEADER
+
+SECRET = "s3cret"
+
+
+def record_settings(fake) -> list[dict]:
+    """The setWebhook requests the fake receives from now on."""
+    settings = []
+    set_webhook = fake._methods["setWebhook"]
+
+    async def recording(data):
+        settings.append(data)
+        return await set_webhook(data)
+
+    fake._methods["setWebhook"] = recording
+    return settings
+
+
+@pytest.fixture
+async def receiver(telegram, fake):
+    settings = record_settings(fake)
+    # Nothing is polled in webhook mode
+    telegram._dispatcher = UpdateDispatcher(telegram, poll=False)
+    receiver = WebhookReceiver(telegram, telegram._dispatcher, url="https://example.com/telegram/hook",
+                               port=0, secret=SECRET)
+    receiver.settings = settings
+    await receiver.start()
+    yield receiver
+    await receiver.stop()
+
+
+async def post(receiver, body, secret: str = SECRET, path: str = "/telegram/hook") -> int:
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{receiver.server.url}{path}", content=body, headers={SECRET_HEADER: secret})
+    return response.status_code
+
+
+def update(fake, thread_id: int, text: str) -> dict:
+    """An update as Telegram would POST it (queued in the fake only to get it built)."""
+    update_id = fake.user_reply(thread_id, text)
+    return next(u for u in fake._updates if u["update_id"] == update_id)
+
+
+async def test_registers_and_removes_the_webhook(receiver, fake):
+    [setting] = receiver.settings
+    assert setting["url"] == "https://example.com/telegram/hook"
+    assert setting["secret_token"] == SECRET
+    # First run: what Telegram kept from before is dropped
+    assert setting["drop_pending_updates"] is True
+    assert receiver.telegram.store.get_offset() == 0
+
+    await receiver.stop()
+    assert fake.requests["deleteWebhook"] == 1
+
+
+async def test_journals_posted_updates(receiver, fake):
+    posted = update(fake, 100, "over the webhook")
+    assert await post(receiver, json.dumps(posted)) == 200
+
+    assert receiver.telegram.store.get_offset() == posted["update_id"] + 1
+    assert await receiver.telegram.wait_for_reply(100, silent_mode=True) == "over the webhook"
+    # A retry of the same update by Telegram is not journaled twice
+    assert await post(receiver, json.dumps(posted)) == 200
+    assert receiver.telegram.store.next_reply(100) is None
+
+
+@pytest.mark.parametrize("body, secret, path, status", [
+    ("{}", "wrong", "/telegram/hook", 403),
+    ('{"update_id": 1}', SECRET, "/other", 404),
+    ("not json", SECRET, "/telegram/hook", 400),
+    ('{"message": {}}', SECRET, "/telegram/hook", 400),
+])
+async def test_rejects_bad_requests(receiver, body, secret, path, status):
+    assert await post(receiver, body, secret, path) == status
+    assert receiver.telegram.store.get_offset() == 0
+
+
+async def test_restart_keeps_pending_updates(make_handler, fake):
+    telegram = make_handler()
+    telegram.store.record_updates([], offset=5)
+    receiver = WebhookReceiver(telegram, UpdateDispatcher(telegram, poll=False), url="https://example.com/hook", port=0)
+    settings = record_settings(fake)
+    await receiver.start()
+    await receiver.stop()
+    assert settings[0]["drop_pending_updates"] is False
@@ -0,0 +1,86 @@
+"""
+Sends text to a Telegram topic from the command line, without starting the MCP server.
+
+Usage:
+  python tg_send.py --thread 42 "Build finished"
+  tail -f build.log | python tg_send.py --topic "CI logs" --plain
+  python tg_send.py --thread 42 --file pytest.log
+
+Lines from stdin or a file are streamed as they arrive: they are batched into as few
+messages as possible (sent when a message is full or --interval seconds after its first
+line) over one pooled connection. Exits with status 1 if any message could not be sent.
+"""
+import sys
+import asyncio
+import argparse
+import threading
+from telegram_handler import TelegramHandler
+from broker import BrokerClient
+from log_buffer import LogBuffer, LOG_MAX_CHARS, LOG_FLUSH_INTERVAL
+
+
+def _read_lines(stream, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+    """Feeds lines from a blocking stream into the queue; None marks the end."""
+    try:
+        for line in stream:
+            loop.call_soon_threadsafe(queue.put_nowait, line.rstrip("\r\n"))
+    finally:
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--thread", type=int, help="thread_id of an existing topic")
+    target.add_argument("--topic", help="task name of the topic (reused if it exists, created otherwise)")
+    parser.add_argument("message", nargs="*", help="text to send; read from --file or stdin if omitted")
+    parser.add_argument("--file", help="send the lines of this file instead of stdin")
+    parser.add_argument("--plain", action="store_true", help="send as plain text instead of converting Markdown")
+    parser.add_argument("--interval", type=float, default=LOG_FLUSH_INTERVAL, help="seconds to wait for more lines before sending")
+    parser.add_argument("--max-chars", type=int, default=LOG_MAX_CHARS, help="characters per message")
+    args = parser.parse_args()
+
+    telegram = TelegramHandler()
+    # Go through a running broker so its rate limiter covers these messages too (never start one for a one-off send)
+    telegram.broker = await BrokerClient.connect(telegram, spawn=False)
+    failures = 0
+
+    async def send(thread_id: int, text: str):
+        nonlocal failures
+        try:
+            await telegram.send_message(thread_id, text, parse_mode=None if args.plain else "HTML", silent_mode=True)
+        except Exception as e:
+            failures += 1
+            print(f"Failed to send message: {e}", file=sys.stderr)
+
+    buffer = LogBuffer(send, max_chars=args.max_chars, flush_interval=args.interval)
+    try:
+        thread_id = args.thread if args.thread is not None else await telegram.create_forum_topic(args.topic)
+
+        if args.message:
+            await buffer.add(thread_id, " ".join(args.message))
+        else:
+            # A reader thread keeps blocking reads (e.g. `tail -f`) off the event loop
+            stream = open(args.file, encoding="utf-8", errors="replace") if args.file else sys.stdin
+            loop = asyncio.get_running_loop()
+            queue = asyncio.Queue()
+            threading.Thread(target=_read_lines, args=(stream, loop, queue), daemon=True).start()
+            while (line := await queue.get()) is not None:
+                if line.strip():
+                    await buffer.add(thread_id, line)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    finally:
+        # Also runs on Ctrl-C, so the last batch of a `tail -f` still goes out
+        await buffer.flush_all()
+        await telegram.close()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main()))
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,79 @@
+import time
+import asyncio
+import secrets
+from collections import OrderedDict
+
+# Tickets nobody collects are dropped after this long, or when there are too many
+TICKET_TTL_SECONDS = 24 * 3600
+MAX_TICKETS = 1000
+
+
+class Ticket:
+    """One question waiting for a reply in the background."""
+
+    def __init__(self, ticket_id: str, thread_id: int, question: str, task: asyncio.Task):
+        self.id = ticket_id
+        self.thread_id = thread_id
+        self.question = question
+        self.task = task
+        self.created = time.time()
+
+    def status(self) -> dict:
+        """{"status": "pending" | "answered" | "failed", ...} for the tool's JSON result."""
+        result = {"ticket": self.id, "thread_id": self.thread_id}
+        if not self.task.done():
+            result["status"] = "pending"
+            result["waiting_seconds"] = round(time.time() - self.created, 1)
+        elif self.task.cancelled():
+            result["status"] = "failed"
+            result["error"] = "cancelled"
+        elif self.task.exception() is not None:
+            result["status"] = "failed"
+            result["error"] = str(self.task.exception())
+        else:
+            result["status"] = "answered"
+            result["reply"] = self.task.result()
+        return result
+
+
+class TicketBook:
+    """
+    Open tickets by id, oldest first. A ticket's waiter takes the next reply in its
+    thread like any other waiter; collecting an answered ticket removes it.
+    """
+
+    def __init__(self, ttl: float = TICKET_TTL_SECONDS, max_tickets: int = MAX_TICKETS):
+        self.ttl = ttl
+        self.max_tickets = max_tickets
+        self._tickets: OrderedDict[str, Ticket] = OrderedDict()
+
+    def open(self, thread_id: int, question: str, waiter) -> Ticket:
+        """Starts `waiter` (a coroutine returning the reply) in the background and returns its ticket."""
+        self._expire()
+        ticket = Ticket(secrets.token_hex(4), thread_id, question, asyncio.ensure_future(waiter))
+        self._tickets[ticket.id] = ticket
+        return ticket
+
+    def get(self, ticket_id: str):
+        return self._tickets.get(ticket_id)
+
+    def close(self, ticket_id: str):
+        """Forgets a ticket, cancelling its waiter if it is still waiting (the reply stays in the journal)."""
+        ticket = self._tickets.pop(ticket_id, None)
+        if ticket and not ticket.task.done():
+            ticket.task.cancel()
+
+    def close_all(self):
+        for ticket_id in list(self._tickets):
+            self.close(ticket_id)
+
+    def pending(self) -> int:
+        return sum(1 for ticket in self._tickets.values() if not ticket.task.done())
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        while self._tickets:
+            ticket_id, ticket = next(iter(self._tickets.items()))
+            if ticket.created >= cutoff and len(self._tickets) < self.max_tickets:
+                break
+            self.close(ticket_id)
@@ -0,0 +1,81 @@
+import os
+import gzip
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+
+# Text files larger than this many bytes are gzipped before upload (0 = never)
+TELEGRAM_GZIP_THRESHOLD = int(os.getenv("TELEGRAM_GZIP_THRESHOLD", str(256 * 1024)))
+
+# Telegram refuses documents above 50 MB from bots
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+# Extensions mimetypes doesn't know as text but agents produce all the time
+_TEXT_EXTENSIONS = {".log", ".diff", ".patch", ".md", ".json", ".jsonl", ".yaml", ".yml", ".toml", ".ini", ".cfg", ".out"}
+
+
+def file_digest(path: str) -> str:
+    """sha256 of the file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_text_file(path: str) -> bool:
+    """Guesses from the name, then by looking for NUL bytes in the first chunk."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".gz":
+        return False
+    mime, _ = mimetypes.guess_type(path)
+    if extension in _TEXT_EXTENSIONS or (mime and mime.startswith("text/")):
+        return True
+    with open(path, "rb") as f:
+        head = f.read(CHUNK_SIZE)
+    return bool(head) and b"\0" not in head
+
+
+class PreparedUpload:
+    """
+    A file ready for sendDocument: the path to stream from (the original file, or a
+    gzipped temporary copy) and the name Telegram shows. Use as a context manager so
+    the temporary copy is removed afterwards.
+    """
+
+    def __init__(self, path: str, threshold: int = TELEGRAM_GZIP_THRESHOLD):
+        self.source = path
+        self.path = path
+        self.file_name = os.path.basename(path)
+        self.compressed = False
+
+        if threshold and os.path.getsize(path) > threshold and is_text_file(path):
+            self.path = self._gzip(path)
+            self.file_name += ".gz"
+            self.compressed = True
+        self.size = os.path.getsize(self.path)
+
+    @staticmethod
+    def _gzip(path: str) -> str:
+        """Compresses the file into a temporary file, streaming, and returns its path."""
+        fd, tmp_path = tempfile.mkstemp(prefix="telegram-upload-", suffix=".gz")
+        try:
+            with os.fdopen(fd, "wb") as raw, open(path, "rb") as src, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.compressed:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import asyncio
 from dotenv import load_dotenv
 
 # Load env vars from current directory (where .env was created by install.py)
@@ -10,13 +11,14 @@ load_dotenv()
 sys.path.append(os.getcwd())
 
 try:
+    import server
     from server import init_task_session, broadcast_log
     print("✅ Successfully imported server module.")
 except ImportError as e:
     print(f"❌ Failed to import server: {e}")
     sys.exit(1)
 
-def verify_server():
+async def verify_server():
     print("--- Verifying Server Functionality ---")
     
     # Check Env Vars
@@ -29,10 +31,15 @@ def verify_server():
 
     print(f"✅ Loaded configuration (Token: ...{token[-5:]}, Group: {group_id})")
 
+    # Run the checks the way the MCP server runs tools, with the outbox (or broker) started
+    async with server.lifespan(server.mcp):
+        await run_checks()
+
+async def run_checks():
     # Test 1: Init Session
     print("1. Testing init_task_session...")
     try:
-        thread_id = init_task_session("Installation Verification")
+        thread_id = await init_task_session("Installation Verification")
         print(f"   ✅ Success! Created topic with Thread ID: {thread_id}")
     except Exception as e:
         print(f"   ❌ Failed to create session: {e}")
@@ -41,10 +48,23 @@ def verify_server():
     # Test 2: Broadcast
     print("2. Testing broadcast_log...")
     try:
-        res = broadcast_log(thread_id, "Installation verified successfully by Antigravity Agent.")
+        res = await broadcast_log(thread_id, "Installation verified successfully by Antigravity Agent.")
+        if res.startswith("Error"):
+            print(f"   ❌ {res}")
+            return
         print(f"   ✅ Broadcast result: {res}")
     except Exception as e:
         print(f"   ❌ Failed to broadcast: {e}")
+        return
+
+    # A queued log only counts once Telegram has it
+    if server.outbox:
+        left = await server.outbox.drain(30)
+        stats = server.outbox.stats()
+        if left or stats["failed_sends"]:
+            print(f"   ❌ Log was not delivered (see get_outbox_status): {stats}")
+        else:
+            print("   ✅ Log delivered to Telegram")
 
 if __name__ == "__main__":
-    verify_server()
+    asyncio.run(verify_server())
@@ -0,0 +1,71 @@
+import os
+import sys
+import hmac
+import json
+import secrets
+from urllib.parse import urlparse
+from local_http import HttpServer
+
+# Public HTTPS URL Telegram should POST updates to (e.g. a reverse proxy or tunnel to the local receiver)
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_HOST = os.getenv("TELEGRAM_WEBHOOK_HOST", "127.0.0.1")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+# Checked against the X-Telegram-Bot-Api-Secret-Token header; a random one is used if unset
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class WebhookReceiver:
+    """
+    Receives Telegram updates over HTTP instead of long polling.
+    Registers itself with setWebhook on start and calls deleteWebhook on stop.
+    Each update is handed to the dispatcher, i.e. the same journal and wake-up path
+    the poller uses, and Telegram only gets its 200 once the update is journaled.
+    """
+
+    def __init__(self, telegram, dispatcher, url: str = TELEGRAM_WEBHOOK_URL, host: str = TELEGRAM_WEBHOOK_HOST,
+                 port: int = TELEGRAM_WEBHOOK_PORT, secret: str = TELEGRAM_WEBHOOK_SECRET):
+        if not url:
+            raise ValueError("TELEGRAM_WEBHOOK_URL is required in webhook mode")
+
+        self.telegram = telegram
+        self.dispatcher = dispatcher
+        self.url = url
+        self.path = urlparse(url).path or "/"
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.server = HttpServer(self._handle, host, port)
+
+    async def start(self):
+        await self.server.start()
+        print(f"Webhook receiver listening on {self.server.url}{self.path}", file=sys.stderr)
+        # On a first run (no update ever journaled) the updates Telegram kept from before are old chatter
+        first_run = self.telegram.store.get_offset() is None
+        await self.telegram.set_webhook(self.url, self.secret, drop_pending_updates=first_run)
+        if first_run:
+            self.telegram.store.record_updates([], offset=0)
+
+    async def stop(self):
+        try:
+            await self.telegram.delete_webhook()
+        except Exception as e:
+            print(f"Error deleting webhook: {e}", file=sys.stderr)
+        await self.server.stop()
+
+    async def _handle(self, method: str, path: str, headers: dict, body: bytes):
+        if path.split("?", 1)[0] != self.path:
+            return 404, b"", "text/plain"
+        if method != "POST":
+            return 405, b"", "text/plain"
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret):
+            return 403, b"", "text/plain"
+
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400, b"", "text/plain"
+        if not isinstance(update, dict) or "update_id" not in update:
+            return 400, b"", "text/plain"
+
+        self.dispatcher.dispatch([update], offset=update["update_id"] + 1)
+        return 200, b"{}", "application/json"